@@ -0,0 +1,32 @@
+"""Add WebSocket quota overrides to user_settings
+
+Revision ID: 4c1d7e9a2b60
+Revises: b3cd3462a4b1
+Create Date: 2026-10-19 09:12:41.208316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1d7e9a2b60'
+down_revision: Union[str, Sequence[str], None] = 'b3cd3462a4b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('user_settings', sa.Column('ws_max_sockets', sa.Integer(), nullable=True))
+    op.add_column('user_settings', sa.Column('ws_max_symbols_per_socket', sa.Integer(), nullable=True))
+    op.add_column('user_settings', sa.Column('ws_max_symbols', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('user_settings', 'ws_max_symbols')
+    op.drop_column('user_settings', 'ws_max_symbols_per_socket')
+    op.drop_column('user_settings', 'ws_max_sockets')
@@ -1,8 +1,17 @@
+import logging
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional, Dict, List, Any
 from app.auth import get_current_user
 from app.models.user import User
-from app.services.alpaca import fetch_bars_from_alpaca, fetch_market_calendar
+from app.services.alpaca import fetch_bars_from_alpaca, fetch_latest_from_alpaca, fetch_market_calendar
+from app.services.analytics import get_correlation
+from app.websocket.real_time_trades import alpaca_ws_manager
+
+MAX_ANALYTICS_SYMBOLS = 50
+MAX_LATEST_SYMBOLS = 200
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/data", tags=["data"])
 
@@ -37,6 +46,65 @@ async def get_historical_bars(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch bars: {e}")
 
+@router.get("/analytics/correlation", response_model=Dict[str, Any])
+async def get_correlation_matrix(
+    symbols: str = Query(..., description="Comma-separated symbols"),
+    start: datetime = Query(..., description="Start datetime in ISO format"),
+    end: datetime = Query(..., description="End datetime in ISO format"),
+    timeframe: str = Query("1Min", description="Bar resolution (e.g. 1Min)"),
+    window: int = Query(30, ge=2, le=10000, description="Rolling volatility window in bars"),
+    current_user: User = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """
+    Align cached close series for the given symbols and return log-return statistics,
+    rolling volatility and the correlation matrix.
+    """
+    symbol_list = sorted({s.strip().upper() for s in symbols.split(",") if s.strip()})
+    if len(symbol_list) < 2:
+        raise HTTPException(status_code=400, detail="At least two symbols are required")
+    if len(symbol_list) > MAX_ANALYTICS_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ANALYTICS_SYMBOLS} symbols are allowed")
+    if start.tzinfo is None or end.tzinfo is None:
+        raise HTTPException(status_code=400, detail="start and end must include a timezone")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    try:
+        return await get_correlation(symbol_list, start, end, timeframe=timeframe, window=window)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute correlation: {e}")
+
+@router.get("/latest", response_model=Dict[str, Any])
+async def get_latest(
+    symbols: str = Query(..., description="Comma-separated symbols"),
+    current_user: User = Depends(get_current_user),
+) -> Dict[str, Any]:
+    """
+    Last trade and bar for each symbol. Symbols this worker streams are served
+    from memory; the rest (in shared stream mode, a follower only streams its
+    own clients' symbols) are looked up with one Alpaca latest-data request, so
+    every worker gives the same answer. Values are null only if that lookup
+    fails or Alpaca has none.
+    """
+    symbol_list = list(dict.fromkeys(s.strip().upper() for s in symbols.split(",") if s.strip()))
+    if not symbol_list:
+        raise HTTPException(status_code=400, detail="At least one symbol is required")
+    if len(symbol_list) > MAX_LATEST_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_LATEST_SYMBOLS} symbols are allowed")
+    latest = alpaca_ws_manager.last_values.latest(symbol_list)
+    misses = [symbol for symbol, value in latest.items() if value["trade"] is None or value["bar"] is None]
+    if misses:
+        try:
+            fetched = await fetch_latest_from_alpaca(misses)
+        except Exception as e:
+            logger.warning("Latest-data lookup failed for %s: %s", ",".join(misses), e)
+        else:
+            for symbol in misses:
+                for kind in ("trade", "bar"):
+                    if latest[symbol][kind] is None:
+                        latest[symbol][kind] = fetched[symbol][kind]
+    return latest
+
 @router.get("/market/calendar")
 async def get_market_calendar(
     start: str = Query(..., description="Start date in YYYY-MM-DD"),
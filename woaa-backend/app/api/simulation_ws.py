@@ -2,46 +2,61 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.auth import get_current_user_ws
 from app.database import async_session_maker
 from app.models.user_setting import UserSetting
+from app.websocket.session import OverflowPolicy, WebSocketSession, policy_from_env
 from sqlalchemy.future import select
-import json
 import asyncio
 
 router = APIRouter()
 
+# Only the latest sim time matters, so a lagging client gets it coalesced.
+SIM_TIME_WS_OVERFLOW = policy_from_env("SIM_TIME_WS_OVERFLOW", OverflowPolicy.COALESCE)
+
+
+async def _publish_sim_time(session: WebSocketSession, user_id):
+    while True:
+        try:
+            async with async_session_maker() as db:
+                result = await db.execute(
+                    select(UserSetting.sim_time).where(UserSetting.user_id == user_id)
+                )
+                sim_time = result.scalar_one_or_none()
+
+            if sim_time is None:
+                session.send({"error": "No sim_time found"}, key="sim_time")
+            else:
+                session.send({"sim_time": sim_time.isoformat()}, key="sim_time")
+
+        except Exception as e:
+            print(f"[WebSocket] Database error for user_id={user_id}: {e}")
+            session.send({"error": "Database error"}, key="sim_time")
+
+        await asyncio.sleep(1)  # stream every second
+
+
 @router.websocket("/ws/simulation/time")
 async def stream_sim_time(websocket: WebSocket):
-    print("hahaha")
     user = None
+    session = WebSocketSession(websocket, "simulation_time", policy=SIM_TIME_WS_OVERFLOW)
+    publisher = None
     try:
         # Authenticate user before accepting connection
         user = await get_current_user_ws(websocket)
         await websocket.accept()
-        
+
+        session.start()
+        publisher = asyncio.create_task(_publish_sim_time(session, user.id))
+
+        # Reader: clients only answer heartbeats, but this notices disconnects
+        # (and reaped, silent clients) right away.
         while True:
-            try:
-                async with async_session_maker() as session:
-                    result = await session.execute(
-                        select(UserSetting.sim_time).where(UserSetting.user_id == user.id)
-                    )
-                    sim_time = result.scalar_one_or_none()
-
-                if sim_time is None:
-                    await websocket.send_text(json.dumps({"error": "No sim_time found"}))
-                else:
-                    await websocket.send_text(json.dumps({"sim_time": sim_time.isoformat()}))
-
-                await asyncio.sleep(1)  # stream every second
-                
-            except Exception as e:
-                print(f"[WebSocket] Database error for user_id={user.id}: {e}")
-                await websocket.send_text(json.dumps({"error": "Database error"}))
-                await asyncio.sleep(1)  # continue after error
+            await session.receive_text()
 
     except WebSocketDisconnect:
         print(f"[WebSocket] Disconnected: user_id={getattr(user, 'id', 'unknown')}")
     except Exception as e:
         print(f"[WebSocket] Authentication or connection error: {e}")
-        try:
-            await websocket.close(code=1008)  # Policy violation
-        except Exception:
-            pass  # Connection might already be closed
+        await session.close(code=1008)  # Policy violation
+    finally:
+        if publisher is not None:
+            publisher.cancel()
+        await session.finish()
@@ -1,6 +1,6 @@
 """
 API routes for managing user settings.
-Admins can update any user's settings.
+Admins can update any user's settings, including their WebSocket quotas.
 """
 
 from datetime import datetime
@@ -9,10 +9,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from app.database import get_db
-from app.schemas.user_setting import UserSettingUpdate, UserSettingOut
+from app.schemas.user_setting import UserSettingUpdate, UserSettingOut, WebSocketQuotaOut, WebSocketQuotaUpdate
 from app.services import user_setting as service
 from app.auth import get_current_user, get_current_admin_user
 from app.models.user import User
+from app.websocket.bar_dispatcher import bar_dispatcher
+from app.websocket.quotas import QuotaLimits, websocket_quotas
 
 router = APIRouter(prefix="/user-settings", tags=["user-settings"])
 
@@ -46,6 +48,7 @@ async def set_my_speed(
     setting.speed = speed
     await db.commit()
     await db.refresh(setting)
+    bar_dispatcher.invalidate_clock(current_user.id)
 
     return setting
 
@@ -66,6 +69,7 @@ async def set_my_pause(
     setting.paused = paused
     await db.commit()
     await db.refresh(setting)
+    bar_dispatcher.invalidate_clock(current_user.id)
 
     return setting
 
@@ -92,6 +96,7 @@ async def set_my_start_time(
     setting.sim_time = parsed_start
     await db.commit()
     await db.refresh(setting)
+    bar_dispatcher.invalidate_clock(current_user.id)
 
 
     return setting
@@ -122,5 +127,52 @@ async def update_settings(
     """
     Update user settings (admin-only access).
     """
-    return await service.update_user_setting(db, user_id, updates)
+    setting = await service.update_user_setting(db, user_id, updates)
+    bar_dispatcher.invalidate_clock(user_id)
+    return setting
+
+
+def _quota_out(setting) -> WebSocketQuotaOut:
+    return WebSocketQuotaOut(
+        user_id=setting.user_id,
+        max_sockets=setting.ws_max_sockets,
+        max_symbols_per_socket=setting.ws_max_symbols_per_socket,
+        max_symbols=setting.ws_max_symbols,
+        effective=QuotaLimits.from_setting(setting).as_dict(),
+    )
+
+
+@router.get("/{user_id}/ws-quota", response_model=WebSocketQuotaOut)
+async def get_ws_quota(
+    user_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    Get a user's WebSocket quota overrides and effective limits (admin-only access).
+    Limits are enforced per worker process, and `sockets` applies to each
+    streaming endpoint separately.
+    """
+    setting = await service.get_user_setting(db, user_id)
+    if not setting:
+        raise HTTPException(status_code=404, detail="Settings not found")
+    return _quota_out(setting)
 
+
+@router.put("/{user_id}/ws-quota", response_model=WebSocketQuotaOut)
+async def update_ws_quota(
+    user_id: UUID,
+    updates: WebSocketQuotaUpdate,
+    db: AsyncSession = Depends(get_db),
+    admin_user: User = Depends(get_current_admin_user)
+):
+    """
+    Set a user's WebSocket quota overrides (admin-only access). Limits are
+    enforced per worker process, and `sockets` applies to each streaming
+    endpoint separately. The change applies right away to the user's open
+    sockets on the worker serving this request (subscriptions already held
+    are kept), and to new sockets everywhere.
+    """
+    setting = await service.update_ws_quota(db, user_id, updates)
+    websocket_quotas.set_limits(user_id, QuotaLimits.from_setting(setting))
+    return _quota_out(setting)
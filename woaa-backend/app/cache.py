@@ -0,0 +1,258 @@
+"""
+In-memory cache for historical market data.
+
+Closed bars never change, so every range fetched from Alpaca is kept per
+(symbol, timeframe, feed) and later requests only go upstream for the gaps
+that have not been seen yet. Symbols whose gaps overlap are fetched
+together in one multi-symbol request.
+"""
+
+import asyncio
+import bisect
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.services.alpaca import fetch_bars_from_alpaca
+
+MAX_SERIES = int(os.getenv("BAR_CACHE_MAX_SERIES", "512"))
+MAX_BARS_PER_SERIES = int(os.getenv("BAR_CACHE_MAX_BARS", "200000"))
+# Bars newer than this may still be revised (or are not yet published on the
+# free IEX feed), so they are returned but never marked as covered.
+SETTLE_DELAY = timedelta(minutes=int(os.getenv("BAR_CACHE_SETTLE_MINUTES", "16")))
+
+Bar = Dict[str, Any]
+Interval = Tuple[datetime, datetime]
+
+
+def parse_bar_time(value: str) -> datetime:
+    """
+    Parse an Alpaca bar timestamp (e.g. "2024-01-03T14:30:00Z") into an aware datetime.
+    """
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class _Series:
+    """
+    Sorted bars for one (symbol, timeframe, feed) plus the time ranges already fetched.
+    Coverage intervals are inclusive, sorted and non-overlapping.
+    """
+
+    __slots__ = ("times", "bars", "covered")
+
+    def __init__(self) -> None:
+        self.times: List[datetime] = []
+        self.bars: List[Bar] = []
+        self.covered: List[List[datetime]] = []
+
+    def missing(self, start: datetime, end: datetime) -> List[Interval]:
+        gaps: List[Interval] = []
+        cursor = start
+        for lo, hi in self.covered:
+            if hi < cursor:
+                continue
+            if lo > end:
+                break
+            if lo > cursor:
+                gaps.append((cursor, lo))
+            cursor = hi
+            if cursor >= end:
+                return gaps
+        gaps.append((cursor, end))
+        return gaps
+
+    def mark_covered(self, start: datetime, end: datetime) -> None:
+        if end < start:
+            return
+        merged: List[List[datetime]] = []
+        placed = False
+        for lo, hi in self.covered:
+            if hi < start:
+                merged.append([lo, hi])
+            elif lo > end:
+                if not placed:
+                    merged.append([start, end])
+                    placed = True
+                merged.append([lo, hi])
+            else:
+                start, end = min(lo, start), max(hi, end)
+        if not placed:
+            merged.append([start, end])
+        self.covered = merged
+
+    def insert(self, bars: Iterable[Bar]) -> None:
+        incoming = [(parse_bar_time(bar["t"]), bar) for bar in bars]
+        if not incoming:
+            return
+        incoming.sort(key=lambda item: item[0])
+
+        # Fast path: the new bars continue the series (the common streaming case).
+        if not self.times or incoming[0][0] > self.times[-1]:
+            for ts, bar in incoming:
+                if not self.times or ts > self.times[-1]:
+                    self.times.append(ts)
+                    self.bars.append(bar)
+        else:
+            merged = dict(zip(self.times, self.bars))
+            merged.update(incoming)
+            ordered = sorted(merged.items(), key=lambda item: item[0])
+            self.times = [ts for ts, _ in ordered]
+            self.bars = [bar for _, bar in ordered]
+
+        overflow = len(self.times) - MAX_BARS_PER_SERIES
+        if overflow > 0:
+            del self.times[:overflow]
+            del self.bars[:overflow]
+            floor = self.times[0]
+            self.covered = [[max(lo, floor), hi] for lo, hi in self.covered if hi >= floor]
+
+    def slice(self, start: datetime, end: datetime) -> List[Bar]:
+        lo = bisect.bisect_left(self.times, start)
+        hi = bisect.bisect_right(self.times, end)
+        return self.bars[lo:hi]
+
+
+class BarCache:
+    """
+    Process-local cache in front of `fetch_bars_from_alpaca`.
+    """
+
+    def __init__(self, max_series: int = MAX_SERIES) -> None:
+        self.max_series = max_series
+        self._series: "OrderedDict[Tuple[str, str, str], _Series]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str, str, str, str], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_series(self, symbol: str, timeframe: str, feed: str) -> _Series:
+        key = (symbol, timeframe, feed)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+        else:
+            self._series.move_to_end(key)
+        return series
+
+    async def get_bars(
+        self,
+        symbols: Iterable[str],
+        start: datetime,
+        end: datetime,
+        timeframe: str = "1Min",
+        feed: str = "iex",
+    ) -> Dict[str, List[Bar]]:
+        """
+        Return bars with `start <= t <= end` for every symbol, fetching only uncached gaps.
+
+        Args:
+            symbols: Ticker symbols (upper case).
+            start: Inclusive, timezone-aware range start.
+            end: Inclusive, timezone-aware range end.
+            timeframe: Alpaca timeframe string (e.g. "1Min").
+            feed: Alpaca market data feed.
+
+        Returns:
+            dict: Symbol -> list of Alpaca bar dicts in ascending time order.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        if end < start or not symbols:
+            return {symbol: [] for symbol in symbols}
+
+        # Overlapping gaps across symbols collapse into one multi-symbol request
+        # over their union; disjoint gaps are fetched separately.
+        gaps = sorted(
+            (gap_start, gap_end, symbol)
+            for symbol in symbols
+            for gap_start, gap_end in self._get_series(symbol, timeframe, feed).missing(start, end)
+        )
+        batches: List[Tuple[List[str], datetime, datetime]] = []
+        for gap_start, gap_end, symbol in gaps:
+            if batches and gap_start <= batches[-1][2]:
+                group, lo, hi = batches[-1]
+                if symbol not in group:
+                    group.append(symbol)
+                batches[-1] = (group, lo, max(hi, gap_end))
+            else:
+                batches.append(([symbol], gap_start, gap_end))
+
+        if batches:
+            self.misses += 1
+            await asyncio.gather(*(
+                self._fill(group, lo, hi, timeframe, feed) for group, lo, hi in batches
+            ))
+        else:
+            self.hits += 1
+
+        return {
+            symbol: self._get_series(symbol, timeframe, feed).slice(start, end)
+            for symbol in symbols
+        }
+
+    async def _fill(
+        self, symbols: List[str], start: datetime, end: datetime, timeframe: str, feed: str
+    ) -> None:
+        joined = ",".join(sorted(symbols))
+        key = (joined, start.isoformat(), end.isoformat(), timeframe, feed)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            fetched = await fetch_bars_from_alpaca(
+                symbol=joined,
+                start=start.isoformat(),
+                end=end.isoformat(),
+                timeframe=timeframe,
+                feed=feed,
+                sort="asc",
+            )
+            settled = datetime.now(timezone.utc) - SETTLE_DELAY
+            for symbol in symbols:
+                series = self._get_series(symbol, timeframe, feed)
+                series.insert(fetched.get(symbol, []))
+                series.mark_covered(start, min(end, settled))
+        except BaseException as e:
+            failure = e if isinstance(e, Exception) else RuntimeError("Bar fetch cancelled")
+            future.set_exception(failure)
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            self._inflight.pop(key, None)
+
+    def peek(
+        self,
+        symbol: str,
+        start: datetime,
+        end: datetime,
+        timeframe: str = "1Min",
+        feed: str = "iex",
+    ) -> List[Bar]:
+        """
+        Return cached bars with `start <= t <= end` without going upstream.
+        """
+        series = self._series.get((symbol, timeframe, feed))
+        return series.slice(start, end) if series is not None else []
+
+    def clear(self) -> None:
+        self._series.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "series": len(self._series),
+            "bars": sum(len(series.times) for series in self._series.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+bar_cache = BarCache()
@@ -5,19 +5,24 @@ Main FastAPI application entry point. Sets up middleware, routers, root route, a
 import asyncio
 import logging
 import os
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from typing import AsyncGenerator
 
+from app.auth import get_current_admin_user
 from app.database import sync_engine, Base
 from app.api import auth
 from app.api import user, position, user_setting, transaction, simulation_ws, log, data, market_clock, trade
 from app.websocket import real_time_trades, historical_bars
 from app.tasks.simulation import update_simulation_time   # Add more routers as needed
 from app.websocket.real_time_trades import alpaca_ws_manager
+from app.websocket.bar_dispatcher import bar_dispatcher
+from app.websocket.session import session_metrics
+from app.websocket.quotas import websocket_quotas
+from app.services.analytics import shutdown_executor
 
 
 # Load environment variables from .env file
@@ -55,9 +60,12 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         sim_task = asyncio.create_task(update_simulation_time())
         print("🕒 Simulation updater started")
 
-    alpaca_task = asyncio.create_task(alpaca_ws_manager.connect())
+    alpaca_task = asyncio.create_task(alpaca_ws_manager.start())
     print("📡 Alpaca WebSocket manager started")
 
+    dispatcher_task = asyncio.create_task(bar_dispatcher.run())
+    print("📼 Historical bar dispatcher started")
+
     try:
         yield  # App is running
     finally:
@@ -75,6 +83,15 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
                 await alpaca_task
             except asyncio.CancelledError:
                 print("🛑 Alpaca WebSocket manager stopped")
+        await alpaca_ws_manager.stop()
+
+        dispatcher_task.cancel()
+        try:
+            await dispatcher_task
+        except asyncio.CancelledError:
+            print("🛑 Historical bar dispatcher stopped")
+
+        shutdown_executor()
 
 
 
@@ -117,6 +134,22 @@ def read_root():
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/health/websockets", dependencies=[Depends(get_current_admin_user)])
+async def websocket_health():
+    """
+    Outbound queue depth, overflow and reaped-connection counters for every WebSocket endpoint,
+    plus this worker's role in the shared market stream, its upstream
+    connections, the tick recorder and WebSocket quota usage (admin-only access).
+    """
+    metrics = session_metrics()
+    broker = alpaca_ws_manager.broker
+    metrics["market_stream"] = broker.status() if broker is not None else {"mode": "direct"}
+    metrics["market_upstreams"] = alpaca_ws_manager.pool.status()
+    recorder = alpaca_ws_manager.recorder
+    metrics["market_recorder"] = recorder.status() if recorder is not None else None
+    metrics["quotas"] = websocket_quotas.status()
+    return metrics
+
 # Register routers
 app.include_router(auth.router)
 app.include_router(user.router)
@@ -3,7 +3,7 @@ Defines the SQLAlchemy model for user settings.
 Stores simulation and trading configuration parameters for each user.
 """
 
-from sqlalchemy import Boolean, Column, String, Float, Enum, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, String, Float, Integer, Enum, DateTime, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from enum import Enum as PyEnum
@@ -25,6 +25,7 @@ class UserSetting(Base):
         - user_id: UUID, primary key and foreign key to User
         - *_rate: Float values for each fee/threshold type
         - *_type: Enum specifying whether the rate is for real/sim
+        - ws_max_*: Optional WebSocket quota overrides
         - updated_at: Timestamp of last update
     """
     
@@ -61,4 +62,9 @@ class UserSetting(Base):
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     paused = Column(Boolean, nullable=False, default=False)
 
+    # Streaming WebSocket quota overrides (admin-set); NULL uses the server default.
+    ws_max_sockets = Column(Integer, nullable=True)
+    ws_max_symbols_per_socket = Column(Integer, nullable=True)
+    ws_max_symbols = Column(Integer, nullable=True)
+
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -3,7 +3,7 @@ Pydantic schemas for user settings.
 Used to validate and serialize settings data.
 """
 
-from pydantic import BaseModel, UUID4, ConfigDict
+from pydantic import BaseModel, UUID4, ConfigDict, Field
 from typing import Literal
 from datetime import datetime
 
@@ -56,3 +56,19 @@ class UserSettingOut(UserSettingBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+
+class WebSocketQuotaUpdate(BaseModel):
+    """
+    Per-user WebSocket quota overrides (admin only); None restores the server default.
+    """
+    max_sockets: int | None = Field(default=None, ge=0)
+    max_symbols_per_socket: int | None = Field(default=None, ge=0)
+    max_symbols: int | None = Field(default=None, ge=0)
+
+
+class WebSocketQuotaOut(WebSocketQuotaUpdate):
+    """
+    The stored overrides plus the limits in effect for the user.
+    """
+    user_id: UUID4
+    effective: dict[str, int]
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 import aiohttp
@@ -12,6 +13,8 @@ ALPACA_SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
 # print(f"{ALPACA_API_KEY = }")
 # print(f"{ALPACA_SECRET_KEY = }")
 BAR_URL = "https://data.alpaca.markets/v2/stocks/bars"
+LATEST_TRADES_URL = "https://data.alpaca.markets/v2/stocks/trades/latest"
+LATEST_BARS_URL = "https://data.alpaca.markets/v2/stocks/bars/latest"
 CALENDAR_URL = "https://api.alpaca.markets/v2/calendar"
 
 
@@ -69,6 +72,33 @@ async def fetch_bars_from_alpaca(
 
     return all_bars
 
+async def fetch_latest_from_alpaca(symbols: List[str], feed: str = "iex") -> Dict[str, Dict[str, Any]]:
+    """
+    Latest trade and minute bar per symbol, shaped like stream items
+    ({"trade": {"T": "t", "S": ...}, "bar": {"T": "b", ...}}); missing values are None.
+    """
+    headers = {
+        "APCA-API-KEY-ID": ALPACA_API_KEY,
+        "APCA-API-SECRET-KEY": ALPACA_SECRET_KEY,
+    }
+    params = {"symbols": ",".join(symbols), "feed": feed}
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        trades, bars = await asyncio.gather(
+            client.get(LATEST_TRADES_URL, headers=headers, params=params),
+            client.get(LATEST_BARS_URL, headers=headers, params=params),
+        )
+    for response in (trades, bars):
+        if response.status_code != 200:
+            raise Exception(f"Alpaca API error {response.status_code}: {response.text}")
+    trades, bars = trades.json().get("trades", {}), bars.json().get("bars", {})
+    return {
+        symbol: {
+            "trade": {"T": "t", "S": symbol, **trades[symbol]} if symbol in trades else None,
+            "bar": {"T": "b", "S": symbol, **bars[symbol]} if symbol in bars else None,
+        }
+        for symbol in symbols
+    }
+
 async def fetch_market_calendar(start: str, end: str) -> dict[str, dict[str, str]]:
     url = f"{CALENDAR_URL}?start={start}&end={end}"
     headers = {
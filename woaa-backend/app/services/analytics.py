@@ -0,0 +1,172 @@
+"""
+Cross-symbol return analytics (log returns, rolling volatility, correlation).
+
+Close series come from the bar cache; the number crunching is vectorized with
+NumPy and runs in a process pool so large matrices never block the event loop.
+Results are memoized per (symbols, range, timeframe, window).
+"""
+
+import asyncio
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.cache import SETTLE_DELAY, bar_cache, parse_bar_time
+
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "2"))
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "128"))
+
+CloseSeries = Tuple[List[int], List[float]]  # (epoch seconds, close prices)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_results: "OrderedDict[Tuple[Any, ...], Dict[str, Any]]" = OrderedDict()
+_inflight: Dict[Tuple[Any, ...], asyncio.Future] = {}
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Lazily create the shared process pool used for analytics jobs.
+    """
+    global _executor
+    if _executor is None:
+        # spawn: forking the threaded server process can deadlock the child
+        _executor = ProcessPoolExecutor(
+            max_workers=ANALYTICS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """
+    Stop the analytics process pool (called from the app lifespan).
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _nan_to_none(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def compute_return_stats(
+    symbols: Sequence[str], series: Dict[str, CloseSeries], window: int
+) -> Dict[str, Any]:
+    """
+    Align close series on their common timestamps and compute return statistics.
+
+    Runs inside a worker process, so it only takes and returns plain picklable data.
+
+    Args:
+        symbols: Symbols in output order.
+        series: Symbol -> (epoch seconds, closes), each sorted ascending.
+        window: Rolling volatility window in bars.
+
+    Returns:
+        dict: Aligned index, per-symbol volatility, rolling volatility and correlation matrix.
+    """
+    index = np.unique(np.concatenate([np.asarray(series[s][0], dtype=np.int64) for s in symbols]))
+    closes = np.full((index.size, len(symbols)), np.nan)
+    for col, symbol in enumerate(symbols):
+        times = np.asarray(series[symbol][0], dtype=np.int64)
+        closes[np.searchsorted(index, times), col] = series[symbol][1]
+
+    # Keep only timestamps where every symbol printed a bar.
+    aligned = ~np.isnan(closes).any(axis=1) & (closes > 0).all(axis=1)
+    index, closes = index[aligned], closes[aligned]
+
+    returns = np.diff(np.log(closes), axis=0)
+    n = returns.shape[0]
+    result: Dict[str, Any] = {
+        "symbols": list(symbols),
+        "observations": int(n),
+        "index": [int(t) for t in index[1:]],
+        "mean_return": {},
+        "volatility": {},
+        "rolling_volatility": {},
+        "correlation": None,
+    }
+    if n == 0:
+        return result
+
+    means = returns.mean(axis=0)
+    vols = returns.std(axis=0, ddof=1) if n > 1 else np.full(len(symbols), np.nan)
+
+    # Rolling sample std from cumulative sums: O(n) per symbol, no Python loop over rows.
+    rolling = np.full(returns.shape, np.nan)
+    if 1 < window <= n:
+        padded = np.vstack([np.zeros((1, len(symbols))), returns])
+        s1 = np.cumsum(padded, axis=0)
+        s2 = np.cumsum(padded ** 2, axis=0)
+        win_sum = s1[window:] - s1[:-window]
+        win_sq = s2[window:] - s2[:-window]
+        var = (win_sq - win_sum ** 2 / window) / (window - 1)
+        rolling[window - 1:] = np.sqrt(np.clip(var, 0.0, None))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = np.corrcoef(returns, rowvar=False) if n > 1 else np.full((len(symbols),) * 2, np.nan)
+    corr = np.atleast_2d(corr)
+
+    for col, symbol in enumerate(symbols):
+        result["mean_return"][symbol] = _nan_to_none(means[col:col + 1])[0]
+        result["volatility"][symbol] = _nan_to_none(vols[col:col + 1])[0]
+        result["rolling_volatility"][symbol] = _nan_to_none(rolling[:, col])
+    result["correlation"] = [_nan_to_none(row) for row in corr]
+    return result
+
+
+async def get_correlation(
+    symbols: Sequence[str],
+    start: datetime,
+    end: datetime,
+    timeframe: str = "1Min",
+    window: int = 30,
+) -> Dict[str, Any]:
+    """
+    Return (memoized) return statistics and correlation matrix for `symbols` over [start, end].
+    """
+    symbols = sorted({s.strip().upper() for s in symbols if s.strip()})
+    key = (tuple(symbols), start.isoformat(), end.isoformat(), timeframe, window)
+
+    cached = _results.get(key)
+    if cached is not None:
+        _results.move_to_end(key)
+        return cached
+    pending = _inflight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        bars = await bar_cache.get_bars(symbols, start, end, timeframe=timeframe)
+        series: Dict[str, CloseSeries] = {
+            symbol: (
+                [int(parse_bar_time(bar["t"]).timestamp()) for bar in bars.get(symbol, [])],
+                [float(bar["c"]) for bar in bars.get(symbol, [])],
+            )
+            for symbol in symbols
+        }
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(get_executor(), compute_return_stats, symbols, series, window)
+        result.update({"start": start.isoformat(), "end": end.isoformat(), "timeframe": timeframe, "window": window})
+
+        # Ranges reaching into unsettled minutes can still change; don't memoize them.
+        if end <= datetime.now(timezone.utc) - SETTLE_DELAY:
+            _results[key] = result
+            while len(_results) > ANALYTICS_CACHE_SIZE:
+                _results.popitem(last=False)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e if isinstance(e, Exception) else RuntimeError("Analytics job cancelled"))
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
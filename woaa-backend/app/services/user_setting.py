@@ -9,7 +9,7 @@ from uuid import UUID
 from fastapi import HTTPException
 
 from app.models.user_setting import UserSetting
-from app.schemas.user_setting import UserSettingUpdate
+from app.schemas.user_setting import UserSettingUpdate, WebSocketQuotaUpdate
 from typing import Optional
 
 
@@ -39,3 +39,20 @@ async def update_user_setting(
     await db.commit()
     await db.refresh(setting)
     return setting
+
+
+async def update_ws_quota(db: AsyncSession, user_id: UUID, updates: WebSocketQuotaUpdate) -> UserSetting:
+    """
+    Store a user's WebSocket quota overrides (admin-only logic enforced in API layer).
+    """
+    setting = await get_user_setting(db, user_id)
+    if not setting:
+        raise HTTPException(status_code=404, detail="User setting not found")
+
+    setting.ws_max_sockets = updates.max_sockets
+    setting.ws_max_symbols_per_socket = updates.max_symbols_per_socket
+    setting.ws_max_symbols = updates.max_symbols
+
+    await db.commit()
+    await db.refresh(setting)
+    return setting
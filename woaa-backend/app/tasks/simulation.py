@@ -1,74 +1,320 @@
 """
 SimTime updater: maps continuous real-world time to market-only simulated time.
-Skips weekends and non-market hours by fast-forwarding over them.
+Skips weekends, holidays and non-market hours by fast-forwarding over them.
+
+Market time is computed on a `TradingCalendar` index: every session gets the
+cumulative trading time elapsed before it, so an instant maps to a "trading
+ordinal" and back with one binary search each, whatever the size of the jump.
+Sessions default to weekdays 6:30-13:00 LA; the exchange calendar (holidays,
+early closes) is loaded from Alpaca at startup and refreshed daily.
 """
 
 import asyncio
 import logging
-from datetime import datetime, timedelta, time
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta, time, timezone
+from typing import Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models.user_setting import UserSetting
 from app.database import async_session_maker
+from app.services.alpaca import fetch_market_calendar
 
 logger = logging.getLogger(__name__)
 
 TICK_INTERVAL = 1  # seconds
 LA_ZONE = ZoneInfo("America/Los_Angeles")
+NY_ZONE = ZoneInfo("America/New_York")  # exchange calendar times
 MARKET_OPEN = time(6, 30)
 MARKET_CLOSE = time(13, 0)
 
+# Exchange calendar span loaded from Alpaca; other dates use the weekday default.
+CALENDAR_START = date.fromisoformat(os.getenv("SIM_CALENDAR_START", "2016-01-01"))
+CALENDAR_YEARS_AHEAD = 2
+CALENDAR_REFRESH_SECONDS = 24 * 3600
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_MARGIN = 7 * 24 * 3600 * 1_000_000  # keep a week of sessions around any looked-up instant
+
+
+def _micros(dt: datetime) -> int:
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(us: int, tz) -> datetime:
+    return (_EPOCH + timedelta(microseconds=us)).astimezone(tz)
+
+
+class TradingCalendar:
+    """
+    Market sessions indexed by cumulative trading time.
+
+    For session i, `opens[i]` / `closes[i]` are epoch microseconds and
+    `ordinals[i]` is the trading time (µs) of all indexed sessions before it.
+    An instant outside a session has the ordinal of the next open (which is
+    also that of the previous close). The index covers whole years around the
+    instants looked up and is rebuilt, O(sessions), only when it must grow.
+    """
+
+    def __init__(self) -> None:
+        # Exchange sessions (NY open, close) for dates in `known`; missing dates there are holidays.
+        self.exchange: Dict[date, Tuple[time, time]] = {}
+        self.known: Optional[Tuple[date, date]] = None
+        self.first: Optional[date] = None
+        self.last: Optional[date] = None
+        self.opens: List[int] = []
+        self.closes: List[int] = []
+        self.ordinals: List[int] = []
+        self.total = 0  # ordinal at the last close
+        self._lo = self._hi = 0  # instants the index can answer for without growing
+
+    def load(self, sessions: Dict[date, Tuple[time, time]], first: date, last: date) -> None:
+        """
+        Use exchange `sessions` (NY open and close times) for dates in [first, last].
+        """
+        self.exchange = sessions
+        self.known = (first, last)
+        if self.first is not None:
+            self._build(self.first, self.last)
+
+    def session(self, day: date) -> Optional[Tuple[int, int]]:
+        """
+        (open, close) of `day` in epoch microseconds, or None when the market is closed.
+        """
+        if self.known is not None and self.known[0] <= day <= self.known[1]:
+            hours = self.exchange.get(day)
+            if hours is None:
+                return None
+            opens, closes, tz = hours[0], hours[1], NY_ZONE
+        elif day.weekday() >= 5:
+            return None
+        else:
+            opens, closes, tz = MARKET_OPEN, MARKET_CLOSE, LA_ZONE
+        return _micros(datetime.combine(day, opens, tz)), _micros(datetime.combine(day, closes, tz))
+
+    def _build(self, first: date, last: date) -> None:
+        opens: List[int] = []
+        closes: List[int] = []
+        ordinals: List[int] = []
+        total = 0
+        day = first
+        while day <= last:
+            hours = self.session(day)
+            if hours is not None:
+                opens.append(hours[0])
+                closes.append(hours[1])
+                ordinals.append(total)
+                total += hours[1] - hours[0]
+            day += timedelta(days=1)
+        self.opens, self.closes, self.ordinals, self.total = opens, closes, ordinals, total
+        self.first, self.last = first, last
+        self._lo = _micros(datetime.combine(first, time(), timezone.utc)) + _MARGIN
+        self._hi = _micros(datetime.combine(last, time(), timezone.utc)) - _MARGIN
+
+    def _cover(self, us: int) -> None:
+        if self.first is not None and self._lo <= us <= self._hi:
+            return
+        year = _from_micros(us, timezone.utc).year
+        first, last = date(year - 1, 1, 1), date(year + 1, 12, 31)
+        if self.first is not None:
+            first, last = min(first, self.first), max(last, self.last)
+        self._build(first, last)
+
+    def _grow_forward(self) -> None:
+        self._build(self.first, date(self.last.year + 2, 12, 31))
+
+    def _grow_backward(self) -> None:
+        self._build(date(self.first.year - 2, 1, 1), self.last)
+
+    def ordinal(self, us: int) -> int:
+        i = bisect_right(self.opens, us) - 1
+        if i >= 0 and us < self.closes[i]:
+            return self.ordinals[i] + us - self.opens[i]
+        return self.ordinals[i + 1] if i + 1 < len(self.ordinals) else self.total
+
+    def instant(self, ordinal: int) -> int:
+        """
+        The instant at `ordinal`; a session boundary maps to the later session's open.
+        """
+        j = bisect_right(self.ordinals, ordinal) - 1
+        return self.opens[j] + ordinal - self.ordinals[j]
+
+    def advance(self, start: datetime, seconds: float) -> datetime:
+        us = _micros(start)
+        self._cover(us)
+        target = self.ordinal(us) + round(seconds * 1_000_000)
+        while target >= self.total:
+            self._grow_forward()
+        return _from_micros(self.instant(target), start.tzinfo)
+
+    def rewind(self, start: datetime, seconds: float) -> datetime:
+        us = _micros(start)
+        self._cover(us)
+        step = round(seconds * 1_000_000)
+        while self.ordinal(us) < step:  # ordinals shift when the index grows backwards
+            self._grow_backward()
+        return _from_micros(self.instant(self.ordinal(us) - step), start.tzinfo)
+
+    def between(self, start: datetime, end: datetime) -> float:
+        a, b = _micros(start), _micros(end)
+        self._cover(a)
+        self._cover(b)
+        return (self.ordinal(b) - self.ordinal(a)) / 1_000_000
+
+    def next_open_after_day(self, dt: datetime) -> datetime:
+        midnight = datetime.combine(dt.date() + timedelta(days=1), time(), dt.tzinfo)
+        us = _micros(midnight)
+        self._cover(us)
+        i = bisect_left(self.opens, us)
+        while i >= len(self.opens):
+            self._grow_forward()
+            i = bisect_left(self.opens, us)
+        return _from_micros(self.opens[i], dt.tzinfo)
+
+    def previous_close_before_day(self, dt: datetime) -> datetime:
+        midnight = datetime.combine(dt.date(), time(), dt.tzinfo)
+        us = _micros(midnight)
+        self._cover(us)
+        i = bisect_left(self.closes, us) - 1
+        while i < 0:
+            self._grow_backward()
+            i = bisect_left(self.closes, us) - 1
+        return _from_micros(self.closes[i], dt.tzinfo)
+
+    def in_session(self, dt: datetime) -> bool:
+        us = _micros(dt)
+        self._cover(us)
+        i = bisect_right(self.opens, us) - 1
+        return i >= 0 and us < self.closes[i]
+
+
+market_calendar = TradingCalendar()
+
+
+async def load_market_calendar() -> None:
+    """
+    Load holidays and early closes from Alpaca into `market_calendar`; on
+    failure the weekday default stays in place.
+    """
+    first = CALENDAR_START
+    last = date(date.today().year + CALENDAR_YEARS_AHEAD, 12, 31)
+    try:
+        days = await fetch_market_calendar(first.isoformat(), last.isoformat())
+    except Exception as e:
+        logger.warning("Market calendar unavailable, using weekday sessions: %s", e)
+        return
+    sessions = {
+        date.fromisoformat(day): (time.fromisoformat(hours["open"]), time.fromisoformat(hours["close"]))
+        for day, hours in days.items()
+    }
+    market_calendar.load(sessions, first, last)
+    logger.info("Loaded %d market sessions (%s to %s)", len(sessions), first, last)
+
 
 def is_market_day(dt: datetime) -> bool:
-    return dt.weekday() < 5  # Mon–Fri
+    return market_calendar.session(dt.date()) is not None
 
 
 def is_during_market_hours(dt: datetime) -> bool:
-    return is_market_day(dt) and MARKET_OPEN <= dt.time() < MARKET_CLOSE
+    return market_calendar.in_session(dt)
 
 
 def next_market_open(dt: datetime) -> datetime:
-    dt = dt + timedelta(days=1)
-    while True:
-        if is_market_day(dt):
-            return dt.replace(hour=6, minute=30, second=0, microsecond=0)
-        dt += timedelta(days=1)
+    """
+    Open of the first session on a day after `dt`'s.
+    """
+    return market_calendar.next_open_after_day(dt)
+
+
+def previous_market_close(dt: datetime) -> datetime:
+    """
+    Close of the last session on a day before `dt`'s.
+    """
+    return market_calendar.previous_close_before_day(dt)
 
 
 def advance_market_time(start: datetime, seconds: float) -> datetime:
-    current = start
-    logger.debug(f"[advance_market_time] Starting from {current}, advancing {seconds} seconds")
+    """
+    Move `start` forward by `seconds` of market time, skipping closed periods.
+    Reaching a session's close exactly lands on the next open.
+    """
+    if seconds <= 0:
+        return start
+    return market_calendar.advance(start, seconds)
 
-    while seconds > 0:
-        if not is_market_day(current) or current.time() >= MARKET_CLOSE:
-            logger.debug(f"[advance_market_time] Outside market hours at {current}, skipping to next open")
-            current = next_market_open(current)
-            continue
 
-        if current.time() < MARKET_OPEN:
-            current = current.replace(hour=6, minute=30, second=0, microsecond=0)
-            logger.debug(f"[advance_market_time] Before market open, jumping to 6:30 AM: {current}")
+def rewind_market_time(start: datetime, seconds: float) -> datetime:
+    """
+    Inverse of `advance_market_time`: step back `seconds` of market time from `start` (LA_ZONE).
+    """
+    if seconds <= 0:
+        return start
+    return market_calendar.rewind(start, seconds)
 
-        market_close = current.replace(hour=13, minute=0, second=0, microsecond=0)
-        time_left_today = (market_close - current).total_seconds()
 
-        step = min(seconds, time_left_today)
-        current += timedelta(seconds=step)
-        seconds -= step
-        logger.debug(f"[advance_market_time] Advanced by {step} seconds, now at {current}, remaining: {seconds}")
+def market_seconds_between(start: datetime, end: datetime) -> float:
+    """
+    Market seconds the sim clock must advance from `start` until it is at or past `end`.
+    Both datetimes must be in LA_ZONE.
+    """
+    if end <= start:
+        return 0.0
+    return market_calendar.between(start, end)
 
-        if step == time_left_today:
-            logger.debug(f"[advance_market_time] Reached market close, advancing to next open")  # noqa: F541
-            current = next_market_open(current)
 
-    logger.debug(f"[advance_market_time] Final advanced time: {current}")
-    return current
+class SimClock:
+    """
+    In-memory projection of one user's simulated clock.
+
+    Built from the persisted (sim_time, last_updated, speed, paused) row, it
+    reproduces what `update_all_users_sim_time` will write at any instant, so
+    callers can read the clock or schedule work without polling the database.
+    """
+
+    __slots__ = ("sim_time", "last_updated", "speed", "paused")
+
+    def __init__(self, sim_time: datetime, last_updated: datetime, speed: float, paused: bool) -> None:
+        self.sim_time = sim_time
+        self.last_updated = last_updated
+        self.speed = speed or 0.0
+        self.paused = bool(paused)
+
+    @property
+    def running(self) -> bool:
+        return not self.paused and self.speed > 0
+
+    def now(self, at: datetime) -> datetime:
+        """
+        Sim time (UTC) at real instant `at`.
+        """
+        elapsed = (at - self.last_updated).total_seconds()
+        if not self.running or elapsed <= 0:
+            return self.sim_time
+        advanced = advance_market_time(self.sim_time.astimezone(LA_ZONE), elapsed * self.speed)
+        return advanced.astimezone(ZoneInfo("UTC"))
+
+    def wall_time_at(self, target: datetime) -> Optional[datetime]:
+        """
+        Real instant (UTC) at which the sim clock reaches `target`, or None while stopped.
+        """
+        if target <= self.sim_time:
+            return self.last_updated
+        if not self.running:
+            return None
+        seconds = market_seconds_between(self.sim_time.astimezone(LA_ZONE), target.astimezone(LA_ZONE))
+        return self.last_updated + timedelta(seconds=seconds / self.speed)
 
 
 async def update_simulation_time():
+    calendar_loaded = None
     while True:
-        logger.debug("[update_simulation_time] Ticking...")
+        now = asyncio.get_running_loop().time()
+        if calendar_loaded is None or now - calendar_loaded >= CALENDAR_REFRESH_SECONDS:
+            await load_market_calendar()
+            calendar_loaded = now
         async with async_session_maker() as session:
             await update_all_users_sim_time(session)
         await asyncio.sleep(TICK_INTERVAL)
@@ -76,33 +322,21 @@ async def update_simulation_time():
 
 async def update_all_users_sim_time(session: AsyncSession):
     now_utc = datetime.now(tz=ZoneInfo("UTC"))
-    logger.debug(f"[update_all_users_sim_time] Current UTC: {now_utc}")
 
     result = await session.execute(select(UserSetting))
     users = result.scalars().all()
-
-    logger.debug(f"[update_all_users_sim_time] Found {len(users)} users")
+    logger.debug("[update_all_users_sim_time] %d users at %s", len(users), now_utc)
 
     for user in users:
-        logger.debug(f"[update_all_users_sim_time] Processing user {user.user_id}")
-        if user.paused:
-            logger.debug("[update_all_users_sim_time] Skipped: paused")
-            continue
-        if user.speed <= 0:
-            logger.debug("[update_all_users_sim_time] Skipped: speed <= 0")
+        if user.paused or user.speed <= 0:
             continue
 
         elapsed = (now_utc - user.last_updated).total_seconds()
-        logger.debug(f"[update_all_users_sim_time] Elapsed real time: {elapsed} seconds")
-
         user.last_updated = now_utc
 
         sim_time_la = user.sim_time.astimezone(LA_ZONE)
         advanced_time = advance_market_time(sim_time_la, elapsed * user.speed)
         user.sim_time = advanced_time.astimezone(ZoneInfo("UTC"))
-
-        logger.debug(f"[update_all_users_sim_time] Updated sim_time: {user.sim_time.isoformat()}")
         session.add(user)
 
     await session.commit()
-    logger.debug("[update_all_users_sim_time] Changes committed")
@@ -0,0 +1,144 @@
+"""
+@fileoverview
+Tests for the /data API including:
+- GET /data/analytics/correlation
+- GET /data/latest, including the Alpaca fallback for symbols this worker doesn't stream
+
+Upstream bar fetches are replaced with a deterministic fake so no Alpaca call is made.
+"""
+
+import pytest
+import uuid
+from datetime import datetime, timedelta, timezone
+from httpx import AsyncClient
+
+import app.api.data as data_api
+import app.cache as cache
+from app.websocket.real_time_trades import alpaca_ws_manager
+
+
+async def _login(client: AsyncClient) -> dict:
+    user_data = {
+        "username": f"datauser_{uuid.uuid4().hex[:6]}",
+        "email": f"data_{uuid.uuid4().hex[:6]}@example.com",
+        "password": "datapass"
+    }
+    await client.post("/auth/register", json=user_data)
+    login = await client.post("/auth/login", data={
+        "username": user_data["email"],
+        "password": user_data["password"]
+    })
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+def _fake_bars(symbols: str, start: str):
+    base = datetime.fromisoformat(start)
+    out = {}
+    for offset, symbol in enumerate(symbols.split(",")):
+        price = 100.0
+        bars = []
+        for i in range(60):
+            price *= 1.001 if (i + offset) % 3 else 0.998
+            t = (base + timedelta(minutes=i)).astimezone(timezone.utc)
+            bars.append({"t": t.strftime("%Y-%m-%dT%H:%M:%SZ"), "o": price, "h": price, "l": price, "c": price, "v": 100})
+        out[symbol] = bars
+    return out
+
+
+@pytest.mark.asyncio
+async def test_correlation_success(client: AsyncClient, monkeypatch):
+    """
+    Two symbols over a fake hour of bars → square matrix with unit diagonal.
+    """
+    calls = []
+
+    async def fake_fetch(symbol, start, end, **kwargs):
+        calls.append(symbol)
+        return _fake_bars(symbol, start)
+
+    monkeypatch.setattr(cache, "fetch_bars_from_alpaca", fake_fetch)
+    cache.bar_cache.clear()
+    headers = await _login(client)
+
+    params = {
+        "symbols": "msft,AAPL",
+        "start": "2024-01-03T14:30:00+00:00",
+        "end": "2024-01-03T15:29:00+00:00",
+        "window": 10,
+    }
+    resp = await client.get("/data/analytics/correlation", params=params, headers=headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["symbols"] == ["AAPL", "MSFT"]
+    assert data["observations"] == 59
+    assert len(data["correlation"]) == 2
+    assert data["correlation"][0][0] == pytest.approx(1.0)
+    assert len(data["rolling_volatility"]["AAPL"]) == 59
+    assert data["rolling_volatility"]["AAPL"][0] is None
+
+    # One multi-symbol upstream call; the repeat is served from memory.
+    resp = await client.get("/data/analytics/correlation", params=params, headers=headers)
+    assert resp.status_code == 200
+    assert calls == ["AAPL,MSFT"]
+
+
+@pytest.mark.asyncio
+async def test_correlation_validation(client: AsyncClient):
+    headers = await _login(client)
+    base = {"start": "2024-01-03T14:30:00+00:00", "end": "2024-01-03T15:30:00+00:00"}
+
+    resp = await client.get("/data/analytics/correlation", params={**base, "symbols": "AAPL"}, headers=headers)
+    assert resp.status_code == 400
+
+    resp = await client.get(
+        "/data/analytics/correlation",
+        params={**base, "symbols": "AAPL,MSFT", "end": "2024-01-03T14:00:00+00:00"},
+        headers=headers,
+    )
+    assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_correlation_unauthorized(client: AsyncClient):
+    resp = await client.get("/data/analytics/correlation", params={
+        "symbols": "AAPL,MSFT",
+        "start": "2024-01-03T14:30:00+00:00",
+        "end": "2024-01-03T15:30:00+00:00",
+    })
+    assert resp.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_latest_served_from_stream_cache(client: AsyncClient, monkeypatch):
+    lookups = []
+
+    async def fake_latest(symbols):
+        lookups.append(symbols)
+        if "FAIL" in symbols:
+            raise Exception("Alpaca API error 500")
+        return {symbol: {"trade": {"T": "t", "S": symbol, "p": 250.0}, "bar": None} for symbol in symbols}
+
+    monkeypatch.setattr(data_api, "fetch_latest_from_alpaca", fake_latest)
+    alpaca_ws_manager.last_values.clear()
+    alpaca_ws_manager.route_batch([
+        {"T": "t", "S": "AAPL", "p": 190.1, "t": "2024-01-03T15:00:00Z"},
+        {"T": "t", "S": "AAPL", "p": 190.3, "t": "2024-01-03T15:00:01Z"},
+        {"T": "b", "S": "AAPL", "c": 190.2, "t": "2024-01-03T15:00:00Z"},
+    ])
+    headers = await _login(client)
+
+    resp = await client.get("/data/latest", params={"symbols": "aapl,TSLA"}, headers=headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["AAPL"]["trade"]["p"] == 190.3
+    assert data["AAPL"]["bar"]["c"] == 190.2
+    # Not streamed by this worker: looked up, so any worker answers the same.
+    assert lookups == [["TSLA"]]
+    assert data["TSLA"] == {"trade": {"T": "t", "S": "TSLA", "p": 250.0}, "bar": None}
+
+    resp = await client.get("/data/latest", params={"symbols": "FAIL"}, headers=headers)
+    assert resp.status_code == 200 and resp.json()["FAIL"] == {"trade": None, "bar": None}
+
+    resp = await client.get("/data/latest", params={"symbols": " , "}, headers=headers)
+    assert resp.status_code == 400
+    alpaca_ws_manager.last_values.clear()
@@ -7,6 +7,7 @@ Tests for the /user-settings API, covering:
 - PATCH /user-settings/me/start-time
 - GET /user-settings/{user_id}
 - PUT /user-settings/{user_id}
+- GET/PUT /user-settings/{user_id}/ws-quota
 
 Includes success cases, auth enforcement, validation errors, and admin vs. regular-user behavior.
 """
@@ -241,3 +242,44 @@ async def test_update_settings_admin_success_and_errors(client: AsyncClient):
     invalid["commission_type"] = "wrong"
     inv = await client.put(f"/user-settings/{user_id}", json=invalid, headers=admin_headers)
     assert inv.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_ws_quota_admin_only(client: AsyncClient):
+    u = {
+        "username": f"wsq_{uuid.uuid4().hex[:6]}",
+        "email": f"wsq_{uuid.uuid4().hex[:6]}@example.com",
+        "password": "pw"
+    }
+    reg = await client.post("/auth/register", json=u)
+    user_id = reg.json()["id"]
+    login = await client.post("/auth/login", data={"username": u["email"], "password": u["password"]})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    admin = {
+        "username": f"wsa_{uuid.uuid4().hex[:6]}",
+        "email": f"wsa_{uuid.uuid4().hex[:6]}@example.com",
+        "password": "pw",
+        "is_admin": True
+    }
+    await client.post("/auth/register-admin", json=admin)
+    login2 = await client.post("/auth/login", data={"username": admin["email"], "password": admin["password"]})
+    admin_headers = {"Authorization": f"Bearer {login2.json()['access_token']}"}
+
+    # Defaults until an admin overrides them
+    resp = await client.get(f"/user-settings/{user_id}/ws-quota", headers=admin_headers)
+    assert resp.status_code == 200
+    assert resp.json()["max_sockets"] is None
+    defaults = resp.json()["effective"]
+
+    resp = await client.put(f"/user-settings/{user_id}/ws-quota", json={"max_sockets": 1, "max_symbols": 3}, headers=admin_headers)
+    assert resp.status_code == 200
+    assert resp.json()["effective"] == {**defaults, "sockets": 1, "symbols": 3}
+
+    # Regular users can't read or change quotas; negative limits are invalid
+    assert (await client.get(f"/user-settings/{user_id}/ws-quota", headers=headers)).status_code == 403
+    assert (await client.put(f"/user-settings/{user_id}/ws-quota", json={}, headers=headers)).status_code == 403
+    bad = await client.put(f"/user-settings/{user_id}/ws-quota", json={"max_sockets": -1}, headers=admin_headers)
+    assert bad.status_code == 422
+    missing = await client.put(f"/user-settings/{uuid.uuid4()}/ws-quota", json={}, headers=admin_headers)
+    assert missing.status_code == 404
@@ -2,6 +2,8 @@
 Tests for the FastAPI root and health check endpoints.
 """
 
+import uuid
+
 import pytest
 from httpx import AsyncClient
 from fastapi import status
@@ -26,3 +28,27 @@ async def test_root_endpoint(client: AsyncClient):
     assert "Welcome" in response.text or response.json()
 
 
+
+
+async def test_websocket_health_is_admin_only(client: AsyncClient):
+    """
+    Ensure /health/websockets needs an admin token.
+    """
+    assert (await client.get("/health/websockets")).status_code == status.HTTP_401_UNAUTHORIZED
+
+    tokens = {}
+    for is_admin in (False, True):
+        u = {
+            "username": f"wsh_{uuid.uuid4().hex[:6]}",
+            "email": f"wsh_{uuid.uuid4().hex[:6]}@example.com",
+            "password": "pw",
+            "is_admin": is_admin,
+        }
+        await client.post("/auth/register-admin" if is_admin else "/auth/register", json=u)
+        login = await client.post("/auth/login", data={"username": u["email"], "password": u["password"]})
+        tokens[is_admin] = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    assert (await client.get("/health/websockets", headers=tokens[False])).status_code == status.HTTP_403_FORBIDDEN
+    response = await client.get("/health/websockets", headers=tokens[True])
+    assert response.status_code == status.HTTP_200_OK
+    assert "quotas" in response.json()
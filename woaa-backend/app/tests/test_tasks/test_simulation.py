@@ -0,0 +1,135 @@
+"""
+@fileoverview
+Tests for the market-time index behind the sim clock:
+- advance / rewind / market_seconds_between match the original day-by-day
+  loops on regular weekday sessions (randomized, fixed seed)
+- exchange holidays and early closes are skipped
+- advancing by years stays exact
+"""
+
+import random
+from datetime import date, datetime, time, timedelta
+
+from app.tasks.simulation import (
+    LA_ZONE, TradingCalendar, advance_market_time, market_seconds_between, next_market_open, rewind_market_time,
+)
+
+
+# The original loops, kept as the reference for regular days.
+
+def _weekday(dt):
+    return dt.weekday() < 5
+
+
+def _next_open(dt):
+    dt = dt + timedelta(days=1)
+    while not _weekday(dt):
+        dt += timedelta(days=1)
+    return dt.replace(hour=6, minute=30, second=0, microsecond=0)
+
+
+def _previous_close(dt):
+    dt = dt - timedelta(days=1)
+    while not _weekday(dt):
+        dt -= timedelta(days=1)
+    return dt.replace(hour=13, minute=0, second=0, microsecond=0)
+
+
+def _loop_advance(current, seconds):
+    while seconds > 0:
+        if not _weekday(current) or current.time() >= time(13, 0):
+            current = _next_open(current)
+            continue
+        if current.time() < time(6, 30):
+            current = current.replace(hour=6, minute=30, second=0, microsecond=0)
+        left = (current.replace(hour=13, minute=0, second=0, microsecond=0) - current).total_seconds()
+        step = min(seconds, left)
+        current += timedelta(seconds=step)
+        seconds -= step
+        if step == left:
+            current = _next_open(current)
+    return current
+
+
+def _loop_rewind(current, seconds):
+    while seconds > 0:
+        if not _weekday(current) or current.time() <= time(6, 30):
+            current = _previous_close(current)
+            continue
+        if current.time() > time(13, 0):
+            current = current.replace(hour=13, minute=0, second=0, microsecond=0)
+        back = (current - current.replace(hour=6, minute=30, second=0, microsecond=0)).total_seconds()
+        step = min(seconds, back)
+        current -= timedelta(seconds=step)
+        seconds -= step
+    return current
+
+
+def _loop_between(current, end):
+    total = 0.0
+    while current < end:
+        if not _weekday(current) or current.time() >= time(13, 0):
+            current = _next_open(current)
+            continue
+        if current.time() < time(6, 30):
+            current = current.replace(hour=6, minute=30, second=0, microsecond=0)
+            continue
+        close = current.replace(hour=13, minute=0, second=0, microsecond=0)
+        if end <= close:
+            total += (end - current).total_seconds()
+            break
+        total += (close - current).total_seconds()
+        current = _next_open(current)
+    return total
+
+
+def _random_instant(rng):
+    day = date(2019, 1, 1) + timedelta(days=rng.randrange(8 * 365))
+    if rng.random() < 0.3:  # land on session boundaries often
+        clock = rng.choice([time(6, 30), time(13, 0), time(0, 0), time(12, 59, 59)])
+    else:
+        clock = time(rng.randrange(24), rng.randrange(60), rng.randrange(60))
+    return datetime.combine(day, clock, LA_ZONE)
+
+
+def test_matches_day_by_day_loops_on_regular_days():
+    rng = random.Random(20240103)
+    session = 6.5 * 3600
+    for _ in range(500):
+        start = _random_instant(rng)
+        seconds = rng.choice([
+            rng.randrange(120), rng.randrange(int(session)) + 0.5, session * rng.randrange(1, 10),
+            rng.randrange(20_000_000),
+        ])
+        assert advance_market_time(start, seconds) == _loop_advance(start, seconds), (start, seconds)
+        assert rewind_market_time(start, seconds) == _loop_rewind(start, seconds), (start, seconds)
+        end = _random_instant(rng)
+        assert market_seconds_between(start, end) == _loop_between(start, end), (start, end)
+
+
+def test_holidays_and_early_closes():
+    calendar = TradingCalendar()
+    # Week of July 4th 2024 (exchange times are New York): early close on the 3rd, closed on the 4th.
+    week = {
+        date(2024, 7, 1): (time(9, 30), time(16, 0)),
+        date(2024, 7, 2): (time(9, 30), time(16, 0)),
+        date(2024, 7, 3): (time(9, 30), time(13, 0)),
+        date(2024, 7, 5): (time(9, 30), time(16, 0)),
+    }
+    calendar.load(week, date(2024, 7, 1), date(2024, 7, 7))
+
+    start = datetime(2024, 7, 3, 9, 59, tzinfo=LA_ZONE)
+    assert calendar.advance(start, 120) == datetime(2024, 7, 5, 6, 31, tzinfo=LA_ZONE)
+    assert calendar.rewind(datetime(2024, 7, 5, 6, 31, tzinfo=LA_ZONE), 120) == start
+    assert calendar.between(start, datetime(2024, 7, 5, 7, 0, tzinfo=LA_ZONE)) == 60 + 30 * 60
+    assert calendar.next_open_after_day(start) == datetime(2024, 7, 5, 6, 30, tzinfo=LA_ZONE)
+
+
+def test_large_jumps_are_exact():
+    start = datetime(2024, 1, 3, 7, 0, 0, 250_000, tzinfo=LA_ZONE)
+    years = 6.5 * 3600 * 252 * 30
+    later = advance_market_time(start, years)
+    assert later.year >= 2050
+    assert rewind_market_time(later, years) == start
+    assert market_seconds_between(start, later) == years
+    assert next_market_open(datetime(2024, 1, 5, 12, 0, tzinfo=LA_ZONE)) == datetime(2024, 1, 8, 6, 30, tzinfo=LA_ZONE)
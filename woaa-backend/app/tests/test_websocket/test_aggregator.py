@@ -0,0 +1,105 @@
+"""
+@fileoverview
+Tests for historical candle aggregation:
+- timeframe parsing and bucket alignment, multi-hour buckets on exchange time across DST
+- shared per-(symbol, timeframe) aggregator read at different sim times
+- forming / closed candle pushes from the dispatcher
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.websocket.aggregator import CandleAggregator, aggregate, bucket_start, parse_timeframe, timeframe_name
+from app.websocket.bar_dispatcher import HistoricalBarDispatcher, HistoricalSubscription
+
+T0 = datetime(2024, 1, 3, 14, 30, tzinfo=timezone.utc)
+
+
+def _format(ts):
+    return ts.isoformat().replace("+00:00", "Z")
+
+
+def _bar(minute, price, volume=10):
+    ts = T0 + timedelta(minutes=minute)
+    return {
+        "t": ts.isoformat().replace("+00:00", "Z"),
+        "o": price, "h": price + 1, "l": price - 1, "c": price + 0.5, "v": volume, "n": 2, "vw": price,
+    }
+
+
+def test_parse_timeframe():
+    assert parse_timeframe(None) == 1
+    assert parse_timeframe("5Min") == 5
+    assert parse_timeframe("15min") == 15
+    assert parse_timeframe("1Hour") == 60
+    assert timeframe_name(5) == "5Min" and timeframe_name(60) == "1Hour"
+    for bad in ("7Min", "1Day", "five"):
+        with pytest.raises(ValueError):
+            parse_timeframe(bad)
+
+
+def test_bucket_start_aligns_to_clock():
+    assert bucket_start(T0 + timedelta(minutes=7, seconds=30), 5) == T0 + timedelta(minutes=5)
+    assert bucket_start(T0, 60) == T0 - timedelta(minutes=30)
+
+
+def test_multi_hour_buckets_follow_the_session_across_dst():
+    # US DST began 2024-03-10: the 09:30 ET open is 14:30 UTC before, 13:30 UTC after.
+    for day, open_utc in ((8, 14), (11, 13)):
+        session_open = datetime(2024, 3, day, open_utc, 30, tzinfo=timezone.utc)
+        assert bucket_start(session_open + timedelta(minutes=119), 120) == session_open
+        assert bucket_start(session_open + timedelta(minutes=120), 120) == session_open + timedelta(hours=2)
+        assert bucket_start(session_open + timedelta(hours=6, minutes=29), 240) == session_open + timedelta(hours=4)
+        assert bucket_start(session_open - timedelta(minutes=1), 240) == session_open - timedelta(hours=4)
+    after = datetime(2024, 3, 11, 13, 30, tzinfo=timezone.utc)
+    candles = aggregate([{**_bar(0, 100), "t": "2024-03-11T17:29:00Z"}, {**_bar(0, 101), "t": "2024-03-11T17:30:00Z"}], 240)
+    assert [candle["t"] for candle in candles] == [
+        _format(after), _format(after + timedelta(hours=4)),
+    ]
+
+
+def test_aggregate_folds_ohlcv():
+    candles = aggregate([_bar(0, 100), _bar(1, 105), _bar(4, 95, volume=30), _bar(5, 90)], 5)
+    assert len(candles) == 2
+    first = candles[0]
+    assert first["t"] == "2024-01-03T14:30:00Z"
+    assert (first["o"], first["h"], first["l"], first["c"]) == (100, 106, 94, 95.5)
+    assert first["v"] == 50 and first["n"] == 6
+    assert first["vw"] == pytest.approx((100 * 10 + 105 * 10 + 95 * 30) / 50)
+
+
+def test_shared_aggregator_serves_any_sim_time():
+    aggregator = CandleAggregator("AAPL", 5)
+    aggregator.add([_bar(0, 100), _bar(1, 105), _bar(2, 110)])
+    # A subscriber behind the first one re-adds earlier bars; they are not double counted.
+    aggregator.add([_bar(0, 100), _bar(1, 105)])
+    assert aggregator.candle(T0, T0 + timedelta(minutes=1))["c"] == 105.5
+    assert aggregator.candle(T0, T0 + timedelta(minutes=1))["v"] == 20
+    assert aggregator.candle(T0, T0 + timedelta(minutes=9))["v"] == 30
+
+
+def test_dispatcher_pushes_forming_then_closed_candles():
+    dispatcher = HistoricalBarDispatcher()
+    subscription = HistoricalSubscription("AAPL", 5, aggregator=CandleAggregator("AAPL", 5))
+
+    message = dispatcher._bars_message(subscription, [_bar(0, 100), _bar(1, 101)], T0 + timedelta(minutes=1))
+    assert message["timeframe"] == "5Min" and message["bars"] == []
+    assert message["forming"]["c"] == 101.5
+
+    # No new bars in an open bucket: nothing to push.
+    assert dispatcher._bars_message(subscription, [], T0 + timedelta(minutes=2)) is None
+
+    # The bucket closes on time even though its last minutes printed no bars.
+    message = dispatcher._bars_message(subscription, [_bar(5, 120)], T0 + timedelta(minutes=5))
+    assert [candle["t"] for candle in message["bars"]] == ["2024-01-03T14:30:00Z"]
+    assert message["bars"][0]["c"] == 101.5
+    assert message["forming"]["t"] == "2024-01-03T14:35:00Z"
+
+
+def test_dispatcher_closed_only_subscription():
+    dispatcher = HistoricalBarDispatcher()
+    subscription = HistoricalSubscription("AAPL", 5, forming=False, aggregator=CandleAggregator("AAPL", 5))
+    assert dispatcher._bars_message(subscription, [_bar(0, 100)], T0) is None
+    message = dispatcher._bars_message(subscription, [_bar(4, 104)], T0 + timedelta(minutes=4))
+    assert "forming" not in message and len(message["bars"]) == 1
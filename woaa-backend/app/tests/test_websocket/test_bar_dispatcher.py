@@ -0,0 +1,423 @@
+"""
+@fileoverview
+Tests for the historical bar dispatcher:
+- lookback parsing (bar counts and market-time durations)
+- subscribe-time snapshot frame served from the bar cache
+- catch-up chunks for large backlogs
+- sockets replaying the same symbol and window share one upstream fetch
+- pushes and wake-ups scheduled from the sim clock, across speed changes and pauses
+- read-ahead refill below the watermark: one fetch of the next window, no gap or repeat at the seam
+- overlapping windows of several symbols fetched in one grouped request and split per symbol
+- one socket's symbols share one upstream request per dispatch and one refill task
+- a clock invalidated while bars are being fetched does not abort the dispatch pass
+"""
+
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import cache
+from app.tasks.simulation import SimClock
+from app.websocket import bar_dispatcher as dispatcher_module
+from app.websocket.bar_dispatcher import WAKE_SLACK, HistoricalBarDispatcher, _batch_windows, parse_lookback
+from app.websocket.codec import FLAG_CATCHUP, decode_bars
+from app.websocket.session import WebSocketSession
+
+# Real instants handed to dispatch_once; sim clocks are projected from them.
+WALL = datetime(2024, 6, 3, 12, 0, tzinfo=timezone.utc)
+# Wednesday 2024-01-03 10:00:30 ET.
+SIM = datetime(2024, 1, 3, 15, 0, 30, tzinfo=timezone.utc)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.sent.append(decode_bars(data))
+
+    async def close(self, code=1000):
+        pass
+
+
+def _bars(start, count):
+    return [
+        {"t": (start + timedelta(minutes=i)).isoformat().replace("+00:00", "Z"), "o": 1, "h": 1, "l": 1, "c": 1, "v": 1}
+        for i in range(count)
+    ]
+
+
+def _stub_alpaca(monkeypatch):
+    """
+    Serve one bar per minute for every requested symbol (tagged with "S"), recording each request.
+    """
+    calls = []
+
+    async def fake_fetch(symbol, start, end, timeframe, feed, sort):
+        calls.append((symbol, start, end))
+        first, last = datetime.fromisoformat(start), datetime.fromisoformat(end)
+        count = int((last - first).total_seconds() // 60) + 1
+        return {s: [{**bar, "S": s} for bar in _bars(first, count)] for s in symbol.split(",")}
+
+    monkeypatch.setattr(cache, "fetch_bars_from_alpaca", fake_fetch)
+    cache.bar_cache.clear()
+    return calls
+
+
+def _dispatcher_for(monkeypatch, clock, *symbols):
+    # Clocks are injected, never re-read from the database.
+    monkeypatch.setattr(dispatcher_module, "CLOCK_RESYNC_INTERVAL", 3600)
+    dispatcher = HistoricalBarDispatcher()
+    subscriber = dispatcher.register(uuid.uuid4(), WebSocketSession(FakeWebSocket(), "test_dispatch").start())
+    dispatcher.clocks[subscriber.user_id] = clock
+    dispatcher._clocks_loaded_at = WALL
+    for symbol in symbols:
+        dispatcher.subscribe(subscriber, symbol)
+    return dispatcher, subscriber
+
+
+async def _sent(subscriber):
+    for _ in range(10):
+        await asyncio.sleep(0)
+    return [(bar.get("S"), bar["t"][11:16]) for frame in subscriber.session.websocket.sent for bar in frame["bars"]]
+
+
+def test_parse_lookback():
+    assert parse_lookback(None) is None
+    assert parse_lookback(30) == 30
+    assert parse_lookback("45") == 45
+    assert parse_lookback("90m") == 90
+    assert parse_lookback("2h") == 120
+    assert parse_lookback("1d") == 390
+    for bad in ("0", -5, "2w", "abc", True):
+        with pytest.raises(ValueError):
+            parse_lookback(bad)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_with_lookback_sends_snapshot(monkeypatch):
+    calls = []
+
+    async def fake_fetch(symbol, start, end, timeframe, feed, sort):
+        calls.append((symbol, start, end))
+        return {"AAPL": _bars(datetime.fromisoformat(start), 60)}
+
+    monkeypatch.setattr(cache, "fetch_bars_from_alpaca", fake_fetch)
+    cache.bar_cache.clear()
+
+    # Wednesday 2024-01-03 10:00:30 ET; the last closed bar is 09:59.
+    sim_time = datetime(2024, 1, 3, 15, 0, 30, tzinfo=timezone.utc)
+    user_id = uuid.uuid4()
+    dispatcher = HistoricalBarDispatcher()
+    dispatcher.clocks[user_id] = SimClock(sim_time, datetime.now(timezone.utc), 1.0, True)
+
+    ws = FakeWebSocket()
+    session = WebSocketSession(ws, "test_lookback").start()
+    subscriber = dispatcher.register(user_id, session)
+    assert dispatcher.subscribe(subscriber, "AAPL", lookback=10)
+
+    subscription = subscriber.subscriptions[("AAPL", 1)]
+    await subscription.snapshot
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    assert len(calls) == 1
+    frame = ws.sent[0]
+    assert frame["snapshot"] is True and frame["symbol"] == "AAPL"
+    assert [bar["t"] for bar in frame["bars"]] == [
+        f"2024-01-03T14:{minute}:00Z" for minute in range(50, 60)
+    ]
+    # Incremental delivery picks up after the snapshot's last bar.
+    assert subscription.cursor == datetime(2024, 1, 3, 14, 59, tzinfo=timezone.utc)
+    assert subscription.snapshot is None
+
+    dispatcher.unregister(subscriber)
+    await session.finish()
+
+
+@pytest.mark.asyncio
+async def test_lookback_snapshot_in_candles(monkeypatch):
+    async def fake_fetch(symbol, start, end, timeframe, feed, sort):
+        return {"AAPL": _bars(datetime.fromisoformat(start), 120)}
+
+    monkeypatch.setattr(cache, "fetch_bars_from_alpaca", fake_fetch)
+    cache.bar_cache.clear()
+
+    # Last closed 1Min bar is 14:57, inside the 14:55 5Min bucket.
+    sim_time = datetime(2024, 1, 3, 14, 58, 10, tzinfo=timezone.utc)
+    user_id = uuid.uuid4()
+    dispatcher = HistoricalBarDispatcher()
+    dispatcher.clocks[user_id] = SimClock(sim_time, datetime.now(timezone.utc), 1.0, True)
+
+    ws = FakeWebSocket()
+    session = WebSocketSession(ws, "test_lookback_candles").start()
+    subscriber = dispatcher.register(user_id, session)
+    assert dispatcher.subscribe(subscriber, "AAPL", lookback=parse_lookback("15m", 5), minutes=5)
+
+    subscription = subscriber.subscriptions[("AAPL", 5)]
+    await subscription.snapshot
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+    frame = ws.sent[0]
+    assert frame["timeframe"] == "5Min" and frame["snapshot"] is True
+    assert [candle["t"] for candle in frame["bars"]] == ["2024-01-03T14:45:00Z", "2024-01-03T14:50:00Z"]
+    assert frame["bars"][0]["v"] == 5
+    assert frame["forming"]["t"] == "2024-01-03T14:55:00Z" and frame["forming"]["v"] == 3
+    assert subscription.open_bucket == datetime(2024, 1, 3, 14, 55, tzinfo=timezone.utc)
+
+    dispatcher.unregister(subscriber)
+    assert dispatcher.aggregators == {}
+    await session.finish()
+
+
+async def _catch_up(monkeypatch, behind_minutes, binary=False):
+    async def fake_fetch(symbol, start, end, timeframe, feed, sort):
+        start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+        return {"AAPL": _bars(start, int((end - start).total_seconds() // 60) + 1)}
+
+    monkeypatch.setattr(cache, "fetch_bars_from_alpaca", fake_fetch)
+    cache.bar_cache.clear()
+
+    # Paused at 20:00:30 UTC on a session day: the last closed bar is 19:59.
+    now = datetime.now(timezone.utc)
+    end = datetime(2024, 1, 3, 19, 59, tzinfo=timezone.utc)
+    user_id = uuid.uuid4()
+    dispatcher = HistoricalBarDispatcher()
+    dispatcher.clocks[user_id] = SimClock(end + timedelta(seconds=90), now, 1.0, True)
+    dispatcher._clocks_loaded_at = now
+
+    ws = FakeWebSocket()
+    session = WebSocketSession(ws, "test_catchup").start()
+    subscriber = dispatcher.register(user_id, session)
+    dispatcher.subscribe(subscriber, "AAPL", binary=binary)
+    subscriber.subscriptions[("AAPL", 1)].cursor = end - timedelta(minutes=behind_minutes)
+
+    await dispatcher.dispatch_once(now)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    dispatcher.unregister(subscriber)
+    await session.finish()
+    return ws.sent
+
+
+@pytest.mark.asyncio
+async def test_large_backlog_is_sent_in_catchup_chunks(monkeypatch):
+    monkeypatch.setattr(dispatcher_module, "CATCHUP_CHUNK_BARS", 100)
+    sent = await _catch_up(monkeypatch, 250)
+
+    chunks, marker = sent[:-1], sent[-1]
+    assert [len(chunk["bars"]) for chunk in chunks] == [100, 100, 50]
+    assert all(chunk["catchup"] is True for chunk in chunks)
+    assert chunks[0]["bars"][0]["t"] == "2024-01-03T15:50:00Z"
+    assert marker == {"symbol": "AAPL", "timeframe": "1Min", "catchup_end": "2024-01-03T19:59:00Z", "count": 250}
+
+
+@pytest.mark.asyncio
+async def test_binary_catchup_and_backlog_cap(monkeypatch):
+    monkeypatch.setattr(dispatcher_module, "CATCHUP_CHUNK_BARS", 100)
+    monkeypatch.setattr(dispatcher_module, "CATCHUP_MAX_BARS", 120)
+    sent = await _catch_up(monkeypatch, 2000, binary=True)
+
+    frames, marker = sent[:-1], sent[-1]
+    assert [meta["flags"] for meta, _ in frames] == [FLAG_CATCHUP, FLAG_CATCHUP]
+    bars = [bar for _, chunk in frames for bar in chunk]
+    assert len(bars) == 120 and bars[0]["t"] == "2024-01-03T18:00:00Z"
+    assert marker["count"] == 120
+
+
+@pytest.mark.asyncio
+async def test_small_backlog_stays_incremental(monkeypatch):
+    sent = await _catch_up(monkeypatch, 5)
+    assert len(sent) == 1 and len(sent[0]["bars"]) == 5 and "catchup" not in sent[0]
+
+
+def test_wall_time_at_skips_closed_market_and_stops_when_paused():
+    # 15:59:30 ET Wednesday at 2x: 30 market seconds to the close, then 60 after Thursday's open.
+    clock = SimClock(datetime(2024, 1, 3, 20, 59, 30, tzinfo=timezone.utc), WALL, 2.0, False)
+    assert clock.wall_time_at(datetime(2024, 1, 4, 14, 31, tzinfo=timezone.utc)) == WALL + timedelta(seconds=45)
+    assert clock.wall_time_at(clock.sim_time - timedelta(minutes=5)) == WALL  # already reached
+    paused = SimClock(clock.sim_time, WALL, 2.0, True)
+    assert paused.wall_time_at(clock.sim_time + timedelta(minutes=1)) is None
+    assert paused.now(WALL + timedelta(hours=1)) == clock.sim_time
+
+
+@pytest.mark.asyncio
+async def test_pushes_follow_the_sim_clock(monkeypatch):
+    _stub_alpaca(monkeypatch)
+    clock = SimClock(SIM, WALL, 1.0, False)
+    dispatcher, subscriber = _dispatcher_for(monkeypatch, clock, "AAPL")
+
+    # At 10:00:30 the 09:59 bar is closed; 10:00 closes 30 real seconds later.
+    wake = await dispatcher.dispatch_once(WALL)
+    assert await _sent(subscriber) == [("AAPL", "14:59")]
+    assert wake == WALL + timedelta(seconds=30) + WAKE_SLACK
+
+    # Early wake-ups send nothing and keep the schedule.
+    assert await dispatcher.dispatch_once(wake - timedelta(seconds=1)) == wake
+    assert await _sent(subscriber) == [("AAPL", "14:59")]
+    assert await dispatcher.dispatch_once(wake) == wake + timedelta(seconds=60)
+    assert await _sent(subscriber) == [("AAPL", "14:59"), ("AAPL", "15:00")]
+
+    # Speed 60 from sim 15:01:10.001: the 15:01 bar closes 49.999 sim seconds (0.8333 real seconds) later.
+    changed_at = wake + timedelta(seconds=10)
+    clock = dispatcher.clocks[subscriber.user_id] = SimClock(clock.now(changed_at), changed_at, 60.0, False)
+    wake = await dispatcher.dispatch_once(changed_at)
+    assert (wake - changed_at).total_seconds() == pytest.approx(49.999 / 60 + 0.001, abs=1e-5)
+    await dispatcher.dispatch_once(changed_at + timedelta(seconds=5))  # sim 15:06:10
+    assert [t for _, t in await _sent(subscriber)][2:] == ["15:01", "15:02", "15:03", "15:04", "15:05"]
+
+    # Paused: nothing more goes out, and only the clock resync is scheduled.
+    paused_at = changed_at + timedelta(seconds=5)
+    dispatcher.clocks[subscriber.user_id] = SimClock(clock.now(paused_at), paused_at, 60.0, True)
+    wake = await dispatcher.dispatch_once(paused_at + timedelta(minutes=1))
+    assert wake == WALL + timedelta(seconds=3600)
+    assert len(await _sent(subscriber)) == 7
+
+    dispatcher.unregister(subscriber)
+    await subscriber.session.finish()
+
+
+@pytest.mark.asyncio
+async def test_read_ahead_refills_once_below_watermark(monkeypatch):
+    calls = _stub_alpaca(monkeypatch)
+    dispatcher, subscriber = _dispatcher_for(monkeypatch, SimClock(SIM, WALL, 1.0, True), "AAPL")
+    subscription = subscriber.subscriptions[("AAPL", 1)]
+
+    def step(minutes):
+        # Paused clocks pin the sim time; speed 1 keeps the 15-minute minimum horizon.
+        dispatcher.clocks[subscriber.user_id] = SimClock(SIM + timedelta(minutes=minutes), WALL, 1.0, True)
+        return dispatcher.dispatch_once(WALL)
+
+    await step(0)
+    assert calls == [("AAPL", "2024-01-03T14:59:00+00:00", "2024-01-03T15:14:00+00:00")]
+    for minute in range(1, 8):
+        await step(minute)  # through 15:06: 8 buffered minutes, above half the horizon
+    assert len(calls) == 1 and subscription.refill is None
+
+    await step(8)  # 15:07 released, 7 minutes left
+    refill = subscription.refill
+    assert refill is not None
+    await step(8)  # a pending refill is not started twice
+    assert subscription.refill is refill
+    await refill
+    assert calls[1:] == [("AAPL", "2024-01-03T15:15:00+00:00", "2024-01-03T15:29:00+00:00")]
+    assert subscription.filled_through == datetime(2024, 1, 3, 15, 29, tzinfo=timezone.utc)
+
+    for minute in range(9, 21):
+        await step(minute)  # through 15:19, across the 15:14 / 15:15 seam
+    assert len(calls) == 2
+    released = [t for _, t in await _sent(subscriber)]
+    first = datetime(2024, 1, 3, 14, 59)
+    assert released == [(first + timedelta(minutes=i)).strftime("%H:%M") for i in range(21)]  # 14:59 .. 15:19
+
+    dispatcher.unregister(subscriber)
+    await subscriber.session.finish()
+
+
+@pytest.mark.asyncio
+async def test_overlapping_windows_are_fetched_once_per_group(monkeypatch):
+    calls = _stub_alpaca(monkeypatch)
+    at = lambda minute: datetime(2024, 1, 3, 15, minute, tzinfo=timezone.utc)
+
+    # Overlapping and adjacent windows merge across symbols; a disjoint one stays apart.
+    batches = _batch_windows({
+        "AAPL": [(at(0), at(9))],
+        "MSFT": [(at(5), at(14))],
+        "QQQ": [(at(15), at(19))],
+        "TSLA": [(at(40), at(44))],
+    })
+    assert batches == [(["AAPL", "MSFT", "QQQ"], at(0), at(19)), (["TSLA"], at(40), at(44))]
+
+    symbols, start, end = batches[0]
+    result = await cache.bar_cache.get_bars(symbols, start, end)
+    assert calls == [("AAPL,MSFT,QQQ", at(0).isoformat(), at(19).isoformat())]
+    for symbol in symbols:
+        assert len(result[symbol]) == 20 and {bar["S"] for bar in result[symbol]} == {symbol}
+
+    # Cached ranges are served locally; only the uncached tail goes upstream, still grouped.
+    await cache.bar_cache.get_bars(["QQQ", "MSFT"], at(5), at(19))
+    result = await cache.bar_cache.get_bars(["AAPL", "MSFT"], at(10), at(24))
+    # (Gaps start at the covered edge, so the 15:19 bar is re-read and deduplicated.)
+    assert calls[1:] == [("AAPL,MSFT", at(19).isoformat(), at(24).isoformat())]
+    for symbol in ("AAPL", "MSFT"):
+        assert [bar["t"][11:16] for bar in result[symbol]][-6:] == ["15:19", "15:20", "15:21", "15:22", "15:23", "15:24"]
+        assert len(result[symbol]) == 15 and {bar["S"] for bar in result[symbol]} == {symbol}
+
+
+@pytest.mark.asyncio
+async def test_socket_symbols_share_fetches_and_refills(monkeypatch):
+    calls = _stub_alpaca(monkeypatch)
+    dispatcher, subscriber = _dispatcher_for(monkeypatch, SimClock(SIM, WALL, 1.0, True), "MSFT", "AAPL")
+    aapl, msft = subscriber.subscriptions[("AAPL", 1)], subscriber.subscriptions[("MSFT", 1)]
+
+    await dispatcher.dispatch_once(WALL)
+    assert calls == [("AAPL,MSFT", "2024-01-03T14:59:00+00:00", "2024-01-03T15:14:00+00:00")]
+    assert sorted(await _sent(subscriber)) == [("AAPL", "14:59"), ("MSFT", "14:59")]
+    assert {bar["S"] for _, bar in aapl.buffer} == {"AAPL"} and {bar["S"] for _, bar in msft.buffer} == {"MSFT"}
+
+    # Both buffers cross the watermark together: one task refills both.
+    dispatcher.clocks[subscriber.user_id] = SimClock(SIM + timedelta(minutes=8), WALL, 1.0, True)
+    await dispatcher.dispatch_once(WALL)
+    refill = aapl.refill
+    assert refill is not None and msft.refill is refill
+    await refill
+    assert calls[1:] == [("AAPL,MSFT", "2024-01-03T15:15:00+00:00", "2024-01-03T15:29:00+00:00")]
+    for subscription in (aapl, msft):
+        assert subscription.filled_through == datetime(2024, 1, 3, 15, 29, tzinfo=timezone.utc)
+        assert {bar["S"] for _, bar in subscription.buffer} == {subscription.symbol}
+
+    sent = await _sent(subscriber)
+    assert [t for symbol, t in sent if symbol == "AAPL"] == [t for symbol, t in sent if symbol == "MSFT"]
+    assert len(sent) == 2 * 9  # 14:59 .. 15:07 for each symbol
+
+    dispatcher.unregister(subscriber)
+    await subscriber.session.finish()
+
+
+@pytest.mark.asyncio
+async def test_clock_invalidated_during_fetch(monkeypatch):
+    calls = _stub_alpaca(monkeypatch)
+    stub = cache.fetch_bars_from_alpaca
+    dispatcher, first = _dispatcher_for(monkeypatch, SimClock(SIM, WALL, 1.0, True), "AAPL")
+    second = dispatcher.register(uuid.uuid4(), WebSocketSession(FakeWebSocket(), "test_dispatch").start())
+    dispatcher.clocks[second.user_id] = SimClock(SIM, WALL, 1.0, True)
+    dispatcher.subscribe(second, "AAPL")
+
+    async def fetch_then_change_speed(**kwargs):
+        dispatcher.invalidate_clock(first.user_id)  # e.g. PUT /user-settings/speed meanwhile
+        return await stub(**kwargs)
+
+    monkeypatch.setattr(cache, "fetch_bars_from_alpaca", fetch_then_change_speed)
+    await dispatcher.dispatch_once(WALL)
+    assert len(calls) == 1 and first.user_id not in dispatcher.clocks
+    for subscriber in (first, second):
+        assert await _sent(subscriber) == [("AAPL", "14:59")]
+        dispatcher.unregister(subscriber)
+        await subscriber.session.finish()
+
+
+@pytest.mark.asyncio
+async def test_sockets_replaying_the_same_window_share_one_fetch(monkeypatch):
+    calls = _stub_alpaca(monkeypatch)
+    dispatcher, first = _dispatcher_for(monkeypatch, SimClock(SIM, WALL, 1.0, True), "AAPL")
+    # Another user, and a second tab of the first user, at the same sim time.
+    others = []
+    for user_id in (uuid.uuid4(), first.user_id):
+        subscriber = dispatcher.register(user_id, WebSocketSession(FakeWebSocket(), "test_dispatch").start())
+        dispatcher.clocks[user_id] = SimClock(SIM, WALL, 1.0, True)
+        dispatcher.subscribe(subscriber, "AAPL")
+        others.append(subscriber)
+
+    await dispatcher.dispatch_once(WALL)
+    assert calls == [("AAPL", "2024-01-03T14:59:00+00:00", "2024-01-03T15:14:00+00:00")]
+    for subscriber in [first] + others:
+        assert await _sent(subscriber) == [("AAPL", "14:59")]
+        dispatcher.unregister(subscriber)
+        await subscriber.session.finish()
@@ -0,0 +1,64 @@
+"""
+@fileoverview
+Tests for the binary frame codecs:
+- historical bar frames
+- /ws/market frames (symbol dictionary, trades, conflated trades, bars; other kinds skipped)
+"""
+
+import json
+
+import pytest
+
+from app.websocket.codec import (
+    FLAG_CATCHUP, decode_bars, decode_market, encode_bars, encode_market, encode_symbols, timestamp_ns,
+)
+
+
+def test_round_trip():
+    bars = [
+        {"t": "2024-01-03T14:30:00Z", "o": 100.5, "h": 101, "l": 99.25, "c": 100, "v": 1200, "n": 14, "vw": 100.2},
+        {"t": "2024-01-03T14:31:00Z", "o": 100, "h": 100.5, "l": 99, "c": 99.5, "v": 800},
+    ]
+    frame = encode_bars("AAPL", "5Min", bars, FLAG_CATCHUP)
+    meta, decoded = decode_bars(frame)
+    assert meta == {"symbol": "AAPL", "timeframe": "5Min", "flags": FLAG_CATCHUP}
+    assert decoded[0] == bars[0]
+    assert decoded[1] == {**bars[1], "n": 0}
+    assert len(frame) < len(str(bars))
+
+
+def test_rejects_foreign_frames():
+    with pytest.raises(ValueError):
+        decode_bars(b"XX\x01\x00")
+
+
+def test_market_round_trip():
+    items = [
+        {"T": "t", "S": "AAPL", "t": "2024-01-03T15:00:07.123456789Z", "p": 190.25, "s": 100, "x": "V", "c": ["@"]},
+        {"T": "t", "S": "MSFT", "t": "2024-01-03T15:00:08Z", "p": 410.0, "s": 5, "h": 411.0, "l": 409.5, "v": 55, "n": 3},
+        {"T": "u", "S": "AAPL", "t": "2024-01-03T15:00:00Z", "o": 1, "h": 2, "l": 0.5, "c": 1.5, "v": 900, "n": 9, "vw": 1.2},
+        {"T": "b", "S": "AAPL", "tf": "5Sec", "t": "2024-01-03T15:00:05Z", "o": 1, "h": 1, "l": 1, "c": 1, "v": 10, "n": 1},
+    ]
+    ids = {"AAPL": 0, "MSFT": 7}
+    dictionary = {}
+    assert decode_market(encode_symbols((i, s) for s, i in ids.items()), dictionary) == []
+    assert dictionary == {0: "AAPL", 7: "MSFT"}
+
+    frame = encode_market(items, ids)
+    decoded = decode_market(frame, dictionary)
+    assert decoded[0] == {"T": "t", "S": "AAPL", "t": "2024-01-03T15:00:07.123456789Z", "p": 190.25, "s": 100}
+    assert decoded[1] == {**items[1], "s": 5.0}
+    assert decoded[2] == items[2]
+    assert decoded[3] == items[3]
+    assert len(frame) * 2 < len(json.dumps(items))
+
+    # Other kinds are skipped before their symbol or timestamp is looked at.
+    others = [{"T": "q", "S": "TSLA", "bp": 1.0}, {"T": "subscription", "trades": ["AAPL"]}]
+    assert decode_market(encode_market(others + items[:1], ids), dictionary) == decoded[:1]
+
+
+def test_timestamp_ns():
+    assert timestamp_ns("1970-01-01T00:00:01Z") == 1_000_000_000
+    assert timestamp_ns("1970-01-01T00:00:01.5Z") == 1_500_000_000
+    with pytest.raises(ValueError):
+        decode_market(b"WB\x01", {})
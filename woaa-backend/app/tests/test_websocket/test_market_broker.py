@@ -0,0 +1,105 @@
+"""
+@fileoverview
+Tests for the shared market stream broker:
+- one worker owns upstream; another follows through the Unix socket
+- follower subscriptions are aggregated upstream and routed data flows back
+- followers take over when the owner goes away, subscribing their clients upstream
+"""
+
+import asyncio
+
+import pytest
+
+from app.websocket.market_broker import FOLLOWER, OWNER, MarketBroker
+from app.websocket.real_time_trades import AlpacaWebSocketManager
+from app.websocket.session import WebSocketSession
+from app.tests.test_websocket.test_real_time_trades import FakeClient
+from app.tests.test_websocket.test_upstream_pool import AlpacaSocket
+
+
+async def _settle(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def _worker(tmp_path):
+    manager = AlpacaWebSocketManager()
+    manager.broker = MarketBroker(manager, socket_path=str(tmp_path / "market.sock"), lock_path=str(tmp_path / "market.lock"))
+    return manager
+
+
+def _subscriptions(upstream):
+    """Commands an owner sent upstream after the auth handshake."""
+    return [command for command in upstream.commands if command["action"] != "auth"]
+
+
+@pytest.mark.asyncio
+async def test_follower_shares_the_owner_stream(tmp_path, monkeypatch):
+    async def alpaca_connect(url):
+        return AlpacaSocket()
+
+    # Owners go through the real connect / auth / resubscribe path.
+    monkeypatch.setattr("app.websocket.real_time_trades.websockets.connect", alpaca_connect)
+    owner, follower = _worker(tmp_path), _worker(tmp_path)
+    await owner.broker.start()
+    await follower.broker.start()
+    assert owner.broker.role == OWNER and follower.broker.role == FOLLOWER
+
+    client = FakeClient()
+    session = WebSocketSession(client, "test_broker").start()
+    follower.register_client(session)
+    await follower.subscribe_symbol(session, "AAPL", "trades")
+    await _settle(lambda: _subscriptions(owner.ws))
+    assert _subscriptions(owner.ws) == [{"action": "subscribe", "trades": ["AAPL"]}]
+
+    owner.handle_upstream_batch([{"T": "t", "S": "AAPL", "p": 190.0}, {"T": "t", "S": "MSFT", "p": 410.0}])
+    await _settle(lambda: client.sent)
+    assert client.sent == [[{"T": "t", "S": "AAPL", "p": 190.0}]]
+
+    await follower.unregister_client(session)
+    await _settle(lambda: len(_subscriptions(owner.ws)) == 2)
+    assert owner.ws.commands[-1] == {"action": "unsubscribe", "trades": ["AAPL"]}
+
+    # Owner exits: the follower takes the lock and subscribes SPY upstream itself.
+    await follower.subscribe_symbol(session, "SPY", "trades")
+    await _settle(lambda: len(_subscriptions(owner.ws)) == 3)
+    await owner.broker.stop()
+    await _settle(lambda: follower.broker.role == OWNER and follower.ws is not None and _subscriptions(follower.ws))
+    assert _subscriptions(follower.ws) == [{"action": "subscribe", "trades": ["SPY"]}]
+
+    await owner.stop()
+    await follower.stop()
+    await session.finish()
+
+
+@pytest.mark.asyncio
+async def test_promoted_follower_subscribes_its_clients_upstream(tmp_path, monkeypatch):
+    async def alpaca_connect(url):
+        return AlpacaSocket()
+
+    # No connect() stub: promotion goes through the real connect / auth / placement path.
+    monkeypatch.setattr("app.websocket.real_time_trades.websockets.connect", alpaca_connect)
+    owner, follower = AlpacaWebSocketManager(), AlpacaWebSocketManager()
+    for manager in (owner, follower):
+        manager.broker = MarketBroker(manager, socket_path=str(tmp_path / "market.sock"), lock_path=str(tmp_path / "market.lock"))
+    await owner.broker.start()
+    await follower.broker.start()
+
+    session = WebSocketSession(FakeClient(), "test_broker").start()
+    follower.register_client(session)
+    await follower.subscribe_symbol(session, "SPY", "trades")
+    await follower.subscribe_symbol(session, "QQQ", "bars")
+    await _settle(lambda: len(owner.ws.commands) == 2)  # auth + the forwarded subscribe; nothing pending locally
+    assert follower.pool.placement == {}
+
+    await owner.broker.stop()
+    await _settle(lambda: follower.broker.role == OWNER and follower.ws is not None and len(follower.ws.commands) == 2)
+    assert follower.ws.commands[0]["action"] == "auth"
+    assert follower.ws.commands[1] == {"action": "subscribe", "trades": ["SPY"], "bars": ["QQQ"]}
+    assert follower.pool.placement.keys() == {("trades", "SPY"), ("bars", "QQQ")}
+
+    await owner.stop()
+    await follower.stop()
+    await session.finish()
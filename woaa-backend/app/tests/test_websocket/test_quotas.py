@@ -0,0 +1,105 @@
+"""
+@fileoverview
+Tests for WebSocket quotas:
+- per-user socket limits, counted per endpoint, and the global socket cap
+- symbols per socket and per user, counted as distinct symbols
+- the global upstream-symbol cap only refuses symbols not already upstream
+- admin changes apply to open sockets
+- /ws/market refuses an extra socket and an extra symbol with a clear error
+"""
+
+import asyncio
+
+import pytest
+
+from app.tests.test_websocket.test_real_time_trades import FakeUpstream, SilentBrowser, _authenticate, _drain
+from app.websocket import quotas, real_time_trades
+from app.websocket.quotas import QuotaExceeded, QuotaLimits, WebSocketQuotas
+from app.websocket.real_time_trades import AlpacaWebSocketManager
+
+
+def test_socket_limits(monkeypatch):
+    registry = WebSocketQuotas()
+    limits = QuotaLimits(sockets=2)
+    first = registry.open("alice", "market", limits, set)
+    registry.open("alice", "market", limits, set)
+    for _ in range(2):
+        registry.open("alice", "historical_bars", limits, set)  # its own allowance
+    with pytest.raises(QuotaExceeded) as refused:
+        registry.open("alice", "market", limits, set)
+    assert (refused.value.quota, refused.value.limit) == ("sockets", 2)
+
+    registry.close(first)
+    registry.open("alice", "market", limits, set)
+
+    monkeypatch.setattr(quotas, "WS_MAX_SOCKETS", 5)
+    registry.open("bob", "market", limits, set)
+    with pytest.raises(QuotaExceeded) as refused:
+        registry.open("carol", "market", limits, set)
+    assert refused.value.quota == "global_sockets"
+    assert registry.status()["rejected"] == {"sockets": 1, "global_sockets": 1}
+
+
+def test_symbol_limits():
+    registry = WebSocketQuotas()
+    limits = QuotaLimits(symbols_per_socket=3, symbols=3)
+    a, b = {"AAPL", "MSFT", "QQQ"}, {"AAPL"}
+    first = registry.open("alice", "market", limits, lambda: a)
+    second = registry.open("alice", "historical_bars", limits, lambda: b)
+
+    registry.check_symbol(first, "AAPL")  # already held: free
+    with pytest.raises(QuotaExceeded) as refused:
+        registry.check_symbol(first, "SPY")
+    assert refused.value.quota == "symbols_per_socket"
+
+    registry.check_symbol(second, "MSFT")  # held by the user on another socket
+    with pytest.raises(QuotaExceeded) as refused:
+        registry.check_symbol(second, "TSLA")
+    assert refused.value.quota == "symbols"
+
+    # An admin raising the limits applies to the open sockets.
+    registry.set_limits("alice", QuotaLimits(symbols_per_socket=5, symbols=10))
+    registry.check_symbol(first, "TSLA")
+
+
+def test_upstream_cap(monkeypatch):
+    registry = WebSocketQuotas()
+    registry.check_upstream(1000)  # 0 = no cap
+    monkeypatch.setattr(quotas, "WS_MAX_UPSTREAM_SYMBOLS", 2)
+    registry.check_upstream(1)
+    with pytest.raises(QuotaExceeded) as refused:
+        registry.check_upstream(2)
+    assert refused.value.quota == "upstream_symbols"
+
+
+@pytest.mark.asyncio
+async def test_market_ws_enforces_quotas(monkeypatch):
+    monkeypatch.setattr(real_time_trades, "alpaca_ws_manager", AlpacaWebSocketManager())
+    monkeypatch.setattr(real_time_trades, "websocket_quotas", WebSocketQuotas())
+    _authenticate(monkeypatch, limits=QuotaLimits(sockets=1, symbols_per_socket=2))
+    manager = real_time_trades.alpaca_ws_manager
+    manager.ws = FakeUpstream()
+
+    first = SilentBrowser(*(
+        {"action": "subscribe", "symbol": symbol, "type": type_}
+        for symbol, type_ in (("AAPL", "trades"), ("AAPL", "bars"), ("MSFT", "trades"), ("SPY", "trades"))
+    ))
+    handler = asyncio.create_task(real_time_trades.market_ws(first))
+    await asyncio.sleep(0.01)
+    await _drain()
+
+    assert manager.distinct_symbols(next(iter(manager.subscribers))) == {"AAPL", "MSFT"}
+    assert first.sent == [{
+        "type": "error", "symbol": "SPY", "quota": "symbols_per_socket", "limit": 2,
+        "message": "Too many symbols on this connection (limit 2)",
+    }]
+
+    second = SilentBrowser()
+    await real_time_trades.market_ws(second)
+    assert second.sent[0]["quota"] == "sockets" and second.closed_with == 1008
+    assert len(manager.subscribers) == 1
+
+    first.inbox.put_nowait(None)  # disconnect frees the socket slot
+    await handler
+    assert real_time_trades.websocket_quotas.sockets == 0
+    await manager.stop()
@@ -0,0 +1,463 @@
+"""
+@fileoverview
+Tests for AlpacaWebSocketManager fan-out:
+- upstream batches are routed per (type, symbol) to subscribed clients only
+- control messages are not forwarded
+- a slow client never stalls the upstream read; conflate / disconnect policies
+- frames are encoded once per subscription signature
+- rate-limited subscriptions get conflated trades
+- reference counts send upstream (un)subscribe exactly on 0 <-> 1 transitions
+- upstream changes are debounced into one command per action; opposites cancel
+- new subscribers get the last trade / bar immediately
+- binary-subprotocol clients get shared market frames plus their own symbol dictionary
+- a client that stops answering heartbeats is reaped and its subscriptions released
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app.websocket import real_time_trades, session as session_module
+from app.websocket.codec import decode_market
+from app.websocket.conflation import conflate_interval
+from app.websocket.quotas import QuotaLimits
+from app.websocket.real_time_trades import AlpacaWebSocketManager
+from app.websocket.session import OverflowPolicy, WebSocketSession
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+        self.raw = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.raw.append(text)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000):
+        pass
+
+
+class FakeUpstream:
+    """Stands in for the Alpaca socket: records commands, replays queued messages."""
+
+    def __init__(self, messages=()):
+        self.close_code = None
+        self.commands = []
+        self.messages = list(messages)
+
+    async def send(self, text):
+        self.commands.append(json.loads(text))
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for message in self.messages:
+            yield message
+
+
+async def _drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def _client(manager, **kwargs):
+    ws = FakeClient()
+    session = WebSocketSession(ws, "test_market", **kwargs).start()
+    manager.register_client(session)
+    return ws, session
+
+
+@pytest.mark.asyncio
+async def test_batches_are_routed_per_symbol():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    aapl, aapl_session = await _client(manager)
+    msft, msft_session = await _client(manager)
+    both, both_session = await _client(manager)
+
+    await manager.subscribe_symbol(aapl_session, "AAPL", "trades")
+    await manager.subscribe_symbol(msft_session, "MSFT", "trades")
+    await manager.subscribe_symbol(both_session, "AAPL", "trades")
+    await manager.subscribe_symbol(both_session, "MSFT", "bars")
+    await manager.flush_upstream()
+    assert manager.ws.commands == [{"action": "subscribe", "trades": ["AAPL", "MSFT"], "bars": ["MSFT"]}]
+
+    manager.ws.messages = [json.dumps([
+        {"T": "success", "msg": "authenticated"},
+        {"T": "t", "S": "AAPL", "p": 190.1},
+        {"T": "t", "S": "MSFT", "p": 410.5},
+        {"T": "b", "S": "MSFT", "c": 410.0},
+        {"T": "t", "S": "TSLA", "p": 250.0},
+        {"T": "t", "S": "AAPL", "p": 190.2},
+    ])]
+    await manager.receive_data()
+    await _drain()
+
+    assert aapl.sent == [[{"T": "t", "S": "AAPL", "p": 190.1}, {"T": "t", "S": "AAPL", "p": 190.2}]]
+    assert msft.sent == [[{"T": "t", "S": "MSFT", "p": 410.5}]]
+    assert len(both.sent) == 1
+    assert sorted((item["T"], item["S"]) for item in both.sent[0]) == [("b", "MSFT"), ("t", "AAPL"), ("t", "AAPL")]
+
+    for session in (aapl_session, msft_session, both_session):
+        await manager.unregister_client(session)
+        await session.finish()
+    assert manager.routes == {}
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_unsubscribed_client_stops_receiving():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    ws, session = await _client(manager)
+    await manager.subscribe_symbol(session, "AAPL", "trades")
+    await manager.flush_upstream()
+    await manager.unsubscribe_symbol(session, "AAPL", "trades")
+    await manager.flush_upstream()
+
+    assert manager.route_batch([{"T": "t", "S": "AAPL", "p": 1}]) == {}
+    assert manager.ws.commands[-1] == {"action": "unsubscribe", "trades": ["AAPL"]}
+    await manager.unregister_client(session)
+    await session.finish()
+    await manager.stop()
+
+
+def _trades(*ticks):
+    return json.dumps([{"T": "t", "S": symbol, "p": price} for symbol, price in ticks])
+
+
+@pytest.mark.asyncio
+async def test_slow_clients_do_not_block_upstream():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    fast, fast_session = await _client(manager)
+    conflating, conflating_session = await _client(manager, max_queue=4, policy=OverflowPolicy.COALESCE)
+    dropping, dropping_session = await _client(manager, max_queue=2, policy=OverflowPolicy.DISCONNECT)
+    for session in (fast_session, conflating_session, dropping_session):
+        await manager.subscribe_symbol(session, "AAPL", "trades")
+        await manager.subscribe_symbol(session, "MSFT", "trades")
+    await _drain()
+    conflating.gate.clear()  # stalled browsers
+    dropping.gate.clear()
+
+    manager.ws.messages = [_trades(("AAPL", i), ("MSFT", 100 + i)) for i in range(10)]
+    await asyncio.wait_for(manager.receive_data(), timeout=1)
+    await _drain()
+
+    assert len(fast.sent) == 10
+    # Conflation keeps only the newest pending frame per (type, symbol).
+    assert conflating_session.coalesced == 18
+    conflating.gate.set()
+    await _drain()
+    assert conflating.sent == [[{"T": "t", "S": "AAPL", "p": 9}], [{"T": "t", "S": "MSFT", "p": 109}]]
+    # The client that overflowed was dropped without the read loop waiting on it.
+    assert dropping_session.closed and dropping_session not in manager.subscribers
+    assert manager.routes[("trades", "AAPL")] == {fast_session, conflating_session}
+
+    for session in (fast_session, conflating_session, dropping_session):
+        await manager.unregister_client(session)
+        await session.finish()
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_identical_subscriptions_share_one_encoded_frame(monkeypatch):
+    encodes = []
+    real_dumps = json.dumps
+    monkeypatch.setattr("app.websocket.real_time_trades.json.dumps", lambda obj: encodes.append(obj) or real_dumps(obj))
+
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    clients = [await _client(manager) for _ in range(5)]
+    for _, session in clients:
+        await manager.subscribe_symbol(session, "SPY", "trades")
+    other, other_session = await _client(manager)
+    await manager.subscribe_symbol(other_session, "SPY", "trades")
+    await manager.subscribe_symbol(other_session, "QQQ", "trades")
+
+    manager.ws.messages = [_trades(("SPY", 500), ("QQQ", 430))]
+    encodes.clear()
+    await manager.receive_data()
+    await _drain()
+
+    assert len(encodes) == 2  # one per distinct subscription signature
+    raws = [ws.raw[0] for ws, _ in clients]
+    assert all(raw is raws[0] for raw in raws)
+    assert json.loads(raws[0]) == [{"T": "t", "S": "SPY", "p": 500}]
+    assert len(other.sent[0]) == 2
+
+    for _, session in clients + [(other, other_session)]:
+        await manager.unregister_client(session)
+        await session.finish()
+    await manager.stop()
+
+
+def test_conflate_interval():
+    assert conflate_interval(4) == 0.25
+    assert conflate_interval(1000) == 0.05
+    for bad in (0, -1, "4", True):
+        with pytest.raises(ValueError):
+            conflate_interval(bad)
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_subscription_gets_conflated_trades():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    raw, raw_session = await _client(manager)
+    slow, slow_session = await _client(manager)
+    await manager.subscribe_symbol(raw_session, "SPY", "trades")
+    await manager.subscribe_symbol(slow_session, "SPY", "trades", max_rate=4)
+    await manager.flush_upstream()
+    assert manager.ws.commands == [{"action": "subscribe", "trades": ["SPY"]}]
+
+    prints = [(501.0, 100), (503.5, 50), (499.25, 10), (502.0, 40)]
+    manager.ws.messages = [
+        json.dumps([{"T": "t", "S": "SPY", "p": price, "s": size, "t": f"2024-01-03T15:00:0{i}Z"}])
+        for i, (price, size) in enumerate(prints)
+    ]
+    await manager.receive_data()
+    conflator = manager.conflators[("SPY", 0.25)]
+    manager.flush_conflator(conflator)
+    manager.flush_conflator(conflator)  # nothing new printed: no frame
+    await _drain()
+
+    assert len(raw.sent) == 4
+    assert slow.sent == [[{
+        "T": "t", "S": "SPY", "p": 502.0, "s": 40, "t": "2024-01-03T15:00:03Z",
+        "h": 503.5, "l": 499.25, "v": 200, "n": 4,
+    }]]
+
+    # Dropping back to the raw stream removes the shared conflator.
+    await manager.subscribe_symbol(slow_session, "SPY", "trades")
+    assert manager.conflators == {} and manager.conflators_by_symbol == {}
+    await _drain()
+    assert conflator.task.cancelled()
+    for session in (raw_session, slow_session):
+        await manager.unregister_client(session)
+        await session.finish()
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_upstream_commands_follow_reference_counts():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    sessions = [(await _client(manager))[1] for _ in range(3)]
+    for session in sessions:
+        await manager.subscribe_symbol(session, "AAPL", "trades")
+        await manager.subscribe_symbol(session, "AAPL", "trades")  # repeat is a no-op
+    await manager.subscribe_symbol(sessions[0], "AAPL", "trades", max_rate=2)  # rate change keeps the count
+    assert manager.refcounts == {("trades", "AAPL"): 3}
+    await manager.flush_upstream()
+    assert manager.ws.commands == [{"action": "subscribe", "trades": ["AAPL"]}]
+
+    await manager.unsubscribe_symbol(sessions[0], "AAPL", "trades")
+    await manager.unregister_client(sessions[1])
+    await manager.flush_upstream()
+    assert manager.ws.commands[-1]["action"] == "subscribe"
+    await manager.unregister_client(sessions[2])
+    await manager.flush_upstream()
+    assert manager.ws.commands[1:] == [{"action": "unsubscribe", "trades": ["AAPL"]}]
+    assert manager.refcounts == {} and manager.symbols["trades"] == set()
+
+    for session in sessions:
+        await manager.unregister_client(session)
+        await session.finish()
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_upstream_changes_are_debounced(monkeypatch):
+    monkeypatch.setattr("app.websocket.real_time_trades.UPSTREAM_DEBOUNCE_SECONDS", 0.01)
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    dashboard, dashboard_session = await _client(manager)
+    await manager.subscribe_symbol(dashboard_session, "SPY", "trades")
+    await asyncio.sleep(0.05)
+    assert manager.ws.commands == [{"action": "subscribe", "trades": ["SPY"]}]
+
+    # A dashboard opening many symbols, with one quickly reopened elsewhere.
+    symbols = [f"S{i}" for i in range(20)]
+    for symbol in symbols:
+        await manager.subscribe_symbol(dashboard_session, symbol, "trades")
+    await manager.subscribe_symbol(dashboard_session, "S0", "bars")
+    await manager.unsubscribe_symbol(dashboard_session, "S0", "bars")  # never reaches upstream
+    await manager.unsubscribe_symbol(dashboard_session, "SPY", "trades")
+    other, other_session = await _client(manager)
+    await manager.subscribe_symbol(other_session, "SPY", "trades")  # cancels the unsubscribe
+    assert manager.pending_upstream == {("trades", symbol): "subscribe" for symbol in symbols}
+    await asyncio.sleep(0.05)
+
+    assert manager.ws.commands[1:] == [{"action": "subscribe", "trades": symbols}]
+    assert manager.symbols["trades"] == set(symbols) | {"SPY"}
+
+    for session in (dashboard_session, other_session):
+        await manager.unregister_client(session)
+        await session.finish()
+    await manager.flush_upstream()
+    assert manager.ws.commands[-1]["action"] == "unsubscribe"
+    assert sorted(manager.ws.commands[-1]["trades"]) == sorted(symbols + ["SPY"])
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_new_subscriber_gets_last_value():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    early, early_session = await _client(manager)
+    await manager.subscribe_symbol(early_session, "AAPL", "trades")
+    await manager.subscribe_symbol(early_session, "AAPL", "bars")
+    manager.handle_upstream_batch([
+        {"T": "t", "S": "AAPL", "p": 190.1},
+        {"T": "t", "S": "AAPL", "p": 190.2},
+        {"T": "b", "S": "AAPL", "c": 190.0},
+    ])
+
+    late, late_session = await _client(manager)
+    await manager.subscribe_symbol(late_session, "AAPL", "trades")
+    await manager.subscribe_symbol(late_session, "MSFT", "trades")  # nothing seen yet
+    await _drain()
+    assert late.sent == [[{"T": "t", "S": "AAPL", "p": 190.2}]]
+    assert manager.last_values.latest(["AAPL"])["AAPL"]["bar"] == {"T": "b", "S": "AAPL", "c": 190.0}
+
+    for session in (early_session, late_session):
+        await manager.unregister_client(session)
+        await session.finish()
+    await manager.stop()
+
+
+class BinaryClient(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.symbols = {}
+        self.frames = []
+
+    async def send_bytes(self, data):
+        self.raw.append(data)
+        self.frames.append(decode_market(data, self.symbols))
+
+
+@pytest.mark.asyncio
+async def test_binary_clients_share_frames_with_own_dictionary():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    clients = []
+    for _ in range(2):
+        ws = BinaryClient()
+        session = WebSocketSession(ws, "test_market").start()
+        manager.register_client(session, binary=True)
+        clients.append((ws, session))
+    text, text_session = await _client(manager)
+    for _, session in clients + [(text, text_session)]:
+        await manager.subscribe_symbol(session, "AAPL", "trades")
+
+    trade = {"T": "t", "S": "AAPL", "t": "2024-01-03T15:00:01Z", "p": 190.5, "s": 10}
+    manager.handle_upstream_batch([trade])
+    manager.handle_upstream_batch([{**trade, "p": 190.75}])
+    await _drain()
+
+    (first, first_session), (second, second_session) = clients
+    assert first.frames == [[], [{**trade, "s": 10.0}], [{**trade, "p": 190.75, "s": 10.0}]]  # dictionary first
+    assert first.raw[1] is second.raw[1]  # data frames are encoded once for both
+    assert text.sent == [[trade], [{**trade, "p": 190.75}]]
+
+    # A late binary subscriber gets the dictionary entry, then the last value.
+    late = BinaryClient()
+    late_session = WebSocketSession(late, "test_market").start()
+    manager.register_client(late_session, binary=True)
+    await manager.subscribe_symbol(late_session, "AAPL", "trades")
+    await _drain()
+    assert late.frames == [[], [{**trade, "p": 190.75, "s": 10.0}]]
+
+    for _, session in clients + [(text, text_session), (late, late_session)]:
+        await manager.unregister_client(session)
+        await session.finish()
+    assert manager.binary_clients == {}
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_overflow_never_drops_the_dictionary():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    ws = BinaryClient()
+    session = WebSocketSession(ws, "test_market", max_queue=2, policy=OverflowPolicy.DROP_OLDEST).start()
+    manager.register_client(session, binary=True)
+    await manager.subscribe_symbol(session, "AAPL", "trades")
+
+    # The announcement and three data frames arrive before the writer runs.
+    trade = {"T": "t", "S": "AAPL", "t": "2024-01-03T15:00:01Z", "p": 190.5, "s": 10}
+    for price in (190.5, 190.75, 191.0):
+        manager.handle_upstream_batch([{**trade, "p": price}])
+    assert session.dropped == 2
+    await _drain()
+    assert ws.frames == [[], [{**trade, "p": 191.0, "s": 10.0}]]
+    assert ws.symbols == {manager.symbol_ids["AAPL"]: "AAPL"}
+
+    await manager.unregister_client(session)
+    await session.finish()
+    await manager.stop()
+
+
+def _authenticate(monkeypatch, user_id="user-1", limits=None):
+    async def user_from_token(websocket):
+        return SimpleNamespace(id=user_id)
+
+    async def user_limits(user_id):
+        return limits or QuotaLimits()
+
+    monkeypatch.setattr(real_time_trades, "get_current_user_ws", user_from_token)
+    monkeypatch.setattr(real_time_trades, "load_limits", user_limits)
+
+
+class SilentBrowser(FakeClient):
+    """A /ws/market peer that subscribes once, then never answers again (a dead tab)."""
+
+    scope = {"subprotocols": []}
+
+    def __init__(self, *messages):
+        super().__init__()
+        self.inbox = asyncio.Queue()
+        for message in messages:
+            self.inbox.put_nowait(json.dumps(message))
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+    async def receive_text(self):
+        message = await self.inbox.get()
+        if message is None:
+            raise WebSocketDisconnect(1000)
+        return message
+
+
+@pytest.mark.asyncio
+async def test_dead_client_is_reaped_and_released(monkeypatch):
+    monkeypatch.setattr(session_module, "HEARTBEAT_SECONDS", 0.01)
+    monkeypatch.setattr(session_module, "HEARTBEAT_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(real_time_trades, "alpaca_ws_manager", AlpacaWebSocketManager())
+    _authenticate(monkeypatch)
+    manager = real_time_trades.alpaca_ws_manager
+    manager.ws = FakeUpstream()
+
+    browser = SilentBrowser({"action": "subscribe", "symbol": "AAPL", "type": "trades"})
+    await asyncio.wait_for(real_time_trades.market_ws(browser), timeout=1)
+
+    assert {"type": "ping"} in browser.sent
+    assert manager.subscribers == {} and manager.refcounts == {}
+    await manager.flush_upstream()
+    assert manager.symbols["trades"] == set() and manager.pool.placement == {}
+    assert session_module.session_metrics()["endpoints"]["market"]["reaped"] >= 1
+    await manager.stop()
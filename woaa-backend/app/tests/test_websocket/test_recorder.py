@@ -0,0 +1,89 @@
+"""
+@fileoverview
+Tests for the live-stream tick recorder:
+- trades and bars are partitioned into gzip segments by their own timestamps
+- batches append gzip members, each described by an index line
+- replay filters by symbol and time through the index
+- the manager records what it reads from upstream
+- the flush loop keeps running after any write error
+"""
+
+import asyncio
+import gzip
+import json
+import os
+
+import pytest
+
+from app.tests.test_websocket.test_real_time_trades import FakeUpstream
+from app.websocket.real_time_trades import AlpacaWebSocketManager
+from app.websocket.recorder import TickRecorder, index_path, item_epoch, list_segments, read_segment
+
+
+def _trade(symbol, t, price=1.0):
+    return {"T": "t", "S": symbol, "p": price, "t": t}
+
+
+@pytest.mark.asyncio
+async def test_segments_index_and_replay(tmp_path):
+    recorder = TickRecorder(str(tmp_path), segment_seconds=3600)
+    recorder.record([
+        {"T": "success", "msg": "authenticated"},
+        _trade("AAPL", "2024-01-03T14:59:59.5Z"),
+        _trade("AAPL", "2024-01-03T15:00:00.123456789Z", 2.0),
+        {"T": "b", "S": "MSFT", "c": 410.0, "t": "2024-01-03T15:00:00Z"},
+    ])
+    await recorder.flush()
+    recorder.record([_trade("MSFT", "2024-01-03T15:30:00Z"), _trade("TSLA", "2024-01-03T15:31:00Z")])
+    await recorder.flush()
+    await recorder.close()
+
+    first, second = list_segments(str(tmp_path))
+    assert os.path.basename(first) == "20240103T140000.jsonl.gz"
+    assert os.path.dirname(second).endswith("2024-01-03")
+    assert [item["p"] for item in read_segment(first)] == [1.0]
+
+    # Two flushes -> two members in the 15:00 segment, readable as one gzip stream.
+    with open(index_path(second)) as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["symbols"] for entry in entries] == [{"AAPL": 1, "MSFT": 1}, {"MSFT": 1, "TSLA": 1}]
+    assert entries[1]["offset"] == entries[0]["length"]
+    with gzip.open(second, "rt") as f:
+        assert len(f.readlines()) == 4
+
+    assert [item["S"] for item in read_segment(second, symbols={"TSLA"})] == ["TSLA"]
+    late = read_segment(second, start=item_epoch("2024-01-03T15:10:00Z"))
+    assert [item["S"] for item in late] == ["MSFT", "TSLA"]
+    assert recorder.status()["items_recorded"] == 5
+
+
+@pytest.mark.asyncio
+async def test_flush_loop_survives_write_errors(tmp_path, monkeypatch):
+    recorder = TickRecorder(str(tmp_path), flush_seconds=0.01)
+    writes = []
+
+    def flaky_write(batch):
+        writes.append(len(batch))
+        if len(writes) == 1:
+            raise ValueError("unexpected item")
+
+    monkeypatch.setattr(recorder, "_write", flaky_write)
+    recorder.start()
+    recorder.record([_trade("AAPL", "2024-01-03T15:00:00Z")])
+    await asyncio.sleep(0.05)
+    recorder.record([_trade("AAPL", "2024-01-03T15:00:01Z")])
+    await asyncio.sleep(0.05)
+    assert writes == [1, 1] and not recorder._task.done()
+    await recorder.close()
+
+
+@pytest.mark.asyncio
+async def test_manager_records_upstream_batches(tmp_path):
+    manager = AlpacaWebSocketManager()
+    manager.recorder = TickRecorder(str(tmp_path))
+    manager.ws = FakeUpstream([json.dumps([_trade("SPY", "2024-01-03T15:00:01Z", 470.5)])])
+    await manager.receive_data()
+    await manager.stop()
+
+    (segment,) = list_segments(str(tmp_path))
+    assert list(read_segment(segment)) == [_trade("SPY", "2024-01-03T15:00:01Z", 470.5)]
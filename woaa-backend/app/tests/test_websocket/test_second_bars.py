@@ -0,0 +1,126 @@
+"""
+@fileoverview
+Tests for sub-minute bars built from the trade stream:
+- OHLCV per 1s / 5s bucket, closed by the next bucket's trade or by the ticker
+- late prints for a closed bucket never reopen it
+- the ticker's feed clock follows exchange time, not the local clock
+- one shared aggregator per symbol holding a single upstream trades reference
+"""
+
+import calendar
+
+import pytest
+
+from app.tests.test_websocket.test_real_time_trades import FakeUpstream, _client, _drain
+from app.websocket.real_time_trades import AlpacaWebSocketManager
+from app.websocket import second_bars
+from app.websocket.second_bars import FeedClock, SecondBarAggregator, parse_second_timeframe
+
+
+def _trade(second, price, size=10, fraction=".5"):
+    return {"T": "t", "S": "AAPL", "p": price, "s": size, "t": f"2024-01-03T15:00:{second:02d}{fraction}Z"}
+
+
+def test_parse_second_timeframe():
+    assert parse_second_timeframe("5Sec") == "5Sec"
+    for bad in ("1Min", "2Sec", None):
+        with pytest.raises(ValueError):
+            parse_second_timeframe(bad)
+
+
+def test_aggregator_builds_buckets():
+    aggregator = SecondBarAggregator("AAPL")
+    aggregator.add_timeframe("1Sec")
+    aggregator.add_timeframe("5Sec")
+
+    assert aggregator.add(_trade(1, 100.0)) == []
+    assert aggregator.add(_trade(1, 101.0, fraction=".9")) == []
+    closed = aggregator.add(_trade(2, 99.0, size=5))
+    assert closed == [("1Sec", {
+        "T": "b", "S": "AAPL", "tf": "1Sec", "t": "2024-01-03T15:00:01Z",
+        "o": 100.0, "h": 101.0, "l": 100.0, "c": 101.0, "v": 20, "n": 2,
+    })]
+    assert aggregator.add(_trade(1, 500.0, fraction=".95")) == []  # late print for a published bar
+
+    closed = dict(aggregator.add(_trade(6, 102.0)))
+    assert closed["1Sec"]["t"] == "2024-01-03T15:00:02Z"
+    assert closed["5Sec"] == {
+        "T": "b", "S": "AAPL", "tf": "5Sec", "t": "2024-01-03T15:00:00Z",
+        "o": 100.0, "h": 500.0, "l": 99.0, "c": 500.0, "v": 35, "n": 4,
+    }
+
+    # A quiet symbol's bars close on the ticker.
+    bucket_end = calendar.timegm((2024, 1, 3, 15, 0, 7))
+    assert aggregator.close_due(bucket_end) == []
+    assert [tf for tf, _ in aggregator.close_due(bucket_end + 1)] == ["1Sec"]
+    assert [tf for tf, _ in aggregator.close_due(bucket_end + 4)] == ["5Sec"]
+
+
+def test_late_print_after_ticker_close_is_dropped():
+    aggregator = SecondBarAggregator("AAPL")
+    aggregator.add_timeframe("1Sec")
+    aggregator.add(_trade(1, 100.0))
+    bucket_end = calendar.timegm((2024, 1, 3, 15, 0, 2))
+    assert [bar["t"] for _, bar in aggregator.close_due(bucket_end + 5)] == ["2024-01-03T15:00:01Z"]
+
+    # Same bucket and an earlier one: neither opens a second bar for a published `t`.
+    assert aggregator.add(_trade(1, 101.0, fraction=".99")) == []
+    assert aggregator.add(_trade(0, 99.0)) == []
+    assert aggregator.forming["1Sec"] is None
+    assert aggregator.close_due(bucket_end + 60) == []
+
+    aggregator.add(_trade(3, 102.0))
+    closed = aggregator.add(_trade(4, 103.0))
+    assert [bar["t"] for _, bar in closed] == ["2024-01-03T15:00:03Z"]
+
+
+def test_feed_clock_follows_trade_timestamps(monkeypatch):
+    local = [1000.0]
+    monkeypatch.setattr(second_bars.time, "monotonic", lambda: local[0])
+    clock = FeedClock()
+    aggregator = SecondBarAggregator("AAPL", clock)
+    aggregator.add_timeframe("1Sec")
+
+    aggregator.add(_trade(1, 100.0, fraction=".25"))
+    aggregator.add(_trade(0, 99.0))  # out of order: the clock does not go back
+    trade_epoch = calendar.timegm((2024, 1, 3, 15, 0, 1)) + 0.25
+    assert clock.latest == trade_epoch
+    local[0] += 1.5
+    # A local clock hours off does not matter; only elapsed local time does.
+    assert clock.now() == trade_epoch + 1.5
+    assert aggregator.close_due(clock.now()) == []  # bucket ended 0.75s ago, inside the grace
+    assert [tf for tf, _ in aggregator.close_due(trade_epoch + 0.75 + second_bars.SECOND_BAR_GRACE)] == ["1Sec"]
+
+
+@pytest.mark.asyncio
+async def test_second_bar_subscriptions_share_one_trade_stream():
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    fast, fast_session = await _client(manager)
+    slow, slow_session = await _client(manager)
+    await manager.subscribe_symbol(fast_session, "AAPL", "1Sec")
+    await manager.subscribe_symbol(slow_session, "AAPL", "5Sec")
+    await manager.subscribe_symbol(slow_session, "AAPL", "trades")
+    await manager.flush_upstream()
+    assert manager.ws.commands == [{"action": "subscribe", "trades": ["AAPL"]}]
+    assert manager.refcounts[("trades", "AAPL")] == 2  # the aggregator and the raw subscriber
+
+    manager.handle_upstream_batch([_trade(1, 100.0), _trade(2, 101.0)])
+    await _drain()
+    assert fast.sent == [[{
+        "T": "b", "S": "AAPL", "tf": "1Sec", "t": "2024-01-03T15:00:01Z",
+        "o": 100.0, "h": 100.0, "l": 100.0, "c": 100.0, "v": 10, "n": 1,
+    }]]
+    assert [item["T"] for item in slow.sent[0]] == ["t", "t"]  # no 5Sec bar closed yet
+
+    await manager.unsubscribe_symbol(slow_session, "AAPL", "trades")
+    await manager.unregister_client(fast_session)
+    assert list(manager.second_bars["AAPL"].forming) == ["5Sec"]
+    await manager.unregister_client(slow_session)
+    assert manager.second_bars == {} and manager.refcounts == {}
+    await manager.flush_upstream()
+    assert manager.ws.commands[-1] == {"action": "unsubscribe", "trades": ["AAPL"]}
+
+    for session in (fast_session, slow_session):
+        await session.finish()
+    await manager.stop()
@@ -0,0 +1,146 @@
+"""
+@fileoverview
+Tests for WebSocketSession outbound queueing:
+- messages are written in order by the writer task
+- drop_oldest / coalesce / disconnect overflow policies; pinned messages are never dropped
+- per-endpoint metrics
+- heartbeat pings, pongs hidden from handlers, silent clients reaped
+"""
+
+import asyncio
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app.websocket.session import OverflowPolicy, WebSocketSession, session_metrics
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.inbox = asyncio.Queue()
+
+    async def receive_text(self):
+        return await self.inbox.get()
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        await self.gate.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+async def _drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_writer_sends_in_order():
+    ws = FakeWebSocket()
+    session = WebSocketSession(ws, "test_order").start()
+    session.send({"a": 1})
+    session.send("plain")
+    session.send(b"\x01\x02")
+    await _drain()
+    assert ws.sent == ['{"a":1}', "plain", b"\x01\x02"]
+    await session.finish()
+    assert session.send("late") is False
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_when_full():
+    ws = FakeWebSocket()
+    ws.gate.clear()  # stalled client
+    session = WebSocketSession(ws, "test_drop", max_queue=2, policy=OverflowPolicy.DROP_OLDEST).start()
+    await _drain()
+    for i in range(5):
+        assert session.send(str(i))
+    assert session.depth == 2
+    assert session.dropped >= 2
+    await session.finish()
+
+
+@pytest.mark.asyncio
+async def test_pinned_message_survives_overflow():
+    ws = FakeWebSocket()
+    ws.gate.clear()
+    session = WebSocketSession(ws, "test_pinned", max_queue=2, policy=OverflowPolicy.DROP_OLDEST).start()
+    session.send("blocker")  # taken by the writer, stuck on the gate
+    await _drain()
+    session.send("dictionary", pinned=True)
+    for i in range(4):
+        session.send(f"data-{i}")
+    assert session.depth == 2 and session.dropped == 3
+    ws.gate.set()
+    await _drain()
+    assert ws.sent == ["blocker", "dictionary", "data-3"]
+    await session.finish()
+
+
+@pytest.mark.asyncio
+async def test_coalesce_replaces_pending_message():
+    ws = FakeWebSocket()
+    ws.gate.clear()
+    session = WebSocketSession(ws, "test_coalesce", max_queue=4, policy=OverflowPolicy.COALESCE).start()
+    session.send("blocker")  # taken by the writer, stuck on the gate
+    await _drain()
+    session.send("t1", key="sim_time")
+    session.send("t2", key="sim_time")
+    session.send("t3", key="sim_time")
+    assert session.depth == 1
+    assert session.coalesced == 2
+    ws.gate.set()
+    await _drain()
+    assert ws.sent == ["blocker", "t3"]
+    await session.finish()
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_slow_client():
+    ws = FakeWebSocket()
+    ws.gate.clear()
+    session = WebSocketSession(ws, "test_disconnect", max_queue=1, policy=OverflowPolicy.DISCONNECT).start()
+    session.send("blocker")
+    await _drain()
+    assert session.send("queued")
+    assert session.send("overflow") is False
+    await _drain()
+    assert ws.closed_with == 1013
+    assert session.closed
+    assert session_metrics()["endpoints"]["test_disconnect"]["overflow_disconnects"] == 1
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_pings_and_hides_pongs():
+    ws = FakeWebSocket()
+    session = WebSocketSession(ws, "test_heartbeat", heartbeat=0.01, heartbeat_timeout=1).start()
+    await asyncio.sleep(0.03)
+    assert json.loads(ws.sent[0]) == {"type": "ping"}
+
+    ws.inbox.put_nowait(json.dumps({"type": "pong"}))
+    ws.inbox.put_nowait(json.dumps({"action": "subscribe"}))
+    assert await session.receive_json() == {"action": "subscribe"}
+    assert not session.reaped
+    await session.finish()
+
+
+@pytest.mark.asyncio
+async def test_silent_client_is_reaped():
+    ws = FakeWebSocket()
+    session = WebSocketSession(ws, "test_reaped", heartbeat=0.01, heartbeat_timeout=0.03).start()
+    with pytest.raises(WebSocketDisconnect):
+        await asyncio.wait_for(session.receive_json(), timeout=1)
+    assert session.reaped and session.closed
+    assert ws.closed_with == 1001
+    await session.finish()
+    assert session_metrics()["endpoints"]["test_reaped"]["reaped"] == 1
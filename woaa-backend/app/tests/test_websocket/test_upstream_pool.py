@@ -0,0 +1,234 @@
+"""
+@fileoverview
+Tests for sharding real-time subscriptions across upstream connections:
+- MARKET_UPSTREAMS parsing
+- least-loaded placement under per-connection caps, with overflow retried later
+- a connection refused with 406 trips its breaker and its symbols move
+- data from every connection reaches clients through the same fan-out
+- reconnects back off with jitter, then backfill the gap ahead of held live data
+- a clean upstream close reconnects too, except while the manager is stopping
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import cache
+from app.tests.test_websocket.test_real_time_trades import FakeUpstream, _client, _drain
+from app.websocket import upstream_pool
+from app.websocket.real_time_trades import AlpacaWebSocketManager
+from app.websocket.upstream_pool import UpstreamConnection, UpstreamPool, upstreams_from_env
+
+
+class AlpacaSocket(FakeUpstream):
+    """FakeUpstream that also answers the auth handshake."""
+
+    def __init__(self, messages=(), auth=({"T": "success", "msg": "authenticated"},)):
+        super().__init__(messages)
+        self.auth = list(auth)
+
+    async def recv(self):
+        return json.dumps(self.auth)
+
+    async def close(self):
+        self.close_code = 1000
+
+
+class ClosingSocket(FakeUpstream):
+    """FakeUpstream whose iteration ends the way a clean close does."""
+
+    async def _iterate(self):
+        for message in self.messages:
+            yield message
+        self.close_code = 1000
+
+
+def test_upstreams_from_env(monkeypatch):
+    monkeypatch.setenv("ALPACA_API_KEY", "default-key")
+    monkeypatch.delenv("MARKET_UPSTREAMS", raising=False)
+    (default,) = upstreams_from_env()
+    assert default.url.endswith("/v2/iex") and default.key == "default-key"
+
+    monkeypatch.setenv("MARKET_UPSTREAMS", json.dumps([
+        {"max_symbols": 30}, {"key": "second-key", "feed": "sip", "max_symbols": 100},
+    ]))
+    first, second = upstreams_from_env()
+    assert (first.key, first.max_symbols) == ("default-key", 30)
+    assert (second.key, second.url, second.name) == ("second-key", "wss://stream.data.alpaca.markets/v2/sip", "upstream-1")
+
+    monkeypatch.setenv("MARKET_UPSTREAMS", "[]")
+    with pytest.raises(ValueError):
+        upstreams_from_env()
+
+
+def _sharded_manager(*caps):
+    manager = AlpacaWebSocketManager()
+    manager.pool = UpstreamPool([UpstreamConnection(f"up-{i}", "", None, None, cap) for i, cap in enumerate(caps)])
+    for conn in manager.pool.connections:
+        conn.ws = FakeUpstream()
+    return manager
+
+
+def _commands(conn):
+    return [(c["action"], sorted(c.get("trades", []))) for c in conn.ws.commands]
+
+
+@pytest.mark.asyncio
+async def test_symbols_are_spread_by_load_and_cap():
+    manager = _sharded_manager(2, 2)
+    a, b = manager.pool.connections
+    ws, session = await _client(manager)
+    for symbol in ("AAPL", "MSFT", "SPY", "QQQ", "TSLA"):
+        await manager.subscribe_symbol(session, symbol, "trades")
+    await manager.flush_upstream()
+
+    assert a.load == b.load == 2
+    assert manager.pool.unplaced == {("trades", "TSLA")}
+    placed = sorted(symbol for conn in (a, b) for _, symbols in _commands(conn) for symbol in symbols)
+    assert placed == ["AAPL", "MSFT", "QQQ", "SPY"]
+
+    # Freeing a slot lets the waiting symbol in on the same flush.
+    holder = manager.pool.placement[("trades", "AAPL")]
+    await manager.unsubscribe_symbol(session, "AAPL", "trades")
+    await manager.flush_upstream()
+    assert manager.pool.placement[("trades", "TSLA")] is holder and not manager.pool.unplaced
+    assert _commands(holder)[-2:] == [("unsubscribe", ["AAPL"]), ("subscribe", ["TSLA"])]
+
+    # Whichever connection a symbol sits on, clients just see the data.
+    manager.handle_upstream_batch([{"T": "t", "S": symbol, "p": 1.0} for symbol in ("MSFT", "TSLA")])
+    await _drain()
+    assert sorted(item["S"] for item in ws.sent[0]) == ["MSFT", "TSLA"]
+
+    await manager.unregister_client(session)
+    await session.finish()
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_connection_symbols_move(monkeypatch):
+    manager = _sharded_manager(0, 0)
+    a, b = manager.pool.connections
+    ws, session = await _client(manager)
+    for symbol in ("AAPL", "MSFT", "SPY", "QQQ"):
+        await manager.subscribe_symbol(session, symbol, "trades")
+    await manager.flush_upstream()
+    lost = sorted(b.symbols["trades"])
+    assert len(lost) == 2
+
+    async def connection_limit(url):
+        return AlpacaSocket(auth=[{"T": "error", "code": 406, "msg": "connection limit exceeded"}])
+
+    monkeypatch.setattr("app.websocket.real_time_trades.websockets.connect", connection_limit)
+    b.ws.close_code = 1006
+    await manager._connect(b)
+    assert b.failed and b.breaker_open and b.load == 0
+    await manager.flush_upstream()
+
+    assert _commands(a)[-1] == ("subscribe", lost)
+    assert a.symbols["trades"] == {"AAPL", "MSFT", "SPY", "QQQ"}
+    assert all(manager.pool.placement[("trades", symbol)] is a for symbol in lost)
+
+    await manager.unregister_client(session)
+    await session.finish()
+    await manager.stop()
+
+
+def test_backoff_and_breaker(monkeypatch):
+    monkeypatch.setattr(upstream_pool, "RECONNECT_BREAKER_FAILURES", 3)
+    conn = UpstreamConnection("up", "", None, None)
+    delays = []
+    for _ in range(3):
+        conn.record_failure()
+        delays.append(conn.next_delay())
+    assert 0.25 <= delays[0] <= 0.5 and 0.5 <= delays[1] <= 1.0 and 1.0 <= delays[2] <= 2.0
+    assert conn.breaker_open  # third failure in a row
+    conn.record_success()
+    assert not conn.breaker_open and not conn.failed and conn.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_reconnect_backfills_gap_before_live_data(monkeypatch):
+    monkeypatch.setattr(upstream_pool, "RECONNECT_BASE_SECONDS", 0.01)
+    if datetime.now(timezone.utc).second >= 58:
+        await asyncio.sleep(3)  # keep the whole test inside one wall-clock minute
+    minute = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    stamp = lambda t: t.isoformat().replace("+00:00", "Z")
+    live = {"T": "b", "S": "AAPL", "t": stamp(minute), "c": 3.0}
+
+    attempts = []
+
+    async def flaky_connect(url):
+        attempts.append(url)
+        if len(attempts) < 3:
+            raise OSError("network unreachable")
+        return AlpacaSocket([json.dumps([live])])
+
+    async def fake_get_bars(symbols, start, end, timeframe="1Min", feed="iex"):
+        await asyncio.sleep(0.01)  # live data arrives meanwhile and is held back
+        bars, t = [], start
+        while t <= end:
+            bars.append({"t": stamp(t), "o": 1.0, "h": 1.0, "l": 1.0, "c": 1.0, "v": 1})
+            t += timedelta(minutes=1)
+        return {symbol: bars for symbol in symbols}
+
+    monkeypatch.setattr("app.websocket.real_time_trades.websockets.connect", flaky_connect)
+    monkeypatch.setattr(cache.bar_cache, "get_bars", fake_get_bars)
+
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    conn = manager.pool.connections[0]
+    ws, session = await _client(manager)
+    await manager.subscribe_symbol(session, "AAPL", "bars")
+    await manager.flush_upstream()
+    manager.handle_upstream_batch([{"T": "b", "S": "AAPL", "t": stamp(minute - timedelta(minutes=4)), "c": 2.0}])
+
+    manager.ws.close_code = 1006
+    await manager.reconnect_and_resubscribe(conn)
+    assert len(attempts) == 3 and conn.is_open and conn.reconnects == 1
+    assert manager.ws.commands[-1] == {"action": "subscribe", "bars": ["AAPL"]}  # resubscribed on the new socket
+    await asyncio.sleep(0.05)
+    await _drain()
+
+    received = [item for frame in ws.sent for item in frame]
+    assert [item["t"] for item in received[1:]] == [
+        stamp(minute - timedelta(minutes=3)), stamp(minute - timedelta(minutes=2)),
+        stamp(minute - timedelta(minutes=1)), stamp(minute),
+    ]
+    assert all(item["backfill"] for item in received[1:4]) and "backfill" not in received[4]
+    assert conn.backfilled_bars == 3
+    assert conn.last_recovery["held_batches"] == 1 and conn.last_recovery["recovery_seconds"] >= 0
+
+    await manager.unregister_client(session)
+    await session.finish()
+    await manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_clean_close_reconnects(monkeypatch):
+    replacement = AlpacaSocket()
+
+    async def fake_connect(url):
+        return replacement
+
+    monkeypatch.setattr("app.websocket.real_time_trades.websockets.connect", fake_connect)
+    manager = AlpacaWebSocketManager()
+    manager.ws = FakeUpstream()
+    conn = manager.pool.connections[0]
+    ws, session = await _client(manager)
+    await manager.subscribe_symbol(session, "AAPL", "trades")
+    await manager.flush_upstream()
+
+    manager.ws = ClosingSocket([json.dumps([{"T": "t", "S": "AAPL", "p": 1.0}])])
+    await manager.receive_data(conn)
+    assert conn.ws is replacement and conn.is_open and conn.reconnects == 1
+    assert replacement.commands[-1] == {"action": "subscribe", "trades": ["AAPL"]}
+
+    await manager.unregister_client(session)
+    await session.finish()
+    await manager.flush_upstream()
+    await manager.stop()
+    manager.ws = ClosingSocket()
+    await manager.receive_data(conn)
+    assert conn.ws is not replacement and conn.reconnects == 1  # shutting down: left closed
@@ -0,0 +1,172 @@
+"""
+Incremental candle aggregation for the historical bars stream.
+
+Subscriptions with a timeframe above 1Min get candles built from the 1Min bars
+the dispatcher releases. One `CandleAggregator` per (symbol, timeframe) is
+shared by every subscriber: for each bucket it keeps the running candle after
+each 1Min bar, so a subscriber at any point of its own sim clock reads its
+forming (or closed) candle with one bisect instead of re-folding the minutes.
+
+Buckets up to an hour are clock-aligned, like Alpaca's bars. Multi-hour
+buckets (2Hour, 4Hour) are anchored at the 09:30 America/New_York session open,
+so they cover the same exchange hours in winter and summer.
+"""
+
+import bisect
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.cache import Bar, parse_bar_time
+from app.tasks.simulation import NY_ZONE
+
+# Buckets kept per aggregator; older ones are rebuilt from bars if needed again.
+MAX_BUCKETS = int(os.getenv("HISTORICAL_MAX_CANDLE_BUCKETS", "2048"))
+
+# Bucket sizes must divide an hour (or be whole hours dividing a day) so
+# buckets line up with Alpaca's clock-aligned bars.
+_TIMEFRAME_PATTERN = re.compile(r"^(\d+)\s*(min|m|t|hour|h)$")
+_VALID_MINUTES = {1, 2, 3, 5, 10, 15, 20, 30, 60, 120, 240}
+
+_SESSION_OPEN_MINUTE = 9 * 60 + 30  # minutes after midnight, exchange time
+
+Candle = Dict[str, Any]
+
+
+def parse_timeframe(value: Optional[str]) -> int:
+    """
+    Parse a timeframe such as "5Min" or "1Hour" into bucket minutes (default 1).
+
+    Raises:
+        ValueError: If the timeframe is malformed or not supported.
+    """
+    if value is None:
+        return 1
+    match = _TIMEFRAME_PATTERN.match(str(value).strip().lower())
+    if match is None:
+        raise ValueError(f"Unsupported timeframe: {value}")
+    minutes = int(match.group(1)) * (60 if match.group(2) in ("hour", "h") else 1)
+    if minutes not in _VALID_MINUTES:
+        raise ValueError(f"Unsupported timeframe: {value}")
+    return minutes
+
+
+def timeframe_name(minutes: int) -> str:
+    return f"{minutes // 60}Hour" if minutes >= 60 else f"{minutes}Min"
+
+
+def bucket_start(ts: datetime, minutes: int) -> datetime:
+    floored = ts.replace(second=0, microsecond=0)
+    if minutes <= 60:
+        # Offsets between UTC and exchange time are whole hours, so flooring in
+        # UTC gives the same boundaries as flooring in exchange time.
+        since_midnight = floored.hour * 60 + floored.minute
+        return floored - timedelta(minutes=since_midnight % minutes)
+    # Multi-hour buckets would move with DST if floored in UTC.
+    local = floored.astimezone(NY_ZONE)
+    since_open = local.hour * 60 + local.minute - _SESSION_OPEN_MINUTE
+    return floored - timedelta(minutes=since_open % minutes)
+
+
+def _format_time(ts: datetime) -> str:
+    return ts.isoformat().replace("+00:00", "Z")
+
+
+def merge_bar(candle: Optional[Candle], bucket: datetime, bar: Bar) -> Candle:
+    """
+    Return a new candle for `bucket` that folds in one 1Min bar.
+    """
+    volume = bar.get("v", 0)
+    if candle is None:
+        merged = {"t": _format_time(bucket), "o": bar["o"], "h": bar["h"], "l": bar["l"], "c": bar["c"], "v": volume}
+        if "n" in bar:
+            merged["n"] = bar["n"]
+        if "vw" in bar:
+            merged["vw"] = bar["vw"]
+        return merged
+
+    merged = dict(candle)
+    merged["h"] = max(candle["h"], bar["h"])
+    merged["l"] = min(candle["l"], bar["l"])
+    merged["c"] = bar["c"]
+    merged["v"] = candle["v"] + volume
+    if "n" in bar:
+        merged["n"] = candle.get("n", 0) + bar["n"]
+    if "vw" in bar and merged["v"]:
+        merged["vw"] = (candle.get("vw", bar["vw"]) * candle["v"] + bar["vw"] * volume) / merged["v"]
+    return merged
+
+
+def aggregate(bars: Iterable[Bar], minutes: int) -> List[Candle]:
+    """
+    Fold ascending 1Min bars into candles of `minutes` (the last one may still be forming).
+    """
+    candles: List[Candle] = []
+    current: Optional[datetime] = None
+    for bar in bars:
+        bucket = bucket_start(parse_bar_time(bar["t"]), minutes)
+        if bucket != current:
+            candles.append(merge_bar(None, bucket, bar))
+            current = bucket
+        else:
+            candles[-1] = merge_bar(candles[-1], bucket, bar)
+    return candles
+
+
+class CandleAggregator:
+    """
+    Running candles for one (symbol, timeframe), shared by all its subscribers.
+    """
+
+    def __init__(self, symbol: str, minutes: int, max_buckets: int = MAX_BUCKETS) -> None:
+        self.symbol = symbol
+        self.minutes = minutes
+        self.max_buckets = max_buckets
+        self.users = 0
+        # bucket start -> (1Min bar times, running candle after each of them)
+        self._buckets: "OrderedDict[datetime, Tuple[List[datetime], List[Candle]]]" = OrderedDict()
+
+    def bucket_end(self, bucket: datetime) -> datetime:
+        """
+        Start time of the bucket's last 1Min bar; the candle is closed once that bar is.
+        """
+        return bucket + timedelta(minutes=self.minutes - 1)
+
+    def add(self, bars: Iterable[Bar]) -> List[datetime]:
+        """
+        Fold ascending 1Min bars into their buckets, skipping bars already folded.
+
+        Returns:
+            list: Buckets touched, in order.
+        """
+        touched: List[datetime] = []
+        for bar in bars:
+            ts = parse_bar_time(bar["t"])
+            bucket = bucket_start(ts, self.minutes)
+            entry = self._buckets.get(bucket)
+            if entry is None:
+                entry = self._buckets[bucket] = ([], [])
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket)
+            times, candles = entry
+            if not times or ts > times[-1]:
+                candles.append(merge_bar(candles[-1] if candles else None, bucket, bar))
+                times.append(ts)
+            if not touched or touched[-1] != bucket:
+                touched.append(bucket)
+        return touched
+
+    def candle(self, bucket: datetime, through: datetime) -> Optional[Candle]:
+        """
+        The bucket's candle as of the 1Min bar stamped `through`, or None if it has no bars yet.
+        """
+        entry = self._buckets.get(bucket)
+        if entry is None:
+            return None
+        times, candles = entry
+        index = bisect.bisect_right(times, through)
+        return candles[index - 1] if index else None
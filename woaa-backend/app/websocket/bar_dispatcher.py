@@ -0,0 +1,674 @@
+"""
+Central dispatcher for the historical bars WebSocket.
+
+Instead of every `/ws/data/historical_bars` connection polling Postgres and
+Alpaca on its own, one dispatcher tracks (symbol, sim-minute) demand over all
+connections, fetches each bar range once through the bar cache, and queues
+the new bars for every socket whose sim clock has reached them.
+
+Delivery is scheduled from each user's projected sim clock: the dispatcher
+sleeps until the real instant at which the next sim minute closes for any
+subscriber (or until a subscription or clock change wakes it), so bars go out
+milliseconds after their minute completes and idle sockets cost nothing.
+
+Each subscription keeps a read-ahead buffer of upcoming bars sized from the
+user's speed. Bars are released from the buffer as the sim clock passes them,
+and the buffer refills in the background when it drops below a watermark, so
+high-speed replay needs one upstream fetch per several minutes of wall time.
+
+A subscription may ask for a `lookback`; the socket then gets one snapshot
+frame with the last N closed bars before incremental pushes start. It may also
+ask for a `timeframe` above 1Min, in which case released minutes are folded
+into candles by a `CandleAggregator` shared per (symbol, timeframe).
+
+When a socket falls far behind its clock (a start-time jump, or a burst of
+high-speed replay), the backlog goes out in catch-up mode: size-bounded chunks
+(compact JSON, or binary frames if the subscription asked for them) sent back
+to back, then a `catchup_end` marker, after which pushes are incremental again.
+"""
+
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
+from uuid import UUID
+
+from sqlalchemy.future import select
+
+from app.cache import SETTLE_DELAY, Bar, bar_cache, parse_bar_time
+from app.database import async_session_maker
+from app.models.user_setting import UserSetting
+from app.tasks.simulation import LA_ZONE, SimClock, advance_market_time, rewind_market_time
+from app.websocket.aggregator import CandleAggregator, aggregate, bucket_start, timeframe_name
+from app.websocket.codec import FLAG_CATCHUP, encode_bars
+from app.websocket.session import WebSocketSession
+
+logger = logging.getLogger(__name__)
+
+# Clocks are re-read from the database at least this often (seconds), which
+# also picks up changes made by other processes.
+CLOCK_RESYNC_INTERVAL = float(os.getenv("SIM_CLOCK_RESYNC_SECONDS", "30"))
+BAR_STEP = timedelta(minutes=1)
+# Read-ahead horizon: this many wall-clock seconds of playback at the user's
+# speed, clamped to [MIN, MAX] sim minutes. Refill when less than
+# READ_AHEAD_WATERMARK of the horizon is left.
+READ_AHEAD_SECONDS = float(os.getenv("HISTORICAL_READ_AHEAD_SECONDS", "120"))
+MIN_READ_AHEAD_MINUTES = int(os.getenv("HISTORICAL_MIN_READ_AHEAD_MINUTES", "15"))
+MAX_READ_AHEAD_MINUTES = int(os.getenv("HISTORICAL_MAX_READ_AHEAD_MINUTES", "5000"))
+READ_AHEAD_WATERMARK = 0.5
+# Wake slightly after the computed instant so float rounding can't leave the bar one tick short.
+WAKE_SLACK = timedelta(milliseconds=1)
+MAX_LOOKBACK_BARS = int(os.getenv("HISTORICAL_MAX_LOOKBACK_BARS", "5000"))
+# A backlog of at least CATCHUP_MIN_BARS minutes is sent in catch-up chunks of
+# CATCHUP_CHUNK_BARS. Backlogs beyond CATCHUP_MAX_BARS minutes are skipped:
+# delivery resumes that many market minutes before the sim clock.
+CATCHUP_MIN_BARS = int(os.getenv("HISTORICAL_CATCHUP_MIN_BARS", "60"))
+CATCHUP_CHUNK_BARS = int(os.getenv("HISTORICAL_CATCHUP_CHUNK_BARS", "500"))
+CATCHUP_MAX_BARS = int(os.getenv("HISTORICAL_CATCHUP_MAX_BARS", "5000"))
+# Sparse symbols may print fewer bars than minutes; widen the snapshot window
+# this many times (doubling) before settling for what exists.
+LOOKBACK_WIDEN_ATTEMPTS = 2
+
+# Lookback durations are in market time: "d" is one regular session.
+_LOOKBACK_UNITS = {"m": 1, "h": 60, "d": 390}
+_LOOKBACK_PATTERN = re.compile(r"^(\d+)\s*([mhd]?)$")
+
+
+def parse_lookback(value: Union[int, str, None], minutes: int = 1) -> Optional[int]:
+    """
+    Parse a subscribe `lookback` into a number of bars of the subscription's timeframe.
+
+    Args:
+        value: A bar count (int or digits) or a market-time duration such as "90m", "2h" or "1d".
+        minutes: Timeframe of the subscription in minutes.
+
+    Returns:
+        int | None: Bar count, capped so the snapshot spans at most MAX_LOOKBACK_BARS minutes,
+        or None when no lookback was requested.
+
+    Raises:
+        ValueError: If the value is not a positive count or a duration.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("lookback must be a bar count or a duration like '2h'")
+    if isinstance(value, int):
+        count = value
+    else:
+        match = _LOOKBACK_PATTERN.match(str(value).strip().lower())
+        if match is None:
+            raise ValueError("lookback must be a bar count or a duration like '2h'")
+        count = int(match.group(1))
+        if match.group(2):
+            # Durations cover whole bars of the timeframe.
+            count = -(-count * _LOOKBACK_UNITS[match.group(2)] // minutes)
+    if count <= 0:
+        raise ValueError("lookback must be positive")
+    return min(count, max(1, MAX_LOOKBACK_BARS // minutes))
+
+
+def _last_closed_bar(sim_time: datetime) -> datetime:
+    # The 1Min bar stamped t covers [t, t + 1min); it is closed once sim_time >= t + 1min.
+    return sim_time.replace(second=0, microsecond=0) - BAR_STEP
+
+
+def _read_ahead_end(after: datetime, speed: float) -> datetime:
+    minutes = speed * READ_AHEAD_SECONDS / 60
+    minutes = min(max(minutes, MIN_READ_AHEAD_MINUTES), MAX_READ_AHEAD_MINUTES)
+    # Advance in market time so the horizon skips nights and weekends.
+    ahead = advance_market_time(after.astimezone(LA_ZONE), minutes * 60).astimezone(after.tzinfo)
+    return ahead.replace(second=0, microsecond=0)
+
+
+def _settled_through() -> datetime:
+    return datetime.now(timezone.utc) - SETTLE_DELAY
+
+
+def _batch_windows(
+    demand: Dict[str, List[Tuple[datetime, datetime]]]
+) -> List[Tuple[List[str], datetime, datetime]]:
+    """
+    Group overlapping (or adjacent) windows across symbols into multi-symbol
+    fetches over their union; the cache splits the result per symbol.
+    """
+    windows = sorted((start, end, symbol) for symbol, spans in demand.items() for start, end in spans)
+    batches: List[Tuple[List[str], datetime, datetime]] = []
+    for start, end, symbol in windows:
+        if batches and start <= batches[-1][2] + BAR_STEP:
+            symbols, lo, hi = batches[-1]
+            if symbol not in symbols:
+                symbols.append(symbol)
+            batches[-1] = (symbols, lo, max(hi, end))
+        else:
+            batches.append(([symbol], start, end))
+    return batches
+
+
+class HistoricalSubscription:
+    """
+    One (symbol, timeframe) on one socket: the 1Min bar time delivered through,
+    and a read-ahead buffer of bars fetched beyond the sim clock but not yet released.
+    """
+
+    __slots__ = (
+        "symbol", "minutes", "forming", "aggregator", "binary", "open_bucket",
+        "cursor", "buffer", "filled_through", "refill", "snapshot",
+    )
+
+    def __init__(
+        self,
+        symbol: str,
+        minutes: int = 1,
+        forming: bool = True,
+        aggregator: Optional[CandleAggregator] = None,
+        binary: bool = False,
+    ) -> None:
+        self.symbol = symbol
+        self.minutes = minutes
+        self.forming = forming
+        self.aggregator = aggregator
+        # Send catch-up chunks as binary frames (see app.websocket.codec).
+        self.binary = binary
+        # Bucket whose candle has been sent as forming but not yet closed.
+        self.open_bucket: Optional[datetime] = None
+        self.cursor: Optional[datetime] = None
+        self.buffer: Deque[Tuple[datetime, Bar]] = deque()
+        self.filled_through: Optional[datetime] = None
+        self.refill: Optional[asyncio.Task] = None
+        # Pending lookback snapshot; incremental delivery waits until it is sent.
+        self.snapshot: Optional[asyncio.Task] = None
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        return self.symbol, self.minutes
+
+    @property
+    def timeframe(self) -> str:
+        return timeframe_name(self.minutes)
+
+    def first_bar(self, end: datetime) -> datetime:
+        """
+        First 1Min bar a fresh subscription needs: the last closed minute, or
+        the start of its bucket so the forming candle is complete.
+        """
+        return end if self.aggregator is None else bucket_start(end, self.minutes)
+
+    def skip_to(self, start: datetime) -> None:
+        """
+        Drop everything before `start` and continue delivery from there.
+        """
+        while self.buffer and self.buffer[0][0] < start:
+            self.buffer.popleft()
+        self.cursor = start - BAR_STEP
+        self.open_bucket = None
+        if self.filled_through is not None and self.filled_through < self.cursor:
+            self.filled_through = None
+            self.buffer.clear()
+
+    def reset(self) -> None:
+        self.cursor = None
+        self.open_bucket = None
+        self.buffer.clear()
+        self.filled_through = None
+        self.refill = None
+
+    def detach_refill(self) -> None:
+        # Refills can be shared by all symbols of a socket; a detached
+        # subscription simply ignores the result.
+        self.refill = None
+
+    def covers(self, end: datetime) -> bool:
+        return self.filled_through is not None and self.filled_through >= end
+
+    def extend(self, bars: List[Bar], through: datetime) -> None:
+        last = self.buffer[-1][0] if self.buffer else self.cursor
+        for bar in bars:
+            ts = parse_bar_time(bar["t"])
+            if last is None or ts > last:
+                self.buffer.append((ts, bar))
+                last = ts
+        if self.filled_through is None or through > self.filled_through:
+            self.filled_through = through
+
+    def release(self, start: datetime, end: datetime) -> List[Bar]:
+        released: List[Bar] = []
+        while self.buffer and self.buffer[0][0] <= end:
+            ts, bar = self.buffer.popleft()
+            if ts >= start:
+                released.append(bar)
+        self.cursor = end
+        return released
+
+
+class HistoricalSubscriber:
+    """
+    State for one historical-bars socket: its user, its per-symbol
+    subscriptions, and the session whose writer delivers its messages.
+    """
+
+    def __init__(self, user_id: UUID, session: WebSocketSession) -> None:
+        self.user_id = user_id
+        self.session = session
+        self.subscriptions: Dict[Tuple[str, int], HistoricalSubscription] = {}
+        self.missing_sim_time = False
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self.session.send(message)
+
+    def next_due(self) -> Optional[datetime]:
+        """
+        Sim instant at which the earliest pending bar for this socket closes.
+        """
+        due = [s.cursor + 2 * BAR_STEP for s in self.subscriptions.values() if s.cursor is not None]
+        return min(due) if due else None
+
+
+class HistoricalBarDispatcher:
+    def __init__(self) -> None:
+        self.subscribers: Set[HistoricalSubscriber] = set()
+        self.clocks: Dict[UUID, Optional[SimClock]] = {}
+        self._clocks_loaded_at: Optional[datetime] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.aggregators: Dict[Tuple[str, int], CandleAggregator] = {}
+
+    def register(self, user_id: UUID, session: WebSocketSession) -> HistoricalSubscriber:
+        subscriber = HistoricalSubscriber(user_id, session)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unregister(self, subscriber: HistoricalSubscriber) -> None:
+        self.subscribers.discard(subscriber)
+        for task in {s.refill for s in subscriber.subscriptions.values() if s.refill is not None}:
+            task.cancel()
+        for subscription in subscriber.subscriptions.values():
+            if subscription.snapshot is not None:
+                subscription.snapshot.cancel()
+            self._release_aggregator(subscription)
+        if not any(sub.user_id == subscriber.user_id for sub in self.subscribers):
+            self.clocks.pop(subscriber.user_id, None)
+
+    def subscribe(
+        self,
+        subscriber: HistoricalSubscriber,
+        symbol: str,
+        lookback: Optional[int] = None,
+        minutes: int = 1,
+        forming: bool = True,
+        binary: bool = False,
+    ) -> bool:
+        """
+        Add (`symbol`, timeframe `minutes`) to a socket.
+
+        With `lookback`, first send a snapshot of the last `lookback` bars of
+        that timeframe. With `forming`, candles above 1Min are also pushed
+        while their bucket is still open. With `binary`, catch-up chunks are
+        binary frames instead of JSON.
+        """
+        if (symbol, minutes) in subscriber.subscriptions:
+            return False
+        aggregator = None
+        if minutes > 1:
+            aggregator = self.aggregators.get((symbol, minutes))
+            if aggregator is None:
+                aggregator = self.aggregators[(symbol, minutes)] = CandleAggregator(symbol, minutes)
+            aggregator.users += 1
+        subscription = HistoricalSubscription(symbol, minutes, forming, aggregator, binary)
+        subscriber.subscriptions[subscription.key] = subscription
+        if lookback:
+            subscription.snapshot = asyncio.create_task(self._snapshot(subscriber, subscription, lookback))
+        else:
+            self.wake()
+        return True
+
+    def unsubscribe(self, subscriber: HistoricalSubscriber, symbol: str, minutes: Optional[int] = None) -> bool:
+        """
+        Remove one timeframe of `symbol` from a socket, or all of them when `minutes` is None.
+        """
+        keys = [key for key in subscriber.subscriptions if key[0] == symbol and minutes in (None, key[1])]
+        for key in keys:
+            subscription = subscriber.subscriptions.pop(key)
+            subscription.detach_refill()
+            if subscription.snapshot is not None:
+                subscription.snapshot.cancel()
+            self._release_aggregator(subscription)
+        return bool(keys)
+
+    def _release_aggregator(self, subscription: HistoricalSubscription) -> None:
+        aggregator = subscription.aggregator
+        if aggregator is None:
+            return
+        aggregator.users -= 1
+        if aggregator.users <= 0 and self.aggregators.get(subscription.key) is aggregator:
+            del self.aggregators[subscription.key]
+
+    def invalidate_clock(self, user_id: UUID) -> None:
+        """
+        Drop a user's cached clock after their speed, pause state or start time changed.
+        """
+        if self.clocks.pop(user_id, None) is not None:
+            self.wake()
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self) -> None:
+        """
+        Dispatch loop; started once from the app lifespan.
+        """
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            timeout: Optional[float] = None
+            try:
+                wake_at = await self.dispatch_once(datetime.now(timezone.utc))
+                if wake_at is not None:
+                    timeout = max(0.0, (wake_at - datetime.now(timezone.utc)).total_seconds())
+            except Exception as e:
+                logger.error("Historical dispatch failed: %s", e)
+                timeout = 1.0
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _load_clocks(self, user_ids: Iterable[UUID]) -> None:
+        user_ids = set(user_ids)
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(
+                    UserSetting.user_id,
+                    UserSetting.sim_time,
+                    UserSetting.last_updated,
+                    UserSetting.speed,
+                    UserSetting.paused,
+                ).where(UserSetting.user_id.in_(user_ids))
+            )
+            rows = {row.user_id: row for row in result.all()}
+        for user_id in user_ids:
+            row = rows.get(user_id)
+            self.clocks[user_id] = (
+                SimClock(row.sim_time, row.last_updated, row.speed, row.paused)
+                if row is not None and row.sim_time is not None
+                else None
+            )
+
+    async def dispatch_once(self, now: datetime) -> Optional[datetime]:
+        """
+        Deliver every bar that has closed on its subscriber's clock as of `now`.
+
+        Returns:
+            datetime | None: Real instant of the next bar close, or None if nothing is pending.
+        """
+        active = [sub for sub in self.subscribers if sub.subscriptions]
+        if not active:
+            return None
+
+        user_ids = {sub.user_id for sub in active}
+        stale = (
+            self._clocks_loaded_at is None
+            or (now - self._clocks_loaded_at).total_seconds() >= CLOCK_RESYNC_INTERVAL
+        )
+        missing = user_ids if stale else {uid for uid in user_ids if uid not in self.clocks}
+        if missing:
+            await self._load_clocks(missing)
+            if stale:
+                self._clocks_loaded_at = now
+
+        sim_times: Dict[UUID, datetime] = {
+            uid: clock.now(now) for uid in user_ids if (clock := self.clocks.get(uid)) is not None
+        }
+
+        # Windows that must be fetched now: fresh subscriptions, clock jumps, or
+        # buffers that ran dry before their background refill landed.
+        demand: Dict[str, List[Tuple[datetime, datetime]]] = {}
+        # Speeds are captured here: a clock may be invalidated while the fetches are awaited.
+        plans: List[Tuple[HistoricalSubscriber, HistoricalSubscription, datetime, datetime, float, Optional[Tuple[datetime, datetime]]]] = []
+        for sub in active:
+            sim_time = sim_times.get(sub.user_id)
+            if sim_time is None:
+                if not sub.missing_sim_time:
+                    sub.send({"error": "No sim_time found"})
+                    sub.missing_sim_time = True
+                continue
+            sub.missing_sim_time = False
+            speed = self.clocks[sub.user_id].speed
+            end = _last_closed_bar(sim_time)
+            for subscription in sub.subscriptions.values():
+                if subscription.snapshot is not None:
+                    continue
+                if subscription.cursor is not None and subscription.cursor > end:
+                    subscription.reset()  # clock moved back
+                # Fresh subscriptions start at the last closed minute (or its bucket).
+                start = subscription.first_bar(end) if subscription.cursor is None else subscription.cursor + BAR_STEP
+                if start > end:
+                    continue
+                if end - start > timedelta(minutes=CATCHUP_MAX_BARS):
+                    # Calendar span bounds the market span, so only long gaps pay for the rewind.
+                    floor = rewind_market_time(end.astimezone(LA_ZONE), (CATCHUP_MAX_BARS - 1) * 60)
+                    floor = subscription.first_bar(floor.astimezone(end.tzinfo))
+                    if start < floor:
+                        subscription.skip_to(floor)
+                        start = floor
+                fill = None
+                if not subscription.covers(end):
+                    subscription.detach_refill()
+                    fill_from = start if subscription.filled_through is None else subscription.filled_through + BAR_STEP
+                    fill = (fill_from, max(end, _read_ahead_end(end, speed)))
+                    demand.setdefault(subscription.symbol, []).append(fill)
+                plans.append((sub, subscription, start, end, speed, fill))
+
+        # Overlapping windows (users replaying the same period, or one socket's
+        # symbols) collapse into one multi-symbol fetch.
+        fetches = _batch_windows(demand)
+        results = await asyncio.gather(*(
+            bar_cache.get_bars(symbols, start, end) for symbols, start, end in fetches
+        ), return_exceptions=True)
+        failed: Set[str] = set()
+        for (symbols, _, _), result in zip(fetches, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to fetch historical bars for %s: %s", ",".join(symbols), result)
+                failed.update(symbols)
+
+        settled = _settled_through()
+        refills: Dict[HistoricalSubscriber, Tuple[float, List[HistoricalSubscription]]] = {}
+        for sub, subscription, start, end, speed, fill in plans:
+            if subscription.symbol in failed or sub.subscriptions.get(subscription.key) is not subscription:
+                continue
+            if fill is not None:
+                fill_from, ahead = fill
+                subscription.extend(
+                    bar_cache.peek(subscription.symbol, fill_from, ahead),
+                    through=max(end, min(ahead, settled)),
+                )
+            # Hand each socket only the bars its own clock has closed.
+            bars = subscription.release(start, end)
+            if len(bars) >= CATCHUP_MIN_BARS:
+                self._send_catchup(sub, subscription, bars, end)
+                continue
+            message = self._bars_message(subscription, bars, end)
+            if message is not None:
+                sub.send(message)
+            if self._needs_refill(subscription, end, speed):
+                refills.setdefault(sub, (speed, []))[1].append(subscription)
+
+        # One background refill per socket covers all of its symbols.
+        for sub, (speed, subscriptions) in refills.items():
+            task = asyncio.create_task(self._refill(subscriptions, speed))
+            for subscription in subscriptions:
+                subscription.refill = task
+
+        if failed:
+            return now + timedelta(seconds=1)
+        return self._next_wake(active)
+
+    def _bars_message(
+        self, subscription: HistoricalSubscription, bars: List[Bar], end: datetime
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Build the push for bars released through `end`: the bars themselves at
+        1Min, otherwise the candles they closed and the one still forming.
+        """
+        aggregator = subscription.aggregator
+        if aggregator is None:
+            return {"symbol": subscription.symbol, "timeframe": subscription.timeframe, "bars": bars} if bars else None
+
+        buckets = aggregator.add(bars)
+        if subscription.open_bucket is not None and (not buckets or buckets[0] != subscription.open_bucket):
+            buckets.insert(0, subscription.open_bucket)
+        closed: List[Bar] = []
+        forming: Optional[Bar] = None
+        subscription.open_bucket = None
+        for bucket in buckets:
+            if aggregator.bucket_end(bucket) <= end:
+                candle = aggregator.candle(bucket, aggregator.bucket_end(bucket))
+                if candle is not None:
+                    closed.append(candle)
+            else:
+                subscription.open_bucket = bucket
+                forming = aggregator.candle(bucket, end) if bars and subscription.forming else None
+
+        if not closed and forming is None:
+            return None
+        message: Dict[str, Any] = {"symbol": subscription.symbol, "timeframe": subscription.timeframe, "bars": closed}
+        if forming is not None:
+            message["forming"] = forming
+        return message
+
+    def _send_catchup(
+        self, sub: HistoricalSubscriber, subscription: HistoricalSubscription, bars: List[Bar], end: datetime
+    ) -> None:
+        """
+        Queue a large backlog as back-to-back chunks followed by a `catchup_end` marker.
+        """
+        message = self._bars_message(subscription, bars, end) or {"bars": []}
+        backlog = message["bars"]
+        for i in range(0, len(backlog), CATCHUP_CHUNK_BARS):
+            chunk = backlog[i:i + CATCHUP_CHUNK_BARS]
+            if subscription.binary:
+                sub.session.send(encode_bars(subscription.symbol, subscription.timeframe, chunk, FLAG_CATCHUP))
+            else:
+                sub.send({"symbol": subscription.symbol, "timeframe": subscription.timeframe, "bars": chunk, "catchup": True})
+
+        marker: Dict[str, Any] = {
+            "symbol": subscription.symbol,
+            "timeframe": subscription.timeframe,
+            "catchup_end": end.isoformat().replace("+00:00", "Z"),
+            "count": len(backlog),
+        }
+        if "forming" in message:
+            marker["forming"] = message["forming"]
+        sub.send(marker)
+
+    async def _snapshot(self, sub: HistoricalSubscriber, subscription: HistoricalSubscription, count: int) -> None:
+        """
+        Send the last `count` bars of the subscription's timeframe up to the
+        user's sim time as one frame, then hand the subscription to the
+        dispatch loop at that point.
+        """
+        symbol = subscription.symbol
+        try:
+            if sub.user_id not in self.clocks:
+                await self._load_clocks([sub.user_id])
+            clock = self.clocks.get(sub.user_id)
+            if clock is None:
+                return  # the dispatch loop reports the missing sim_time
+
+            end = _last_closed_bar(clock.now(datetime.now(timezone.utc)))
+            end_la = end.astimezone(LA_ZONE)
+            minutes = count * subscription.minutes
+            bars: List[Bar] = []
+            for _ in range(LOOKBACK_WIDEN_ATTEMPTS + 1):
+                # The bar stamped `end` is included, so step back minutes - 1.
+                start = rewind_market_time(end_la, (minutes - 1) * 60).astimezone(end.tzinfo)
+                start = bucket_start(start, subscription.minutes)
+                bars = (await bar_cache.get_bars([symbol], start, end)).get(symbol, [])
+                if len(bars) >= minutes:
+                    break
+                minutes *= 2
+
+            if sub.subscriptions.get(subscription.key) is not subscription:
+                return
+            subscription.cursor = end
+            message: Dict[str, Any] = {"symbol": symbol, "timeframe": subscription.timeframe, "snapshot": True}
+            if subscription.aggregator is None:
+                message["bars"] = bars[-count:]
+            else:
+                # Seed the shared aggregator so incremental candles continue the forming one.
+                subscription.aggregator.add(bars)
+                candles = aggregate(bars, subscription.minutes)[-count:]
+                last_bucket = bucket_start(end, subscription.minutes)
+                if subscription.aggregator.bucket_end(last_bucket) > end:
+                    subscription.open_bucket = last_bucket
+                    if candles and parse_bar_time(candles[-1]["t"]) == last_bucket:
+                        forming = candles.pop()
+                        if subscription.forming:
+                            message["forming"] = forming
+                message["bars"] = candles
+            sub.send(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Fall back to plain incremental delivery from the current minute.
+            logger.warning("Lookback snapshot failed for %s: %s", symbol, e)
+            sub.send({"error": f"Failed to load lookback for {symbol}"})
+        finally:
+            subscription.snapshot = None
+            self.wake()
+
+    def _needs_refill(self, subscription: HistoricalSubscription, end: datetime, speed: float) -> bool:
+        if subscription.refill is not None or subscription.filled_through is None:
+            return False
+        horizon = _read_ahead_end(end, speed) - end
+        if subscription.filled_through - end >= horizon * READ_AHEAD_WATERMARK:
+            return False
+        # Nothing newer than the settle delay can be buffered yet.
+        return subscription.filled_through < _settled_through()
+
+    async def _refill(self, subscriptions: List[HistoricalSubscription], speed: float) -> None:
+        task = asyncio.current_task()
+        ranges = {
+            s: (s.filled_through, _read_ahead_end(s.filled_through, speed)) for s in subscriptions
+        }
+        start = min(filled for filled, _ in ranges.values()) + BAR_STEP
+        ahead = max(ahead for _, ahead in ranges.values())
+        symbols = list(dict.fromkeys(s.symbol for s in subscriptions))
+        try:
+            await bar_cache.get_bars(symbols, start, ahead)
+            settled = _settled_through()
+            for subscription, (filled, until) in ranges.items():
+                # Skip subscriptions that were reset or detached meanwhile.
+                if subscription.refill is task and subscription.filled_through == filled:
+                    subscription.extend(
+                        bar_cache.peek(subscription.symbol, filled + BAR_STEP, until),
+                        through=min(until, settled),
+                    )
+        except Exception as e:
+            logger.warning("Read-ahead refill failed for %s: %s", ",".join(symbols), e)
+        finally:
+            for subscription in subscriptions:
+                if subscription.refill is task:
+                    subscription.refill = None
+
+    def _next_wake(self, active: List[HistoricalSubscriber]) -> Optional[datetime]:
+        wake_at: Optional[datetime] = None
+        for sub in active:
+            clock = self.clocks.get(sub.user_id)
+            due = sub.next_due()
+            if clock is None or due is None:
+                continue
+            at = clock.wall_time_at(due)
+            if at is not None and (wake_at is None or at < wake_at):
+                wake_at = at + WAKE_SLACK
+
+        if self._clocks_loaded_at is not None:
+            resync_at = self._clocks_loaded_at + timedelta(seconds=CLOCK_RESYNC_INTERVAL)
+            wake_at = resync_at if wake_at is None else min(wake_at, resync_at)
+        return wake_at
+
+
+bar_dispatcher = HistoricalBarDispatcher()
@@ -0,0 +1,243 @@
+"""
+Compact binary encodings for frames sent over WebSockets.
+
+Bar frames (historical bars). Layout (little endian):
+
+    magic "WB" | version u8 | flags u8
+    symbol length u8 | symbol (utf-8) | timeframe length u8 | timeframe (utf-8)
+    bar count u32
+    per bar: t i64 (epoch ms) | o h l c v f64 | n u32 | vw f64 (NaN when absent)
+
+60 bytes per bar against roughly 90 for the equivalent compact JSON, and no
+text parsing on either side.
+
+Market frames (the `/ws/market` binary subprotocol): magic "WM" | version u8,
+then records until the end of the frame, each starting with a kind u8:
+
+    SYMBOL   kind | id u32 | length u8 | symbol (utf-8)
+    TRADE    kind | id u32 | t i64 (epoch ns) | p f64 | s f64
+    SUMMARY  kind | id u32 | t i64 | p s h l v f64 | n u32     (conflated trade)
+    BAR      kind | id u32 | t i64 | interval u16 (s) | flags u8 | o h l c v f64 | n u32 | vw f64
+
+Symbol ids come from a dictionary each connection receives as SYMBOL records
+before the first record that uses them. Trade records are 29 bytes against
+roughly 120 for Alpaca's JSON.
+"""
+
+import calendar
+import math
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from app.cache import Bar, parse_bar_time
+
+MAGIC = b"WB"
+VERSION = 1
+
+FLAG_CATCHUP = 0x01
+FLAG_SNAPSHOT = 0x02
+
+_HEADER = struct.Struct("<2sBB")
+_COUNT = struct.Struct("<I")
+_BAR = struct.Struct("<qdddddId")
+
+
+def encode_bars(symbol: str, timeframe: str, bars: Sequence[Bar], flags: int = 0) -> bytes:
+    """
+    Encode one frame of bars for `symbol`.
+
+    Args:
+        symbol: Ticker symbol.
+        timeframe: Timeframe name (e.g. "1Min").
+        bars: Alpaca-style bar dicts.
+        flags: FLAG_* bits describing the frame.
+
+    Returns:
+        bytes: The encoded frame.
+    """
+    symbol_bytes = symbol.encode()
+    timeframe_bytes = timeframe.encode()
+    parts = [
+        _HEADER.pack(MAGIC, VERSION, flags),
+        bytes([len(symbol_bytes)]), symbol_bytes,
+        bytes([len(timeframe_bytes)]), timeframe_bytes,
+        _COUNT.pack(len(bars)),
+    ]
+    pack = _BAR.pack
+    for bar in bars:
+        parts.append(pack(
+            int(parse_bar_time(bar["t"]).timestamp() * 1000),
+            bar["o"], bar["h"], bar["l"], bar["c"], bar.get("v", 0),
+            int(bar.get("n", 0)), bar.get("vw", math.nan),
+        ))
+    return b"".join(parts)
+
+
+def decode_bars(data: bytes) -> Tuple[Dict[str, Any], List[Bar]]:
+    """
+    Decode a frame produced by `encode_bars`.
+
+    Returns:
+        tuple: ({"symbol", "timeframe", "flags"}, bars as dicts with ISO `t`).
+
+    Raises:
+        ValueError: If the frame is not a bar frame of a known version.
+    """
+    magic, version, flags = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a bar frame")
+    offset = _HEADER.size
+    symbol_len = data[offset]
+    symbol = data[offset + 1:offset + 1 + symbol_len].decode()
+    offset += 1 + symbol_len
+    timeframe_len = data[offset]
+    timeframe = data[offset + 1:offset + 1 + timeframe_len].decode()
+    offset += 1 + timeframe_len
+    (count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+
+    bars: List[Bar] = []
+    for t, o, h, low, c, v, n, vw in _BAR.iter_unpack(data[offset:offset + count * _BAR.size]):
+        bar: Bar = {
+            "t": datetime.fromtimestamp(t / 1000, tz=timezone.utc).isoformat().replace("+00:00", "Z"),
+            "o": o, "h": h, "l": low, "c": c, "v": v, "n": n,
+        }
+        if not math.isnan(vw):
+            bar["vw"] = vw
+        bars.append(bar)
+    return {"symbol": symbol, "timeframe": timeframe, "flags": flags}, bars
+
+
+MARKET_MAGIC = b"WM"
+MARKET_VERSION = 1
+
+KIND_SYMBOL = 1
+KIND_TRADE = 2
+KIND_SUMMARY = 3
+KIND_BAR = 4
+
+BAR_UPDATED = 0x01  # Alpaca "u" (corrected) bar
+BAR_BACKFILL = 0x02  # filled in from REST after a reconnect
+
+_MARKET_HEADER = struct.Struct("<2sB")
+_KIND = struct.Struct("<B")
+_SYMBOL = struct.Struct("<BIB")
+_TRADE = struct.Struct("<BIqdd")
+_SUMMARY = struct.Struct("<BIqdddddI")
+_MARKET_BAR = struct.Struct("<BIqHBdddddId")
+
+_BAR_SECONDS = {"1Sec": 1, "5Sec": 5, "15Sec": 15, "30Sec": 30}
+
+
+def timestamp_ns(t: str) -> int:
+    """
+    Epoch nanoseconds of an RFC 3339 UTC timestamp ("2024-01-03T15:00:07.123456789Z").
+    """
+    seconds = calendar.timegm((int(t[:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16]), int(t[17:19])))
+    fraction = t[20:].rstrip("Z") if len(t) > 19 and t[19] == "." else ""
+    return seconds * 1_000_000_000 + int(fraction[:9].ljust(9, "0") or 0)
+
+
+def _rfc3339(ns: int) -> str:
+    seconds, fraction = divmod(ns, 1_000_000_000)
+    stamp = datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{stamp}.{fraction:09d}Z" if fraction else f"{stamp}Z"
+
+
+def encode_symbols(entries: Iterable[Tuple[int, str]]) -> bytes:
+    """
+    A market frame announcing (id, symbol) dictionary entries.
+    """
+    parts = [_MARKET_HEADER.pack(MARKET_MAGIC, MARKET_VERSION)]
+    for symbol_id, symbol in entries:
+        data = symbol.encode()
+        parts.append(_SYMBOL.pack(KIND_SYMBOL, symbol_id, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def encode_market(items: Sequence[Dict[str, Any]], symbol_ids: Dict[str, int]) -> bytes:
+    """
+    Encode Alpaca-style trade and bar items as one market frame.
+
+    Args:
+        items: Trade ("t", optionally conflated with h/l/v/n) and bar ("b", "u") items.
+        symbol_ids: Symbol -> dictionary id; every item's symbol must be present.
+
+    Returns:
+        bytes: The encoded frame (items of other kinds are skipped).
+    """
+    parts = [_MARKET_HEADER.pack(MARKET_MAGIC, MARKET_VERSION)]
+    for item in items:
+        kind = item.get("T")
+        if kind != "t" and kind != "b" and kind != "u":
+            continue
+        symbol_id = symbol_ids[item["S"]]
+        t = timestamp_ns(item["t"])
+        if kind == "t":
+            if "n" in item:
+                parts.append(_SUMMARY.pack(
+                    KIND_SUMMARY, symbol_id, t, item["p"], item.get("s", 0),
+                    item["h"], item["l"], item["v"], int(item["n"]),
+                ))
+            else:
+                parts.append(_TRADE.pack(KIND_TRADE, symbol_id, t, item["p"], item.get("s", 0)))
+        else:
+            flags = (BAR_UPDATED if kind == "u" else 0) | (BAR_BACKFILL if item.get("backfill") else 0)
+            parts.append(_MARKET_BAR.pack(
+                KIND_BAR, symbol_id, t, _BAR_SECONDS.get(item.get("tf"), 60), flags,
+                item["o"], item["h"], item["l"], item["c"], item.get("v", 0),
+                int(item.get("n", 0)), item.get("vw", math.nan),
+            ))
+    return b"".join(parts)
+
+
+def decode_market(data: bytes, symbols: Dict[int, str]) -> List[Dict[str, Any]]:
+    """
+    Decode a market frame back into Alpaca-style items.
+
+    Args:
+        data: Frame produced by `encode_symbols` or `encode_market`.
+        symbols: The connection's id -> symbol dictionary; SYMBOL records update it.
+
+    Raises:
+        ValueError: If the frame is not a market frame of a known version.
+    """
+    magic, version = _MARKET_HEADER.unpack_from(data, 0)
+    if magic != MARKET_MAGIC or version != MARKET_VERSION:
+        raise ValueError("Not a market frame")
+    items: List[Dict[str, Any]] = []
+    offset = _MARKET_HEADER.size
+    while offset < len(data):
+        (kind,) = _KIND.unpack_from(data, offset)
+        if kind == KIND_SYMBOL:
+            _, symbol_id, length = _SYMBOL.unpack_from(data, offset)
+            offset += _SYMBOL.size
+            symbols[symbol_id] = data[offset:offset + length].decode()
+            offset += length
+        elif kind == KIND_TRADE:
+            _, symbol_id, t, p, size = _TRADE.unpack_from(data, offset)
+            offset += _TRADE.size
+            items.append({"T": "t", "S": symbols[symbol_id], "t": _rfc3339(t), "p": p, "s": size})
+        elif kind == KIND_SUMMARY:
+            _, symbol_id, t, p, size, h, low, v, n = _SUMMARY.unpack_from(data, offset)
+            offset += _SUMMARY.size
+            items.append({"T": "t", "S": symbols[symbol_id], "t": _rfc3339(t), "p": p, "s": size, "h": h, "l": low, "v": v, "n": n})
+        elif kind == KIND_BAR:
+            _, symbol_id, t, interval, flags, o, h, low, c, v, n, vw = _MARKET_BAR.unpack_from(data, offset)
+            offset += _MARKET_BAR.size
+            item = {
+                "T": "u" if flags & BAR_UPDATED else "b", "S": symbols[symbol_id], "t": _rfc3339(t),
+                "o": o, "h": h, "l": low, "c": c, "v": v, "n": n,
+            }
+            if not math.isnan(vw):
+                item["vw"] = vw
+            if interval != 60:
+                item["tf"] = f"{interval}Sec"
+            if flags & BAR_BACKFILL:
+                item["backfill"] = True
+            items.append(item)
+        else:
+            raise ValueError(f"Unknown market record kind {kind}")
+    return items
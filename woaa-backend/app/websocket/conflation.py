@@ -0,0 +1,66 @@
+"""
+Trade conflation for rate-limited `/ws/market` subscriptions.
+
+A client may subscribe to a symbol's trades with a `max_rate` (messages per
+second). Instead of every print, it then gets at most one trade item per
+interval: the last print of the interval, extended with the interval's high,
+low, summed volume and trade count. One `TradeConflator` per (symbol,
+interval) is shared by every client asking for that rate, so each interval is
+folded (and encoded, once per encoding) however many clients watch it.
+"""
+
+import os
+from typing import Any, Dict, Optional, Set
+
+from app.websocket.session import WebSocketSession
+
+MIN_CONFLATE_INTERVAL = float(os.getenv("MARKET_MIN_CONFLATE_INTERVAL", "0.05"))
+MAX_CONFLATE_INTERVAL = 60.0
+
+
+def conflate_interval(max_rate: float) -> float:
+    """
+    Flush interval in seconds for a requested `max_rate` (messages per second).
+
+    Raises:
+        ValueError: If `max_rate` is not a positive number.
+    """
+    if isinstance(max_rate, bool) or not isinstance(max_rate, (int, float)) or max_rate <= 0:
+        raise ValueError("max_rate must be a positive number of messages per second")
+    # Round so clients asking for nearly the same rate share a conflator.
+    return round(min(max(1.0 / max_rate, MIN_CONFLATE_INTERVAL), MAX_CONFLATE_INTERVAL), 3)
+
+
+class TradeConflator:
+    """
+    Folds one symbol's trades over an interval for the sessions that asked for that rate.
+    """
+
+    def __init__(self, symbol: str, interval: float) -> None:
+        self.symbol = symbol
+        self.interval = interval
+        self.sessions: Set[WebSocketSession] = set()
+        self.task = None
+        self._pending: Optional[Dict[str, Any]] = None
+
+    def add(self, trade: Dict[str, Any]) -> None:
+        price = trade.get("p")
+        size = trade.get("s", 0)
+        pending = self._pending
+        if pending is None:
+            self._pending = {**trade, "h": price, "l": price, "v": size, "n": 1}
+            return
+        high, low, volume, count = pending["h"], pending["l"], pending["v"], pending["n"]
+        pending.clear()
+        pending.update(trade)
+        pending["h"] = max(high, price)
+        pending["l"] = min(low, price)
+        pending["v"] = volume + size
+        pending["n"] = count + 1
+
+    def take(self) -> Optional[Dict[str, Any]]:
+        """
+        The folded trade for the interval just ended, or None if no trades printed.
+        """
+        pending, self._pending = self._pending, None
+        return pending
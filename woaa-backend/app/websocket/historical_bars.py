@@ -1,92 +1,84 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.auth import get_current_user_ws
-from app.database import async_session_maker
-from app.models.user_setting import UserSetting
-from sqlalchemy.future import select
-from app.services.alpaca import fetch_bars_from_alpaca
-
-import json
-import asyncio
-from datetime import datetime, timedelta
-from typing import Dict
+from app.websocket.aggregator import parse_timeframe, timeframe_name
+from app.websocket.bar_dispatcher import bar_dispatcher, parse_lookback
+from app.websocket.quotas import QuotaExceeded, load_limits, websocket_quotas
+from app.websocket.session import OverflowPolicy, WebSocketSession, policy_from_env
 
 router = APIRouter()
 
+# Dropping bars would leave holes in the client's chart, so a client that
+# can't keep up is disconnected (and can resubscribe) by default.
+HISTORICAL_WS_OVERFLOW = policy_from_env("HISTORICAL_WS_OVERFLOW", OverflowPolicy.DISCONNECT)
+
 
 @router.websocket("/ws/data/historical_bars")
 async def stream_historical_bars(websocket: WebSocket):
     await websocket.accept()
     user = None
+    session = WebSocketSession(websocket, "historical_bars", policy=HISTORICAL_WS_OVERFLOW)
+    subscriber = None
+    quota = None
     try:
         user = await get_current_user_ws(websocket)
         print(f"[WebSocket] User {user.id} connected to historical bars stream")
 
-        subscribed_symbols: Dict[str, datetime] = {}
+        try:
+            quota = websocket_quotas.open(
+                user.id, "historical_bars", await load_limits(user.id),
+                lambda: {symbol for symbol, _ in subscriber.subscriptions} if subscriber is not None else set(),
+            )
+        except QuotaExceeded as e:
+            await websocket.send_json({"error": str(e), "quota": e.quota, "limit": e.limit})
+            await websocket.close(code=1008)
+            return
+
+        session.start()
+        subscriber = bar_dispatcher.register(user.id, session)
 
         while True:
-            try:
-                if websocket.client_state.name == "CONNECTED":
-                    message = await asyncio.wait_for(websocket.receive_text(), timeout=0.1)
-                    data = json.loads(message)
-                    action = data.get("action")
-                    symbol = data.get("symbol", "").upper().strip()
-
-                    if action == "subscribe" and symbol:
-                        if symbol not in subscribed_symbols:
-                            subscribed_symbols[symbol] = None
-                            await websocket.send_json({"info": f"Subscribed to {symbol}"})
-                    elif action == "unsubscribe" and symbol:
-                        if symbol in subscribed_symbols:
-                            subscribed_symbols.pop(symbol)
-                            await websocket.send_json({"info": f"Unsubscribed from {symbol}"})
-            except asyncio.TimeoutError:
-                pass  # Allow time to fetch sim_time
-
-            if not subscribed_symbols:
-                await asyncio.sleep(1)
-                continue
-
-            async with async_session_maker() as session:
-                result = await session.execute(
-                    select(UserSetting.sim_time).where(UserSetting.user_id == user.id)
-                )
-                sim_time: datetime = result.scalar_one_or_none()
-
-            if sim_time is None:
-                await websocket.send_json({"error": "No sim_time found"})
-                await asyncio.sleep(1)
-                continue
-
-            for symbol, last_sent_time in subscribed_symbols.items():
-                start = sim_time if last_sent_time is None else last_sent_time + timedelta(minutes=1)
-                if start > sim_time:
-                    continue  # No new data needed
-
-                bars = await fetch_bars_from_alpaca(
-                    symbol=symbol,
-                    start=start.isoformat(),
-                    end=sim_time.isoformat(),
-                    timeframe="1Min",
-                    limit=1000,
-                    sort="asc"
-                )
-
-                if symbol in bars and bars[symbol]:
-                    await websocket.send_json({
-                        "symbol": symbol,
-                        "bars": bars[symbol]
-                    })
-
-                    last_timestamp = bars[symbol][-1]["t"]
-                    subscribed_symbols[symbol] = datetime.fromisoformat(last_timestamp)
-
-            await asyncio.sleep(1.3)
+            data = await session.receive_json()
+            action = data.get("action")
+            symbol = data.get("symbol", "").upper().strip()
+
+            if action == "subscribe" and symbol:
+                try:
+                    minutes = parse_timeframe(data.get("timeframe"))
+                    lookback = parse_lookback(data.get("lookback"), minutes)
+                except ValueError as e:
+                    session.send({"error": str(e)})
+                    continue
+                catchup = data.get("catchup", "json")
+                if catchup not in ("json", "binary"):
+                    session.send({"error": "catchup must be 'json' or 'binary'"})
+                    continue
+                forming = bool(data.get("forming", True))
+                try:
+                    websocket_quotas.check_symbol(quota, symbol)
+                except QuotaExceeded as e:
+                    session.send({"error": str(e), "symbol": symbol, "quota": e.quota, "limit": e.limit})
+                    continue
+                if bar_dispatcher.subscribe(
+                    subscriber, symbol, lookback=lookback, minutes=minutes, forming=forming, binary=catchup == "binary"
+                ):
+                    session.send({"info": f"Subscribed to {symbol} {timeframe_name(minutes)}"})
+            elif action == "unsubscribe" and symbol:
+                try:
+                    minutes = parse_timeframe(data["timeframe"]) if data.get("timeframe") else None
+                except ValueError as e:
+                    session.send({"error": str(e)})
+                    continue
+                if bar_dispatcher.unsubscribe(subscriber, symbol, minutes):
+                    session.send({"info": f"Unsubscribed from {symbol}"})
 
     except WebSocketDisconnect:
         print(f"[WebSocket] Disconnected: user_id={getattr(user, 'id', 'unknown')}")
     except Exception as e:
         print(f"[WebSocket] Error: {e}")
-        try:
-            await websocket.close(code=1011)
-        except Exception:
-            pass
+        await session.close(code=1011)
+    finally:
+        if quota is not None:
+            websocket_quotas.close(quota)
+        if subscriber is not None:
+            bar_dispatcher.unregister(subscriber)
+        await session.finish()
@@ -0,0 +1,61 @@
+"""
+Last-value cache for the real-time market stream.
+
+Keeps, per symbol, the most recent trade and bar seen upstream, so a new
+`/ws/market` subscriber gets the current value immediately instead of waiting
+for the next print, and `/data/latest` can answer price lookups from memory.
+Items are kept exactly as Alpaca sent them (including their `t` timestamp, so
+callers can judge staleness).
+"""
+
+from typing import Any, Dict, Iterable, Optional
+
+Item = Dict[str, Any]
+
+
+class LastValue:
+    __slots__ = ("trade", "bar")
+
+    def __init__(self) -> None:
+        self.trade: Optional[Item] = None
+        self.bar: Optional[Item] = None
+
+    def as_dict(self) -> Dict[str, Optional[Item]]:
+        return {"trade": self.trade, "bar": self.bar}
+
+
+class LastValueCache:
+    def __init__(self) -> None:
+        self._values: Dict[str, LastValue] = {}
+
+    def record(self, type_: str, symbol: str, item: Item) -> None:
+        """
+        Remember `item` as the latest of `type_` for `symbol`; only "trades"
+        and "bars" are kept.
+        """
+        if type_ != "trades" and type_ != "bars":
+            return
+        value = self._values.get(symbol)
+        if value is None:
+            value = self._values[symbol] = LastValue()
+        if type_ == "trades":
+            value.trade = item
+        else:
+            value.bar = item
+
+    def get(self, type_: str, symbol: str) -> Optional[Item]:
+        value = self._values.get(symbol)
+        if value is None:
+            return None
+        if type_ == "trades":
+            return value.trade
+        return value.bar if type_ == "bars" else None
+
+    def latest(self, symbols: Iterable[str]) -> Dict[str, Dict[str, Optional[Item]]]:
+        """
+        Last trade and bar for each symbol; both None for symbols not seen yet.
+        """
+        return {symbol: (self._values.get(symbol) or LastValue()).as_dict() for symbol in symbols}
+
+    def clear(self) -> None:
+        self._values.clear()
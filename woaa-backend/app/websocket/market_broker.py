@@ -0,0 +1,188 @@
+"""
+Local broker that shares one Alpaca stream between the workers on a host.
+
+With MARKET_STREAM_MODE=shared, the first worker to take an exclusive lock on
+MARKET_BROKER_LOCK becomes the owner: it holds the upstream connection and
+serves a Unix socket at MARKET_BROKER_SOCKET. Every other worker follows: it
+sends its debounced subscribe/unsubscribe commands to the owner and receives
+symbol-routed batches back, which it fans out to its own clients exactly as
+if they had come from Alpaca.
+
+On the owner, each follower is registered with the manager as a `BrokerPeer`,
+an ordinary routed subscriber, so reference counting, routing and encoding
+all work unchanged and upstream only ever sees one connection. If the owner
+exits, followers race for the lock again and one of them takes over.
+
+The wire format is newline-delimited JSON in both directions; commands have
+the same shape as Alpaca's (`{"action": ..., "trades": [...], "bars": [...]}`).
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Optional, Set
+
+from app.websocket.session import OverflowPolicy
+
+if TYPE_CHECKING:
+    from app.websocket.real_time_trades import AlpacaWebSocketManager
+
+logger = logging.getLogger(__name__)
+
+MARKET_STREAM_MODE = os.getenv("MARKET_STREAM_MODE", "direct").strip().lower()
+BROKER_SOCKET = os.getenv("MARKET_BROKER_SOCKET", "/tmp/woaa-market.sock")
+BROKER_LOCK = os.getenv("MARKET_BROKER_LOCK", "/tmp/woaa-market.lock")
+# A follower whose unread backlog exceeds this many bytes is dropped; it reconnects and resubscribes.
+BROKER_MAX_BUFFER = int(os.getenv("MARKET_BROKER_MAX_BUFFER", str(8 * 1024 * 1024)))
+BROKER_RETRY_SECONDS = 0.5
+
+OWNER = "owner"
+FOLLOWER = "follower"
+
+
+class BrokerPeer:
+    """
+    Owner-side stand-in for one follower worker, routed like a client session.
+    """
+
+    name = "market_broker_peer"
+    policy = OverflowPolicy.DROP_OLDEST
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.closed = False
+
+    def send(self, payload: str, key: Optional[Hashable] = None) -> bool:
+        if self.closed or self.writer.is_closing():
+            return False
+        if self.writer.transport.get_write_buffer_size() > BROKER_MAX_BUFFER:
+            logger.warning("Broker follower fell %d bytes behind, dropping it", BROKER_MAX_BUFFER)
+            self.close()
+            return False
+        self.writer.write(payload.encode() + b"\n")
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+        self.writer.close()
+
+
+class MarketBroker:
+    def __init__(
+        self, manager: "AlpacaWebSocketManager", socket_path: str = BROKER_SOCKET, lock_path: str = BROKER_LOCK
+    ) -> None:
+        self.manager = manager
+        self.socket_path = socket_path
+        self.lock_path = lock_path
+        self.role: Optional[str] = None
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[BrokerPeer] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._follow_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Become the owner if the lock is free, otherwise follow the current owner.
+        """
+        while True:
+            if self._try_lock():
+                await self._own()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                await asyncio.sleep(BROKER_RETRY_SECONDS)  # owner still starting up
+                continue
+            self.role = FOLLOWER
+            self._writer = writer
+            logger.info("📡 Following the market stream owner at %s", self.socket_path)
+            # Tell the owner what this worker's clients already need.
+            needed = {type_: sorted(symbols) for type_, symbols in self.manager.symbols.items() if symbols}
+            if needed:
+                await self.send({"action": "subscribe", **needed})
+            self._follow_task = asyncio.create_task(self._follow(reader))
+            return
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _own(self) -> None:
+        self.role = OWNER
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left behind by a previous owner; we hold the lock
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.socket_path)
+        logger.info("📡 Owning the market stream; serving followers at %s", self.socket_path)
+        await self.manager.connect()
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = BrokerPeer(writer)
+        self._peers.add(peer)
+        self.manager.register_client(peer)
+        try:
+            while line := await reader.readline():
+                command = json.loads(line)
+                for type_ in ("trades", "bars"):
+                    for symbol in command.get(type_, []):
+                        if command.get("action") == "subscribe":
+                            await self.manager.subscribe_symbol(peer, symbol, type_)
+                        elif command.get("action") == "unsubscribe":
+                            await self.manager.unsubscribe_symbol(peer, symbol, type_)
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logger.warning("Broker follower connection failed: %s", e)
+        finally:
+            peer.closed = True
+            self._peers.discard(peer)
+            await self.manager.unregister_client(peer)
+            writer.close()
+
+    async def _follow(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while line := await reader.readline():
+                self.manager.handle_upstream_batch(json.loads(line))
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logger.warning("Lost the market stream owner: %s", e)
+        self._writer = None
+        logger.info("🔁 Market stream owner went away; re-electing")
+        await self.start()
+
+    async def send(self, command: Dict[str, Any]) -> None:
+        """
+        Forward a subscription command to the owner (followers only).
+
+        While the owner is unreachable the command is dropped; the manager's
+        symbol sets are replayed in full on reconnect.
+        """
+        if self._writer is None or self._writer.is_closing():
+            return
+        self._writer.write(json.dumps(command).encode() + b"\n")
+        await self._writer.drain()
+
+    async def stop(self) -> None:
+        if self._follow_task is not None:
+            self._follow_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()  # followers re-elect an owner
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.role = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"mode": MARKET_STREAM_MODE, "role": self.role, "socket": self.socket_path, "followers": len(self._peers)}
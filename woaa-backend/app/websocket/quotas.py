@@ -0,0 +1,196 @@
+"""
+Per-user and global limits for the streaming WebSocket endpoints.
+
+Every limit is enforced per worker process: the counts live in this module, so
+with N workers a user can hold up to N times each limit across the deployment.
+
+Per user, on `/ws/market` and `/ws/data/historical_bars`:
+
+- WS_MAX_SOCKETS_PER_USER: concurrent sockets on each endpoint (a user may
+  hold this many on both at once, e.g. a chart tab and a simulation tab).
+- WS_MAX_SYMBOLS_PER_SOCKET: distinct symbols one socket may subscribe to.
+- WS_MAX_SYMBOLS_PER_USER: distinct symbols over all of a user's sockets.
+
+and two global caps (0 = no cap):
+
+- WS_MAX_SOCKETS: concurrent sockets over all users.
+- WS_MAX_UPSTREAM_SYMBOLS: (type, symbol) pairs the market manager keeps
+  subscribed upstream. Joining a symbol that is already upstream is always
+  allowed, since it costs no upstream capacity.
+
+Admins can override the per-user limits (user_settings.ws_max_*; NULL means
+the default). Overrides are read when a socket opens and pushed to the live
+sockets of the worker that served the change; other workers apply them to
+sockets opened afterwards.
+
+A refused socket gets an error message and is closed with 1008; a refused
+subscription only gets the error. Both carry `quota` (which limit) and `limit`.
+"""
+
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Set
+from uuid import UUID
+
+from sqlalchemy.future import select
+
+from app.database import async_session_maker
+from app.models.user_setting import UserSetting
+
+logger = logging.getLogger(__name__)
+
+WS_MAX_SOCKETS_PER_USER = int(os.getenv("WS_MAX_SOCKETS_PER_USER", "5"))
+WS_MAX_SYMBOLS_PER_SOCKET = int(os.getenv("WS_MAX_SYMBOLS_PER_SOCKET", "50"))
+WS_MAX_SYMBOLS_PER_USER = int(os.getenv("WS_MAX_SYMBOLS_PER_USER", "100"))
+WS_MAX_SOCKETS = int(os.getenv("WS_MAX_SOCKETS", "0"))
+WS_MAX_UPSTREAM_SYMBOLS = int(os.getenv("WS_MAX_UPSTREAM_SYMBOLS", "0"))
+
+
+class QuotaExceeded(Exception):
+    """
+    A socket or subscription would go over `quota` (whose value is `limit`).
+    """
+
+    def __init__(self, quota: str, limit: int, message: str) -> None:
+        super().__init__(message)
+        self.quota = quota
+        self.limit = limit
+
+    def payload(self) -> Dict[str, Any]:
+        return {"quota": self.quota, "limit": self.limit, "message": str(self)}
+
+
+class QuotaLimits:
+    """
+    One user's limits; None fields fall back to the environment defaults.
+    """
+
+    __slots__ = ("sockets", "symbols_per_socket", "symbols")
+
+    def __init__(
+        self, sockets: Optional[int] = None, symbols_per_socket: Optional[int] = None, symbols: Optional[int] = None
+    ) -> None:
+        self.sockets = WS_MAX_SOCKETS_PER_USER if sockets is None else sockets
+        self.symbols_per_socket = WS_MAX_SYMBOLS_PER_SOCKET if symbols_per_socket is None else symbols_per_socket
+        self.symbols = WS_MAX_SYMBOLS_PER_USER if symbols is None else symbols
+
+    @classmethod
+    def from_setting(cls, setting: Optional[UserSetting]) -> "QuotaLimits":
+        if setting is None:
+            return cls()
+        return cls(setting.ws_max_sockets, setting.ws_max_symbols_per_socket, setting.ws_max_symbols)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"sockets": self.sockets, "symbols_per_socket": self.symbols_per_socket, "symbols": self.symbols}
+
+
+async def load_limits(user_id: UUID) -> QuotaLimits:
+    """
+    The user's limits, with any admin overrides from user_settings.
+    """
+    async with async_session_maker() as db:
+        result = await db.execute(select(UserSetting).where(UserSetting.user_id == user_id))
+        return QuotaLimits.from_setting(result.scalar_one_or_none())
+
+
+class QuotaTicket:
+    """
+    One open socket's claim on its user's budget. `symbols` returns the
+    distinct symbols the socket is subscribed to right now.
+    """
+
+    def __init__(self, user_id: UUID, endpoint: str, limits: QuotaLimits, symbols: Callable[[], Set[str]]) -> None:
+        self.user_id = user_id
+        self.endpoint = endpoint
+        self.limits = limits
+        self.symbols = symbols
+
+
+class WebSocketQuotas:
+    def __init__(self) -> None:
+        self.tickets: Dict[UUID, List[QuotaTicket]] = {}
+        self.rejected: Dict[str, int] = {}
+
+    @property
+    def sockets(self) -> int:
+        return sum(len(tickets) for tickets in self.tickets.values())
+
+    def open(self, user_id: UUID, endpoint: str, limits: QuotaLimits, symbols: Callable[[], Set[str]]) -> QuotaTicket:
+        """
+        Claim a socket for `user_id` on `endpoint`.
+
+        Raises:
+            QuotaExceeded: If the user already has the maximum number of sockets
+                on `endpoint`, or the worker has its maximum overall.
+        """
+        held = sum(1 for ticket in self.tickets.get(user_id, ()) if ticket.endpoint == endpoint)
+        if held >= limits.sockets:
+            self._reject(
+                "sockets", limits.sockets, f"Too many open connections (limit {limits.sockets} per user on this endpoint)"
+            )
+        if WS_MAX_SOCKETS > 0 and self.sockets >= WS_MAX_SOCKETS:
+            self._reject("global_sockets", WS_MAX_SOCKETS, "Server is at its connection limit, try again later")
+        ticket = QuotaTicket(user_id, endpoint, limits, symbols)
+        self.tickets.setdefault(user_id, []).append(ticket)
+        return ticket
+
+    def close(self, ticket: QuotaTicket) -> None:
+        held = self.tickets.get(ticket.user_id, [])
+        if ticket in held:
+            held.remove(ticket)
+        if not held:
+            self.tickets.pop(ticket.user_id, None)
+
+    def check_symbol(self, ticket: QuotaTicket, symbol: str) -> None:
+        """
+        Raises:
+            QuotaExceeded: If adding `symbol` would put the socket or its user over their symbol limit.
+        """
+        mine = ticket.symbols()
+        if symbol in mine:
+            return
+        limits = ticket.limits
+        if len(mine) >= limits.symbols_per_socket:
+            self._reject(
+                "symbols_per_socket", limits.symbols_per_socket,
+                f"Too many symbols on this connection (limit {limits.symbols_per_socket})",
+            )
+        user_symbols = set().union(*(other.symbols() for other in self.tickets.get(ticket.user_id, ())))
+        if symbol not in user_symbols and len(user_symbols) >= limits.symbols:
+            self._reject("symbols", limits.symbols, f"Too many symbols across your connections (limit {limits.symbols})")
+
+    def check_upstream(self, upstream_symbols: int) -> None:
+        """
+        Raises:
+            QuotaExceeded: If one more upstream subscription would exceed WS_MAX_UPSTREAM_SYMBOLS.
+        """
+        if WS_MAX_UPSTREAM_SYMBOLS > 0 and upstream_symbols >= WS_MAX_UPSTREAM_SYMBOLS:
+            self._reject(
+                "upstream_symbols", WS_MAX_UPSTREAM_SYMBOLS,
+                "Server is streaming as many symbols as it can; subscribe to one already in use or try later",
+            )
+
+    def set_limits(self, user_id: UUID, limits: QuotaLimits) -> None:
+        """
+        Apply changed limits to the user's open sockets (existing subscriptions are kept).
+        """
+        for ticket in self.tickets.get(user_id, ()):
+            ticket.limits = limits
+
+    def _reject(self, quota: str, limit: int, message: str) -> None:
+        self.rejected[quota] = self.rejected.get(quota, 0) + 1
+        logger.info("Quota %s (limit %d) refused: %s", quota, limit, message)
+        raise QuotaExceeded(quota, limit, message)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "sockets": self.sockets,
+            "users": len(self.tickets),
+            "rejected": dict(self.rejected),
+            "defaults": QuotaLimits().as_dict(),
+            "max_sockets": WS_MAX_SOCKETS,
+            "max_upstream_symbols": WS_MAX_UPSTREAM_SYMBOLS,
+        }
+
+
+websocket_quotas = WebSocketQuotas()
@@ -3,11 +3,24 @@ import re
 import json
 import asyncio
 import logging
+import time
 import traceback
+from datetime import datetime, timedelta, timezone
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import websockets
 from websockets.exceptions import ConnectionClosed
 from dotenv import load_dotenv
+from app.auth import get_current_user_ws
+from app.cache import bar_cache, parse_bar_time
+from app.websocket.codec import encode_market, encode_symbols
+from app.websocket.conflation import TradeConflator, conflate_interval
+from app.websocket.last_values import LastValueCache
+from app.websocket.market_broker import FOLLOWER, MARKET_STREAM_MODE, MarketBroker
+from app.websocket.quotas import QuotaExceeded, load_limits, websocket_quotas
+from app.websocket.recorder import TickRecorder
+from app.websocket.second_bars import SECOND_BAR_TIMEFRAMES, FeedClock, SecondBarAggregator, parse_second_timeframe
+from app.websocket.session import DEFAULT_QUEUE_SIZE, OverflowPolicy, WebSocketSession, policy_from_env
+from app.websocket.upstream_pool import UpstreamConnection, UpstreamPool, upstreams_from_env
 
 load_dotenv()
 
@@ -16,169 +29,712 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)  # Only affects this logger
     
     
-ALPACA_URL = "wss://stream.data.alpaca.markets/v2/iex"
-API_KEY = os.getenv("ALPACA_API_KEY")
-API_SECRET = os.getenv("ALPACA_SECRET_KEY")
-
 VALID_SYMBOL_REGEX = re.compile(r"^[A-Z]{1,5}$")
 
+# What happens to a client whose writer queue is full: drop (its oldest
+# frames), conflate (keep only the latest pending frame per type and symbol)
+# or disconnect. Live ticks are superseded quickly, so drop is the default.
+MARKET_WS_OVERFLOW = policy_from_env("MARKET_WS_OVERFLOW", OverflowPolicy.DROP_OLDEST)
+MARKET_WS_QUEUE_SIZE = int(os.getenv("MARKET_WS_QUEUE_SIZE", str(DEFAULT_QUEUE_SIZE)))
+
+# Upstream subscription changes are collected for this long, so a dashboard
+# opening many symbols (or a burst of reconnects) costs one command per action.
+UPSTREAM_DEBOUNCE_SECONDS = float(os.getenv("MARKET_UPSTREAM_DEBOUNCE_MS", "50")) / 1000
+
+# How often quiet symbols' sub-minute bars are checked for closing.
+SECOND_BAR_TICK_SECONDS = 0.25
+
+# After a reconnect, missed 1-minute bars are backfilled over at most this many minutes.
+BACKFILL_MAX_MINUTES = int(os.getenv("MARKET_BACKFILL_MAX_MINUTES", "390"))
+
+# /ws/market subprotocols. Clients offering the binary one get trades and bars
+# as compact records (app.websocket.codec market frames); JSON is the default.
+BINARY_SUBPROTOCOL = "woaa.market.binary.v1"
+JSON_SUBPROTOCOL = "woaa.market.json.v1"
+
+# Upstream message type ("T") -> subscription type it is routed by.
+ROUTED_TYPES = {"t": "trades", "b": "bars", "u": "bars"}
+
 router = APIRouter()
 
+
+class BinaryClient:
+    """
+    Per-connection state of a binary-subprotocol client.
+    """
+
+    __slots__ = ("announced",)
+
+    def __init__(self) -> None:
+        self.announced: set[str] = set()  # symbols whose dictionary entry it has been sent
+
+
 class AlpacaWebSocketManager:
     def __init__(self):
-        self.subscribers: dict[WebSocket, dict[str, set[str]]] = {} 
+        self.subscribers: dict[WebSocketSession, dict[str, set[str]]] = {}
+        # (type, symbol) -> sessions subscribed to it, for routing upstream data.
+        # Besides "trades" and "bars", type may be a sub-minute timeframe ("5Sec").
+        self.routes: dict[tuple[str, str], set[WebSocketSession]] = {}
+        # Rate-limited trade subscriptions: (symbol, interval) -> shared conflator,
+        # symbol -> its conflators, and each session's conflator per symbol.
+        self.conflators: dict[tuple[str, float], TradeConflator] = {}
+        self.conflators_by_symbol: dict[str, set[TradeConflator]] = {}
+        self.client_conflators: dict[WebSocketSession, dict[str, TradeConflator]] = {}
+        # (type, symbol) -> number of sessions subscribed; upstream subscribe and
+        # unsubscribe are sent on the 0 -> 1 and 1 -> 0 transitions only.
+        # A symbol's sub-minute bar aggregator holds one count on its trades.
+        # `symbols` is the set of keys with a non-zero count, per upstream type.
+        self.refcounts: dict[tuple[str, str], int] = {}
         self.symbols = {"trades": set(), "bars": set()}
-        self.ws = None
-        self.lock = asyncio.Lock()
+        # (type, symbol) -> "subscribe" / "unsubscribe" waiting for the next flush.
+        self.pending_upstream: dict[tuple[str, str], str] = {}
+        self._flush_task: asyncio.Task | None = None
+        # Latest trade and bar per symbol, replayed to new subscribers.
+        self.last_values = LastValueCache()
+        # Binary-subprotocol clients, and the process-wide symbol ids their
+        # dictionaries are built from (so binary frames can be shared too).
+        self.binary_clients: dict[WebSocketSession, BinaryClient] = {}
+        self.symbol_ids: dict[str, int] = {}
+        # symbol -> shared sub-minute bar aggregator, the exchange-time clock
+        # they share, and the task closing quiet bars.
+        self.second_bars: dict[str, SecondBarAggregator] = {}
+        self.feed_clock = FeedClock()
+        self._second_bar_task: asyncio.Task | None = None
+        # Upstream connections and which one each wanted (type, symbol) is placed on.
+        self.pool = UpstreamPool(upstreams_from_env())
+        # Archive of what upstream sent, when MARKET_RECORDER_DIR is set.
+        self.recorder: TickRecorder | None = TickRecorder.from_env()
+        # Set in shared mode: one worker per host owns the upstream stream.
+        self.broker: MarketBroker | None = None
+        # Set by stop(), so upstream sockets closing on shutdown are not reopened.
+        self.stopping = False
+
+    async def start(self):
+        """
+        Bring up the market stream: directly, or through the local broker when
+        MARKET_STREAM_MODE=shared (see app.websocket.market_broker).
+        """
+        self.stopping = False
+        if self.recorder is not None:
+            self.recorder.start()
+        if MARKET_STREAM_MODE == "shared":
+            self.broker = MarketBroker(self)
+            await self.broker.start()
+        else:
+            await self.connect()
+
+    async def stop(self):
+        self.stopping = True
+        for task in (self._flush_task, self._second_bar_task):
+            if task is not None:
+                task.cancel()
+        self._flush_task = self._second_bar_task = None
+        for conn in self.pool.connections:
+            if conn.receive_task is not None:
+                conn.receive_task.cancel()
+                conn.receive_task = None
+        if self.broker is not None:
+            await self.broker.stop()
+        if self.recorder is not None:
+            await self.recorder.close()
+
+    @property
+    def is_follower(self) -> bool:
+        return self.broker is not None and self.broker.role == FOLLOWER
+
+    @property
+    def ws(self):
+        """
+        Socket of the first upstream connection (the only one unless MARKET_UPSTREAMS lists several).
+        """
+        return self.pool.connections[0].ws
+
+    @ws.setter
+    def ws(self, value):
+        self.pool.connections[0].ws = value
 
     async def connect(self):
         logger.debug("🧭 connect() called. Caller stack:\n%s", "".join(traceback.format_stack(limit=5)))
-
-        async with self.lock:
-            if self.ws and self.ws.close_code is None:
-                logger.debug("✅ Skipping connect — WebSocket is already open.")
+        if self.is_follower:
+            return  # the owning worker holds the upstream connection
+        # A follower promoted to owner never placed its keys: queue everything its clients hold.
+        self.pool.unplaced.update(
+            key for key in self.refcounts if key[0] in self.symbols and key not in self.pool.placement
+        )
+        await asyncio.gather(*(self._connect(conn) for conn in self.pool.connections))
+        if self.pool.unplaced:
+            await self.flush_upstream()
+
+    async def _connect(self, conn: UpstreamConnection):
+        async with conn.lock:
+            if conn.is_open:
+                logger.debug("✅ Skipping connect — %s is already open.", conn.name)
+                return
+            if conn.breaker_open:
+                logger.debug("⛔ Not connecting %s — circuit breaker open.", conn.name)
                 return
 
-            logger.debug("🔌 Connecting to Alpaca WebSocket...")
+            logger.debug("🔌 Connecting %s to Alpaca WebSocket...", conn.name)
             try:
-                self.ws = await websockets.connect(ALPACA_URL)
-                await self.ws.send(json.dumps({
+                conn.ws = await websockets.connect(conn.url)
+                await conn.ws.send(json.dumps({
                     "action": "auth",
-                    "key": API_KEY,
-                    "secret": API_SECRET
+                    "key": conn.key,
+                    "secret": conn.secret
                 }))
-                resp = await self.ws.recv()
+                resp = await conn.ws.recv()
                 logger.debug("Auth response: %s", resp)
 
                 parsed = json.loads(resp)
                 if isinstance(parsed, list):
                     for msg in parsed:
                         if msg.get("T") == "error":
-                            logger.error("🚨 Alpaca WebSocket Error: %s", msg)
+                            logger.error("🚨 Alpaca WebSocket Error on %s: %s", conn.name, msg)
                             if msg.get("code") == 406:
-                                logger.critical("🚫 Connection limit hit. Disabling reconnects.")
-                                return  # Optional: set self.hard_error = True to block future calls
-
-                for type_, symbol_set in self.symbols.items():
+                                logger.critical("🚫 Connection limit hit on %s. Moving its symbols.", conn.name)
+                                await conn.ws.close()
+                                conn.record_failure(trip=True)
+                                self._evacuate(conn)
+                                return
+
+                conn.record_success()
+                for type_, symbol_set in conn.symbols.items():
                     if symbol_set:
-                        await self.ws.send(json.dumps({
+                        await conn.ws.send(json.dumps({
                             "action": "subscribe",
                             type_: list(symbol_set)
                         }))
-                        logger.debug(f"🔁 Resubscribed to {type_}: {symbol_set}")
+                        logger.debug(f"🔁 Resubscribed {conn.name} to {type_}: {symbol_set}")
 
-                asyncio.create_task(self.receive_data())
+                if conn.disconnected_at is not None:
+                    # Hold live data back until the gap is filled, so it arrives in order.
+                    conn.held = []
+                    asyncio.create_task(self._backfill(conn))
+                conn.receive_task = asyncio.create_task(self.receive_data(conn))
 
             except Exception as e:
-                logger.error("❌ Failed to connect to Alpaca WebSocket: %s", e)
+                logger.error("❌ Failed to connect %s to Alpaca WebSocket: %s", conn.name, e)
+                conn.record_failure()
+                if conn.breaker_open:
+                    self._evacuate(conn)  # persistently down: let the rest of the pool serve its symbols
+                return
+
+        if self.pool.unplaced:
+            self._schedule_flush()  # capacity is back: place what had nowhere to go
 
+    def _evacuate(self, conn: UpstreamConnection):
+        """
+        Move a failed connection's symbols to the rest of the pool on the next flush.
+        """
+        moved = self.pool.evacuate(conn)
+        if moved:
+            logger.warning("Re-placing %d upstream subscriptions from %s", len(moved), conn.name)
+            self._schedule_flush()
 
-    async def subscribe_symbol(self, websocket: WebSocket, symbol: str, type_: str = "trades"):  # 🆕
-        if type_ not in {"trades", "bars"}:
+
+    async def subscribe_symbol(
+        self, websocket: WebSocketSession, symbol: str, type_: str = "trades", max_rate: float | None = None
+    ):  # 🆕
+        if type_ not in {"trades", "bars"} and type_ not in SECOND_BAR_TIMEFRAMES:
             logger.warning("Invalid subscription type: %s", type_)
             return
 
         if websocket not in self.subscribers:
             self.subscribers[websocket] = {"trades": set(), "bars": set()}
-
-        self.subscribers[websocket][type_].add(symbol)
-
-        if symbol not in self.symbols[type_]:
-            await self.ensure_ws()
-            try:
-                await self.ws.send(json.dumps({
-                    "action": "subscribe",
-                    type_: [symbol]
-                }))
-                self.symbols[type_].add(symbol)
-                logger.debug(f"Subscribed to {type_}: {symbol}")
-            except ConnectionClosed:
-                logger.warning("Connection closed during subscribe to %s (%s), reconnecting...", symbol, type_)
-                await self.reconnect_and_resubscribe()
-
-    async def unsubscribe_symbol(self, websocket: WebSocket, symbol: str, type_: str = "trades"):  # 🆕
+        symbols = self.subscribers[websocket].setdefault(type_, set())
+
+        # Re-subscribing replaces the previous rate for this symbol.
+        self._drop_route(websocket, type_, symbol)
+        first = False
+        if symbol not in symbols:
+            symbols.add(symbol)
+            first = self._acquire(type_, symbol)
+        if type_ == "trades" and max_rate is not None:
+            self._add_conflated(websocket, symbol, conflate_interval(max_rate))
+        else:
+            self.routes.setdefault((type_, symbol), set()).add(websocket)
+
+        if first:
+            self._first_acquired(type_, symbol)
+
+        last = self.last_values.get(type_, symbol)
+        if last is not None and not self._send_slices(websocket, [((type_, symbol), [last])], {}, {}):
+            self._client_gone(websocket)
+
+    async def unsubscribe_symbol(self, websocket: WebSocketSession, symbol: str, type_: str = "trades"):  # 🆕
         if websocket in self.subscribers and symbol in self.subscribers[websocket].get(type_, set()):
             self.subscribers[websocket][type_].remove(symbol)
+            self._drop_route(websocket, type_, symbol)
 
-            still_used = any(
-                symbol in other_subs.get(type_, set()) for other_subs in self.subscribers.values()
-            )
-            if not still_used:
-                await self.ensure_ws()
+            if self._release(type_, symbol):
+                self._last_released(type_, symbol)
+
+    def _first_acquired(self, type_: str, symbol: str):
+        if type_ not in SECOND_BAR_TIMEFRAMES:
+            self._queue_upstream("subscribe", type_, symbol)
+            return
+        aggregator = self.second_bars.get(symbol)
+        if aggregator is None:
+            aggregator = self.second_bars[symbol] = SecondBarAggregator(symbol, self.feed_clock)
+            if self._acquire("trades", symbol):
+                self._queue_upstream("subscribe", "trades", symbol)
+        aggregator.add_timeframe(type_)
+        if self._second_bar_task is None:
+            self._second_bar_task = asyncio.create_task(self._run_second_bars())
+
+    def _last_released(self, type_: str, symbol: str):
+        if type_ not in SECOND_BAR_TIMEFRAMES:
+            self._queue_upstream("unsubscribe", type_, symbol)
+            return
+        aggregator = self.second_bars[symbol]
+        aggregator.remove_timeframe(type_)
+        if not aggregator.forming:
+            del self.second_bars[symbol]
+            if self._release("trades", symbol):
+                self._queue_upstream("unsubscribe", "trades", symbol)
+
+    def _queue_upstream(self, action: str, type_: str, symbol: str):
+        """
+        Record an upstream (un)subscribe for the next debounced flush.
+
+        A change that reverses one still pending cancels it, since upstream
+        is then already in the wanted state.
+        """
+        key = (type_, symbol)
+        if self.pending_upstream.get(key, action) != action:
+            del self.pending_upstream[key]
+        else:
+            self.pending_upstream[key] = action
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(UPSTREAM_DEBOUNCE_SECONDS)
+        await self.flush_upstream()
+
+    async def flush_upstream(self):
+        """
+        Send the pending subscription changes: at most one command per action
+        and connection, each listing its symbols per type.
+
+        Subscriptions are placed on a connection here; ones no connection had
+        room for are retried on every flush.
+        """
+        # Changes queued from here on get a window of their own.
+        task, self._flush_task = self._flush_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()  # flushed early
+        pending, self.pending_upstream = self.pending_upstream, {}
+
+        if self.is_follower:
+            commands: dict[str, dict[str, list[str]]] = {}
+            for (type_, symbol), action in pending.items():
+                commands.setdefault(action, {}).setdefault(type_, []).append(symbol)
+            for action in ("unsubscribe", "subscribe"):
+                if action in commands:
+                    await self._send_upstream({"action": action, **commands[action]})
+            return
+
+        batches: dict[UpstreamConnection, dict[str, dict[str, list[str]]]] = {}
+        for key, action in pending.items():
+            if action == "unsubscribe" and (conn := self.pool.release(key)) is not None:
+                batches.setdefault(conn, {}).setdefault(action, {}).setdefault(key[0], []).append(key[1])
+        wanted = [key for key, action in pending.items() if action == "subscribe"]
+        wanted += [key for key in self.pool.unplaced if key not in pending]
+        if wanted and not any(not conn.failed and conn.has_room() for conn in self.pool.connections):
+            # Everything healthy is full or down: try the failed connections again.
+            await asyncio.gather(*(self._connect(conn) for conn in self.pool.connections if conn.failed))
+        for key in wanted:
+            if key not in self.refcounts or key in self.pool.placement:
+                self.pool.unplaced.discard(key)
+                continue
+            conn = self.pool.place(key)
+            if conn is None:
+                logger.warning("No upstream connection has room for %s %s", *key)
+                continue
+            batches.setdefault(conn, {}).setdefault("subscribe", {}).setdefault(key[0], []).append(key[1])
+
+        for conn, commands in batches.items():
+            for action in ("unsubscribe", "subscribe"):
+                if action not in commands:
+                    continue
                 try:
-                    await self.ws.send(json.dumps({
-                        "action": "unsubscribe",
-                        type_: [symbol]
-                    }))
-                    self.symbols[type_].discard(symbol)
-                    logger.debug("Unsubscribed from %s (%s)", symbol, type_)
+                    await self._send_to(conn, {"action": action, **commands[action]})
+                    logger.debug("Upstream %s on %s: %s", action, conn.name, commands[action])
                 except ConnectionClosed:
-                    logger.warning("Connection closed during unsubscribe from %s (%s), reconnecting...", symbol, type_)
-                    await self.reconnect_and_resubscribe()
-
-    async def receive_data(self):
+                    # Reconnecting replays the connection's symbol sets, which already reflect these changes.
+                    logger.warning("%s closed during upstream %s, reconnecting...", conn.name, action)
+                    asyncio.create_task(self.reconnect_and_resubscribe(conn))
+                    break
+
+    async def _send_upstream(self, command: dict):
+        """
+        Forward a subscription command to the broker owner (followers only).
+        """
+        await self.broker.send(command)
+
+    async def _send_to(self, conn: UpstreamConnection, command: dict):
+        await self.ensure_ws(conn)
+        if conn.is_open:
+            await conn.ws.send(json.dumps(command))
+
+    async def receive_data(self, conn: UpstreamConnection | None = None):
+        conn = conn or self.pool.connections[0]
         try:
-            async for message in self.ws:
+            async for message in conn.ws:
                 try:
                     data = json.loads(message)
                 except json.JSONDecodeError:
                     logger.warning("Received non-JSON message: %s", message)
                     continue
-
-                if isinstance(data, dict) and data.get("T") == "error":
-                    logger.error("🚨 Alpaca WebSocket Error: %s", data)
-                elif isinstance(data, list):
-                    for item in data:
-                        if item.get("T") == "error":
-                            logger.error("🚨 Alpaca WebSocket Error: %s", item)
-
-                disconnected = []
-                for sub in self.subscribers:
-                    try:
-                        await sub.send_text(message)
-                    except Exception:
-                        disconnected.append(sub)
-                for sub in disconnected:
-                    await self.unregister_client(sub)
+                if self.recorder is not None:
+                    self.recorder.record(data if isinstance(data, list) else [data])
+                if conn.held is not None:
+                    conn.held.append(data)  # gap backfill still running
+                    continue
+                self.handle_upstream_batch(data)
         except Exception as e:
-            logger.debug("Error in receive loop: %s", e)
-            await self.reconnect_and_resubscribe()
-
-    async def ensure_ws(self):
-        logger.debug("🛂 ensure_ws() called. WS = %s, closed = %s", self.ws, self.ws.close_code if self.ws else "None")
-        if not self.ws or self.ws.close_code is not None:
-            await self.connect()
-
-    async def reconnect_and_resubscribe(self):
+            logger.debug("Error in %s receive loop: %s", conn.name, e)
+            await self.reconnect_and_resubscribe(conn)
+            return
+        # A clean close (1000/1001, e.g. upstream restarting) just ends the loop.
+        if not self.stopping and not conn.is_open:
+            logger.info("🔌 %s closed by upstream (code %s); reconnecting", conn.name, conn.ws.close_code)
+            await self.reconnect_and_resubscribe(conn)
+
+    async def _reconnect(self, conn: UpstreamConnection):
+        """
+        Reconnect `conn` with exponential backoff and jitter, waiting out an open circuit breaker.
+        """
+        if conn.reconnecting:
+            return
+        conn.reconnecting = True
+        if conn.disconnected_at is None:
+            conn.disconnected_at = datetime.now(timezone.utc)
+        try:
+            while not conn.is_open:
+                if conn.breaker_open:
+                    await asyncio.sleep(conn.breaker_until - time.monotonic())
+                    continue
+                await self._connect(conn)
+                if not conn.is_open:
+                    delay = conn.next_delay()
+                    logger.info("🔁 %s reconnect attempt %d failed; retrying in %.1fs", conn.name, conn.failures, delay)
+                    await asyncio.sleep(delay)
+            conn.reconnects += 1
+        finally:
+            conn.reconnecting = False
+
+    async def _backfill(self, conn: UpstreamConnection):
+        """
+        After a reconnect, deliver the 1-minute bars each of `conn`'s bar
+        symbols missed (from the cached REST layer), then the live batches
+        held back meanwhile.
+
+        Backfilled items are regular bar items flagged `"backfill": true`.
+        """
+        disconnected_at, conn.disconnected_at = conn.disconnected_at, None
+        symbols = sorted(conn.symbols["bars"])
+        count = 0
+        try:
+            end = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)
+            oldest = end - timedelta(minutes=BACKFILL_MAX_MINUTES)
+            starts = {}
+            for symbol in symbols:
+                last = self.last_values.get("bars", symbol)
+                seen = parse_bar_time(last["t"]) + timedelta(minutes=1) if last is not None else None
+                starts[symbol] = max(seen or disconnected_at.replace(second=0, microsecond=0), oldest)
+            if starts and min(starts.values()) <= end:
+                fetched = await bar_cache.get_bars(symbols, min(starts.values()), end)
+                items = [
+                    {"T": "b", "S": symbol, **bar, "backfill": True}
+                    for symbol in symbols
+                    for bar in fetched.get(symbol, [])
+                    if parse_bar_time(bar["t"]) >= starts[symbol]
+                ]
+                if items:
+                    self.handle_upstream_batch(items)
+                count = len(items)
+        except Exception as e:
+            logger.error("Gap backfill on %s failed: %s", conn.name, e)
+            conn.backfill_failures += 1
+        finally:
+            held, conn.held = conn.held or [], None
+            for data in held:
+                self.handle_upstream_batch(data)
+            conn.backfilled_bars += count
+            conn.last_recovery = {
+                "disconnected_at": disconnected_at.isoformat(),
+                "recovery_seconds": round((datetime.now(timezone.utc) - disconnected_at).total_seconds(), 3),
+                "symbols": len(symbols),
+                "backfilled_bars": count,
+                "held_batches": len(held),
+            }
+            logger.info("✅ %s recovered: %s", conn.name, conn.last_recovery)
+
+    def handle_upstream_batch(self, data):
+        """
+        Fan one upstream batch (from Alpaca, or from the broker owner) out to subscribed sessions.
+        """
+        self.publish(self.route_batch(data if isinstance(data, list) else [data]))
+
+    def publish(self, slices: dict[WebSocketSession, list[tuple[tuple[str, str], list]]]):
+        """
+        Queue each session's slices onto its writer.
+        """
+        # Never await a client here: sends only enqueue onto each
+        # session's writer, and cleanup of closed clients (which
+        # may unsubscribe upstream) runs in the background.
+        # Clients whose slices cover the same (type, symbol) keys get
+        # the same frame, so it is encoded once per signature (and
+        # encoding) and the same object is queued for each of them.
+        payloads: dict[tuple[tuple[str, str], ...], str] = {}
+        binary_payloads: dict[tuple[tuple[str, str], ...], bytes] = {}
+        for sub, sub_slices in slices.items():
+            if not self._send_slices(sub, sub_slices, payloads, binary_payloads):
+                self._client_gone(sub)
+
+    def _send_slices(self, sub: WebSocketSession, slices: list, payloads: dict, binary_payloads: dict) -> bool:
+        """
+        Queue one session's slices, in its encoding; False if the session refused them.
+        """
+        client = self.binary_clients.get(sub)
+        if client is None:
+            encode, cache = self._encode, payloads
+        else:
+            if not self._announce(sub, client, [key[1] for key, _ in slices]):
+                return False
+            encode, cache = self._encode_binary, binary_payloads
+        if sub.policy is OverflowPolicy.COALESCE:
+            return all([sub.send(encode(cache, [(key, items)]), key=key) for key, items in slices])
+        return sub.send(encode(cache, slices))
+
+    def _announce(self, sub: WebSocketSession, client: BinaryClient, symbols: list[str]) -> bool:
+        """
+        Send a binary client the dictionary entries it lacks for `symbols`.
+
+        The announcement is pinned in the session queue, so overflow can never
+        drop it ahead of the data frames that use it.
+        """
+        missing = [symbol for symbol in dict.fromkeys(symbols) if symbol not in client.announced]
+        if not missing:
+            return True
+        entries = [(self.symbol_ids.setdefault(symbol, len(self.symbol_ids)), symbol) for symbol in missing]
+        if not sub.send(encode_symbols(entries), pinned=True):
+            return False
+        client.announced.update(missing)
+        return True
+
+    def route_batch(self, batch: list) -> dict[WebSocketSession, list[tuple[tuple[str, str], list]]]:
+        """
+        Split one upstream batch by (type, symbol) and collect each session's
+        (key, items) slices, in the same key order for every session.
+
+        Trades are also folded into the symbol's rate-limited conflators, which
+        flush on their own schedule, and into its sub-minute bar aggregator,
+        whose closed bars are routed with the batch. The last item per key is
+        kept in the last-value cache. Control messages (success, subscription,
+        error) are handled here and not forwarded.
+        """
+        by_key: dict[tuple[str, str], list] = {}
+        for item in batch:
+            if not isinstance(item, dict):
+                continue
+            kind = item.get("T")
+            type_ = ROUTED_TYPES.get(kind)
+            if type_ is None:
+                if kind == "error":
+                    logger.error("🚨 Alpaca WebSocket Error: %s", item)
+                continue
+            symbol = item.get("S")
+            by_key.setdefault((type_, symbol), []).append(item)
+            if kind == "t":
+                for conflator in self.conflators_by_symbol.get(symbol, ()):
+                    conflator.add(item)
+                aggregator = self.second_bars.get(symbol)
+                if aggregator is not None:
+                    for timeframe, bar in aggregator.add(item):
+                        by_key.setdefault((timeframe, symbol), []).append(bar)
+        return self._route(by_key)
+
+    def _route(self, by_key: dict[tuple[str, str], list]) -> dict[WebSocketSession, list[tuple[tuple[str, str], list]]]:
+        slices: dict[WebSocketSession, list[tuple[tuple[str, str], list]]] = {}
+        for key, items in by_key.items():
+            self.last_values.record(*key, items[-1])
+            for sub in self.routes.get(key, ()):
+                slices.setdefault(sub, []).append((key, items))
+        return slices
+
+    @staticmethod
+    def _encode(payloads: dict, slices: list[tuple[tuple[str, str], list]]) -> str:
+        signature = tuple(key for key, _ in slices)
+        payload = payloads.get(signature)
+        if payload is None:
+            payload = payloads[signature] = json.dumps([item for _, items in slices for item in items])
+        return payload
+
+    def _encode_binary(self, payloads: dict, slices: list[tuple[tuple[str, str], list]]) -> bytes:
+        signature = tuple(key for key, _ in slices)
+        payload = payloads.get(signature)
+        if payload is None:
+            payload = payloads[signature] = encode_market([item for _, items in slices for item in items], self.symbol_ids)
+        return payload
+
+    def _drop_route(self, websocket: WebSocketSession, type_: str, symbol: str):
+        sessions = self.routes.get((type_, symbol))
+        if sessions is not None:
+            sessions.discard(websocket)
+            if not sessions:
+                del self.routes[(type_, symbol)]
+        if type_ == "trades":
+            self._drop_conflated(websocket, symbol)
+
+    def _add_conflated(self, websocket: WebSocketSession, symbol: str, interval: float):
+        conflator = self.conflators.get((symbol, interval))
+        if conflator is None:
+            conflator = self.conflators[(symbol, interval)] = TradeConflator(symbol, interval)
+            self.conflators_by_symbol.setdefault(symbol, set()).add(conflator)
+            conflator.task = asyncio.create_task(self._run_conflator(conflator))
+        conflator.sessions.add(websocket)
+        self.client_conflators.setdefault(websocket, {})[symbol] = conflator
+
+    def _drop_conflated(self, websocket: WebSocketSession, symbol: str):
+        conflator = self.client_conflators.get(websocket, {}).pop(symbol, None)
+        if conflator is None:
+            return
+        if not self.client_conflators[websocket]:
+            del self.client_conflators[websocket]
+        conflator.sessions.discard(websocket)
+        if not conflator.sessions:
+            del self.conflators[(symbol, conflator.interval)]
+            by_symbol = self.conflators_by_symbol[symbol]
+            by_symbol.discard(conflator)
+            if not by_symbol:
+                del self.conflators_by_symbol[symbol]
+            conflator.task.cancel()
+
+    async def _run_second_bars(self):
+        try:
+            while self.second_bars:
+                await asyncio.sleep(SECOND_BAR_TICK_SECONDS)
+                now = self.feed_clock.now()
+                by_key: dict[tuple[str, str], list] = {}
+                for symbol, aggregator in self.second_bars.items():
+                    for timeframe, bar in aggregator.close_due(now):
+                        by_key.setdefault((timeframe, symbol), []).append(bar)
+                if by_key:
+                    self.publish(self._route(by_key))
+        finally:
+            if self._second_bar_task is asyncio.current_task():
+                self._second_bar_task = None
+
+    async def _run_conflator(self, conflator: TradeConflator):
+        while True:
+            await asyncio.sleep(conflator.interval)
+            self.flush_conflator(conflator)
+
+    def flush_conflator(self, conflator: TradeConflator):
+        """
+        Send the conflated trade for the interval just ended to every session on `conflator`.
+        """
+        trade = conflator.take()
+        if trade is None:
+            return
+        slices = [(("trades", conflator.symbol), [trade])]
+        payloads, binary_payloads = {}, {}
+        for sub in list(conflator.sessions):
+            if not self._send_slices(sub, slices, payloads, binary_payloads):
+                self._client_gone(sub)
+
+    def _client_gone(self, websocket: WebSocketSession):
+        # Called from fan-out paths; upstream changes are only queued here.
+        self._unsubscribe_upstream(self._detach_client(websocket))
+
+    async def ensure_ws(self, conn: UpstreamConnection | None = None):
+        conn = conn or self.pool.connections[0]
+        logger.debug("🛂 ensure_ws() called for %s. open = %s", conn.name, conn.is_open)
+        if not conn.is_open:
+            await self._connect(conn)
+
+    async def reconnect_and_resubscribe(self, conn: UpstreamConnection | None = None):
         logger.debug("🔁 reconnect_and_resubscribe() called")
-        await self.connect()
+        if conn is None:
+            await self.connect()
+        else:
+            await self._reconnect(conn)
 
-    def register_client(self, websocket: WebSocket):
+    def register_client(self, websocket: WebSocketSession, binary: bool = False):
         self.subscribers[websocket] = {"trades": set(), "bars": set()}
+        if binary:
+            self.binary_clients[websocket] = BinaryClient()
 
-    async def unregister_client(self, websocket: WebSocket):
-        symbols_dict = self.subscribers.pop(websocket, {"trades": set(), "bars": set()})
+    async def unregister_client(self, websocket: WebSocketSession):
+        self._unsubscribe_upstream(self._detach_client(websocket))
 
-        for type_ in ["trades", "bars"]:
-            for symbol in symbols_dict.get(type_, set()):
-                still_used = any(
-                    symbol in other_subs.get(type_, set()) for other_subs in self.subscribers.values()
-                )
-                if not still_used:
-                    await self.ensure_ws()
-                    try:
-                        await self.ws.send(json.dumps({
-                            "action": "unsubscribe",
-                            type_: [symbol]
-                        }))
-                        self.symbols[type_].discard(symbol)
-                        logger.debug("Unsubscribed from %s (%s) during cleanup", symbol, type_)
-                    except ConnectionClosed:
-                        logger.warning("Connection closed during unsubscribe cleanup for %s (%s)", symbol, type_)
+    def _detach_client(self, websocket: WebSocketSession) -> list[tuple[str, str]]:
+        """
+        Forget a client without touching the upstream socket.
 
-    def get_my_subscribed_symbols(self, websocket: WebSocket) -> dict[str, set[str]]:
+        Returns:
+            list: (type, symbol) pairs no other client uses any more.
+        """
+        symbols_dict = self.subscribers.pop(websocket, {"trades": set(), "bars": set()})
+        self.binary_clients.pop(websocket, None)
+        orphaned = []
+        for type_, symbols in symbols_dict.items():
+            for symbol in symbols:
+                self._drop_route(websocket, type_, symbol)
+                if self._release(type_, symbol):
+                    orphaned.append((type_, symbol))
+        return orphaned
+
+    def _acquire(self, type_: str, symbol: str) -> bool:
+        """
+        Count one more session on (type, symbol); True if it is the first.
+        """
+        count = self.refcounts.get((type_, symbol), 0) + 1
+        self.refcounts[(type_, symbol)] = count
+        if count == 1 and type_ in self.symbols:
+            self.symbols[type_].add(symbol)
+        return count == 1
+
+    def _release(self, type_: str, symbol: str) -> bool:
+        """
+        Count one session fewer on (type, symbol); True if it was the last.
+        """
+        count = self.refcounts.get((type_, symbol), 0) - 1
+        if count > 0:
+            self.refcounts[(type_, symbol)] = count
+            return False
+        self.refcounts.pop((type_, symbol), None)
+        if type_ in self.symbols:
+            self.symbols[type_].discard(symbol)
+        return True
+
+    def _unsubscribe_upstream(self, orphaned: list[tuple[str, str]]):
+        for type_, symbol in orphaned:
+            self._last_released(type_, symbol)
+
+    def get_my_subscribed_symbols(self, websocket: WebSocketSession) -> dict[str, set[str]]:
         return self.subscribers.get(websocket, {"trades": set(), "bars": set()})
 
+    def distinct_symbols(self, websocket: WebSocketSession) -> set[str]:
+        return set().union(*self.get_my_subscribed_symbols(websocket).values())
+
+    def adds_upstream(self, symbol: str, type_: str) -> bool:
+        """
+        Whether subscribing (type, symbol) would take a new upstream subscription.
+        """
+        upstream_type = "trades" if type_ in SECOND_BAR_TIMEFRAMES else type_
+        return (upstream_type, symbol) not in self.refcounts
+
+    @property
+    def upstream_count(self) -> int:
+        return sum(len(symbols) for symbols in self.symbols.values())
+
     def print_status(self):
         logger.debug("🔌 Connections: %d", len(self.subscribers))
         for type_ in ["trades", "bars"]:
@@ -190,30 +746,72 @@ alpaca_ws_manager = AlpacaWebSocketManager()
 
 @router.websocket("/ws/market")
 async def market_ws(websocket: WebSocket):
-    await websocket.accept()
-    alpaca_ws_manager.register_client(websocket)
+    # Rejected with 1008 before the handshake completes if the token is missing or invalid.
+    user = await get_current_user_ws(websocket)
+    limits = await load_limits(user.id)
+
+    offered = websocket.scope.get("subprotocols", [])
+    binary = BINARY_SUBPROTOCOL in offered
+    # Control replies (errors, subscriptions) stay JSON text frames either way.
+    subprotocol = BINARY_SUBPROTOCOL if binary else JSON_SUBPROTOCOL if JSON_SUBPROTOCOL in offered else None
+    await websocket.accept(subprotocol=subprotocol)
+    session = WebSocketSession(websocket, "market", max_queue=MARKET_WS_QUEUE_SIZE, policy=MARKET_WS_OVERFLOW)
+    try:
+        quota = websocket_quotas.open(user.id, "market", limits, lambda: alpaca_ws_manager.distinct_symbols(session))
+    except QuotaExceeded as e:
+        await websocket.send_text(json.dumps({"type": "error", **e.payload()}))
+        await websocket.close(code=1008)
+        return
+    session.start()
+    alpaca_ws_manager.register_client(session, binary=binary)
     alpaca_ws_manager.print_status()
 
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await session.receive_json()
             action = data.get("action")
             symbol = data.get("symbol")
             type_ = data.get("type", "trades")  # 🆕 default to "trades"
+            max_rate = data.get("max_rate")  # optional: conflate trades to at most this many messages/s
+
+            if type_ == "second_bars" and action in ("subscribe", "unsubscribe"):
+                # Sub-minute bars built from trades; routed by their timeframe ("1Sec" ... "30Sec").
+                try:
+                    type_ = parse_second_timeframe(data.get("timeframe"))
+                except ValueError as e:
+                    session.send(json.dumps({"type": "error", "message": str(e)}))
+                    continue
 
             if action == "subscribe" and symbol:
-                await alpaca_ws_manager.subscribe_symbol(websocket, symbol, type_)
+                if max_rate is not None:
+                    try:
+                        conflate_interval(max_rate)
+                    except ValueError as e:
+                        session.send(json.dumps({"type": "error", "message": str(e)}))
+                        continue
+                try:
+                    websocket_quotas.check_symbol(quota, symbol)
+                    if alpaca_ws_manager.adds_upstream(symbol, type_):
+                        websocket_quotas.check_upstream(alpaca_ws_manager.upstream_count)
+                except QuotaExceeded as e:
+                    session.send(json.dumps({"type": "error", "symbol": symbol, **e.payload()}))
+                    continue
+                await alpaca_ws_manager.subscribe_symbol(session, symbol, type_, max_rate)
                 alpaca_ws_manager.print_status()
             elif action == "unsubscribe" and symbol:
-                await alpaca_ws_manager.unsubscribe_symbol(websocket, symbol, type_)
+                await alpaca_ws_manager.unsubscribe_symbol(session, symbol, type_)
                 alpaca_ws_manager.print_status()
             elif action == "get_subscriptions":
-                symbols = alpaca_ws_manager.get_my_subscribed_symbols(websocket)
-                await websocket.send_text(json.dumps({
+                symbols = alpaca_ws_manager.get_my_subscribed_symbols(session)
+                session.send(json.dumps({
                     "type": "subscriptions",
                     "symbols": {k: list(v) for k, v in symbols.items()}
                 }))
 
     except WebSocketDisconnect:
-        await alpaca_ws_manager.unregister_client(websocket)
+        pass
+    finally:
+        websocket_quotas.close(quota)
+        await alpaca_ws_manager.unregister_client(session)
         alpaca_ws_manager.print_status()
+        await session.finish()
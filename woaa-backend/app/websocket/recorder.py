@@ -0,0 +1,227 @@
+"""
+Optional archive of the live market stream for replay.
+
+With MARKET_RECORDER_DIR set, every trade and bar the manager reads from
+Alpaca is appended to time-partitioned, gzip-compressed segment files:
+
+    <dir>/<YYYY-MM-DD>/<YYYYMMDDTHHMMSS>.jsonl.gz     items, one JSON object per line
+    <dir>/<YYYY-MM-DD>/<YYYYMMDDTHHMMSS>.idx.jsonl    one index line per gzip member
+
+Items are partitioned by their own `t` timestamp into MARKET_RECORDER_SEGMENT_SECONDS
+windows (UTC). The event loop only appends items to an in-memory buffer; every
+MARKET_RECORDER_FLUSH_SECONDS the buffer is handed to a single writer thread,
+which appends one gzip member per touched segment (concatenated members are a
+valid gzip stream) and one index line describing it:
+
+    {"offset": ..., "length": ..., "start": epoch s, "end": epoch s, "symbols": {"AAPL": 12, ...}}
+
+`read_segment` uses the index to decompress only the members that can hold
+the wanted symbols and time range. Day directories older than
+MARKET_RECORDER_RETENTION_DAYS (0 = keep everything) are removed as segments roll.
+"""
+
+import asyncio
+import calendar
+import gzip
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+RECORDER_DIR = os.getenv("MARKET_RECORDER_DIR", "")
+RECORDER_SEGMENT_SECONDS = int(os.getenv("MARKET_RECORDER_SEGMENT_SECONDS", "3600"))
+RECORDER_FLUSH_SECONDS = float(os.getenv("MARKET_RECORDER_FLUSH_SECONDS", "1.0"))
+RECORDER_COMPRESSION = int(os.getenv("MARKET_RECORDER_COMPRESSION", "6"))
+RECORDER_RETENTION_DAYS = int(os.getenv("MARKET_RECORDER_RETENTION_DAYS", "0"))
+# Items buffered beyond this between flushes (a stuck disk) are dropped and counted.
+RECORDER_MAX_PENDING = int(os.getenv("MARKET_RECORDER_MAX_PENDING", "500000"))
+
+# Upstream message types worth keeping: trades, bars and updated bars.
+RECORDED_TYPES = {"t", "b", "u"}
+
+Item = Dict[str, Any]
+
+
+def item_epoch(t: str) -> int:
+    """
+    Whole epoch seconds of an RFC 3339 UTC timestamp ("2024-01-03T15:00:07.123Z").
+    """
+    return calendar.timegm((int(t[:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16]), int(t[17:19])))
+
+
+def segment_name(start: int) -> str:
+    return datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+
+class TickRecorder:
+    def __init__(
+        self,
+        directory: str,
+        segment_seconds: int = RECORDER_SEGMENT_SECONDS,
+        flush_seconds: float = RECORDER_FLUSH_SECONDS,
+        retention_days: int = RECORDER_RETENTION_DAYS,
+    ) -> None:
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        self.items_recorded = 0
+        self.items_dropped = 0
+        self.bytes_written = 0
+        self.segments: Set[str] = set()
+        self._pending: List[Item] = []
+        self._task: Optional[asyncio.Task] = None
+        # One thread keeps appends to a segment in order.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tick-recorder")
+
+    @classmethod
+    def from_env(cls) -> Optional["TickRecorder"]:
+        return cls(RECORDER_DIR) if RECORDER_DIR else None
+
+    def start(self) -> "TickRecorder":
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    def record(self, batch: Sequence[Any]) -> None:
+        """
+        Buffer the trades and bars of one upstream batch (called on the event loop).
+        """
+        pending = self._pending
+        for item in batch:
+            if isinstance(item, dict) and item.get("T") in RECORDED_TYPES and isinstance(item.get("t"), str):
+                pending.append(item)
+        if len(pending) > RECORDER_MAX_PENDING:
+            overflow = len(pending) - RECORDER_MAX_PENDING
+            del pending[:overflow]
+            self.items_dropped += overflow
+
+    async def flush(self) -> None:
+        """
+        Write everything buffered so far, in the writer thread.
+        """
+        batch, self._pending = self._pending, []
+        if batch:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, batch)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Tick recorder failed to write")
+
+    def _write(self, batch: List[Item]) -> None:
+        by_segment: Dict[int, List[Item]] = {}
+        epochs: Dict[int, List[int]] = {}
+        for item in batch:
+            try:
+                epoch = item_epoch(item["t"])
+            except (ValueError, IndexError):
+                continue
+            start = epoch - epoch % self.segment_seconds
+            by_segment.setdefault(start, []).append(item)
+            epochs.setdefault(start, []).append(epoch)
+
+        for start, items in by_segment.items():
+            path = self._segment_path(start)
+            data = gzip.compress(
+                "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in items).encode(),
+                compresslevel=RECORDER_COMPRESSION,
+            )
+            symbols: Dict[str, int] = {}
+            for item in items:
+                symbols[item.get("S")] = symbols.get(item.get("S"), 0) + 1
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            entry = {"offset": offset, "length": len(data), "start": min(epochs[start]), "end": max(epochs[start]), "symbols": symbols}
+            with open(index_path(path), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.items_recorded += len(items)
+            self.bytes_written += len(data)
+
+    def _segment_path(self, start: int) -> str:
+        day = datetime.fromtimestamp(start, tz=timezone.utc).date()
+        day_dir = os.path.join(self.directory, day.isoformat())
+        path = os.path.join(day_dir, f"{segment_name(start)}.jsonl.gz")
+        if path not in self.segments:
+            os.makedirs(day_dir, exist_ok=True)
+            self.segments.add(path)
+            self._expire(day)
+        return path
+
+    def _expire(self, today: date) -> None:
+        if self.retention_days <= 0:
+            return
+        cutoff = (today - timedelta(days=self.retention_days)).isoformat()
+        for name in os.listdir(self.directory):
+            if len(name) == 10 and name < cutoff:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                self.segments = {path for path in self.segments if not path.startswith(os.path.join(self.directory, name))}
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory, "items_recorded": self.items_recorded, "items_dropped": self.items_dropped,
+            "bytes_written": self.bytes_written, "pending": len(self._pending),
+        }
+
+
+def index_path(segment_path: str) -> str:
+    return segment_path[: -len(".jsonl.gz")] + ".idx.jsonl"
+
+
+def list_segments(directory: str) -> List[str]:
+    """
+    Every segment file under `directory`, oldest first.
+    """
+    return sorted(
+        os.path.join(directory, day, name)
+        for day in os.listdir(directory) if os.path.isdir(os.path.join(directory, day))
+        for name in os.listdir(os.path.join(directory, day)) if name.endswith(".jsonl.gz")
+    )
+
+
+def read_segment(
+    path: str, symbols: Optional[Set[str]] = None, start: Optional[int] = None, end: Optional[int] = None
+) -> Iterator[Item]:
+    """
+    Replay one segment's items in recorded order.
+
+    Args:
+        path: Segment file (`.jsonl.gz`).
+        symbols: Only yield these symbols.
+        start: Only yield items at or after this epoch second.
+        end: Only yield items at or before this epoch second.
+    """
+    with open(index_path(path)) as f:
+        entries = [json.loads(line) for line in f]
+    with open(path, "rb") as f:
+        for entry in entries:
+            if start is not None and entry["end"] < start or end is not None and entry["start"] > end:
+                continue
+            if symbols is not None and symbols.isdisjoint(entry["symbols"]):
+                continue
+            f.seek(entry["offset"])
+            for line in gzip.decompress(f.read(entry["length"])).splitlines():
+                item = json.loads(line)
+                if symbols is not None and item.get("S") not in symbols:
+                    continue
+                if start is not None or end is not None:
+                    epoch = item_epoch(item["t"])
+                    if start is not None and epoch < start or end is not None and epoch > end:
+                        continue
+                yield item
@@ -0,0 +1,175 @@
+"""
+Sub-minute OHLCV bars built from the live trade stream.
+
+Alpaca only streams 1-minute bars. For 1s, 5s, 15s and 30s candles the
+real-time manager feeds each symbol's trades into one shared
+`SecondBarAggregator`, which keeps a forming bar per resolution in use and
+emits a bar item once its bucket is over: either when a later trade arrives or,
+for quiet symbols, when the manager's ticker calls `close_due`.
+
+The ticker does not use the local clock directly: exchange timestamps and the
+local clock disagree by feed latency and clock skew. A `FeedClock` shared by
+the manager's aggregators remembers the newest trade timestamp seen and
+advances it by local time elapsed since, so a bucket is closed SECOND_BAR_GRACE
+after it ended in exchange time.
+
+Emitted items look like Alpaca bars (`"T": "b"`) plus a `tf` field naming the
+resolution. Trades are bucketed by their own `t` timestamp. Each resolution
+remembers the last bucket it closed; a trade at or before it (its bar was
+already published) is dropped, so a bar's `t` is never published twice.
+"""
+
+import calendar
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Subscription timeframe name -> bucket length in seconds.
+SECOND_BAR_TIMEFRAMES = {"1Sec": 1, "5Sec": 5, "15Sec": 15, "30Sec": 30}
+# How long after a bucket ends (feed time) a quiet symbol's bar is closed anyway.
+SECOND_BAR_GRACE = float(os.getenv("MARKET_SECOND_BAR_GRACE", "1.0"))
+
+Item = Dict[str, Any]
+
+
+def parse_second_timeframe(value: Any) -> str:
+    """
+    Validate a sub-minute timeframe name.
+
+    Raises:
+        ValueError: If `value` is not one of SECOND_BAR_TIMEFRAMES.
+    """
+    if value not in SECOND_BAR_TIMEFRAMES:
+        raise ValueError(f"timeframe must be one of {', '.join(SECOND_BAR_TIMEFRAMES)}")
+    return value
+
+
+class FeedClock:
+    """
+    Exchange time as of now: the newest trade timestamp seen, advanced by the
+    local time elapsed since it arrived. Falls back to the local clock before
+    the first trade.
+    """
+
+    __slots__ = ("latest", "seen_at")
+
+    def __init__(self) -> None:
+        self.latest: Optional[float] = None
+        self.seen_at = 0.0
+
+    def observe(self, epoch: float) -> None:
+        if self.latest is None or epoch > self.latest:
+            self.latest = epoch
+            self.seen_at = time.monotonic()
+
+    def now(self) -> float:
+        if self.latest is None:
+            return time.time()
+        return self.latest + time.monotonic() - self.seen_at
+
+
+class _Forming:
+    __slots__ = ("day", "start", "end_epoch", "bar")
+
+    def __init__(self, day: str, start: int, end_epoch: float, bar: Item) -> None:
+        self.day = day
+        self.start = start  # seconds since midnight UTC
+        self.end_epoch = end_epoch
+        self.bar = bar
+
+
+class SecondBarAggregator:
+    """
+    Builds every requested sub-minute resolution for one symbol.
+    """
+
+    def __init__(self, symbol: str, clock: Optional[FeedClock] = None) -> None:
+        self.symbol = symbol
+        self.clock = clock
+        self.forming: Dict[str, Optional[_Forming]] = {}
+        # timeframe -> (day, start) of the last bucket whose bar was published
+        self.closed: Dict[str, Tuple[str, int]] = {}
+        self._day_epochs: Dict[str, int] = {}
+
+    def add_timeframe(self, timeframe: str) -> None:
+        self.forming.setdefault(timeframe, None)
+
+    def remove_timeframe(self, timeframe: str) -> None:
+        self.forming.pop(timeframe, None)
+        self.closed.pop(timeframe, None)
+
+    def add(self, trade: Item) -> List[Tuple[str, Item]]:
+        """
+        Fold one trade into every resolution.
+
+        Returns:
+            list: (timeframe, bar) for each bar the trade closed.
+        """
+        t = trade.get("t")
+        price = trade.get("p")
+        if not isinstance(t, str) or len(t) < 19 or price is None:
+            return []
+        # RFC 3339 UTC ("2024-01-03T15:00:07.123456789Z"): slice instead of parsing.
+        day = t[:10]
+        second = int(t[11:13]) * 3600 + int(t[14:16]) * 60 + int(t[17:19])
+        size = trade.get("s", 0)
+        if self.clock is not None:
+            fraction = float(t[19:-1]) if t[19:20] == "." else 0.0
+            self.clock.observe(self._day_epoch(day) + second + fraction)
+
+        closed = []
+        for timeframe, forming in self.forming.items():
+            length = SECOND_BAR_TIMEFRAMES[timeframe]
+            start = second - second % length
+            bucket = (day, start)
+            if forming is not None and bucket == (forming.day, forming.start):
+                bar = forming.bar
+                if price > bar["h"]:
+                    bar["h"] = price
+                if price < bar["l"]:
+                    bar["l"] = price
+                bar["c"] = price
+                bar["v"] += size
+                bar["n"] += 1
+                continue
+            last = self.closed.get(timeframe)
+            if last is not None and bucket <= last:
+                continue  # late print for a bar already published
+            if forming is not None:
+                if bucket < (forming.day, forming.start):
+                    continue  # late print for a bucket already skipped over
+                closed.append((timeframe, forming.bar))
+                self.closed[timeframe] = (forming.day, forming.start)
+            self.forming[timeframe] = self._open(timeframe, day, start, length, price, size)
+        return closed
+
+    def close_due(self, now: float) -> List[Tuple[str, Item]]:
+        """
+        Close bars whose bucket ended more than SECOND_BAR_GRACE before `now`
+        (epoch seconds, normally FeedClock.now()).
+        """
+        closed = []
+        for timeframe, forming in self.forming.items():
+            if forming is not None and forming.end_epoch + SECOND_BAR_GRACE <= now:
+                closed.append((timeframe, forming.bar))
+                self.closed[timeframe] = (forming.day, forming.start)
+                self.forming[timeframe] = None
+        return closed
+
+    def _day_epoch(self, day: str) -> int:
+        day_epoch = self._day_epochs.get(day)
+        if day_epoch is None:
+            self._day_epochs.clear()  # only the current session's day is ever needed
+            day_epoch = self._day_epochs[day] = calendar.timegm(
+                (int(day[:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0)
+            )
+        return day_epoch
+
+    def _open(self, timeframe: str, day: str, start: int, length: int, price: float, size: float) -> _Forming:
+        day_epoch = self._day_epoch(day)
+        bar = {
+            "T": "b", "S": self.symbol, "tf": timeframe,
+            "t": f"{day}T{start // 3600:02d}:{start // 60 % 60:02d}:{start % 60:02d}Z",
+            "o": price, "h": price, "l": price, "c": price, "v": size, "n": 1,
+        }
+        return _Forming(day, start, day_epoch + start + length, bar)
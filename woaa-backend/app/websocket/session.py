@@ -0,0 +1,342 @@
+"""
+Shared WebSocket session: separate reader and writer, bounded outbound queue.
+
+Handlers never await a socket send directly. They enqueue with `send()`, which
+never blocks, and a dedicated writer task drains the queue to the socket, so a
+slow client only ever delays itself. When the queue is full the session applies
+its overflow policy:
+
+- drop_oldest: discard the oldest queued message.
+- coalesce: a message sent with a `key` replaces the queued message with the
+  same key (keeping its place); otherwise the oldest message is dropped.
+- disconnect: close the socket with 1013 (try again later).
+
+Messages sent with `pinned=True` (state the client needs to read later
+messages, such as a binary symbol dictionary) are never dropped; the oldest
+unpinned message goes instead.
+
+Every session also runs a heartbeat: each WS_HEARTBEAT_SECONDS it queues
+{"type": "ping"}, and clients answer {"type": "pong"} (any inbound message
+counts as a sign of life). A session that hears nothing for
+WS_HEARTBEAT_TIMEOUT_SECONDS is reaped: the socket is closed with 1001 and the
+handler's pending receive raises WebSocketDisconnect, so its normal cleanup
+releases subscriptions and stops polling loops. Pongs never reach handlers.
+An interval of 0 disables the heartbeat.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from collections import deque
+from enum import Enum
+from typing import Any, Deque, Dict, Hashable, List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("WS_HEARTBEAT_TIMEOUT_SECONDS", "45"))
+
+PING = {"type": "ping"}
+
+Payload = Union[str, bytes, Dict[str, Any], List[Any]]
+
+
+class OverflowPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+_POLICY_ALIASES = {"drop": OverflowPolicy.DROP_OLDEST, "conflate": OverflowPolicy.COALESCE}
+
+
+def policy_from_env(name: str, default: OverflowPolicy) -> OverflowPolicy:
+    """
+    Read an overflow policy from environment variable `name`, falling back to `default`.
+    "drop" and "conflate" are accepted as aliases of drop_oldest and coalesce.
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    value = value.strip().lower()
+    if value in _POLICY_ALIASES:
+        return _POLICY_ALIASES[value]
+    try:
+        return OverflowPolicy(value)
+    except ValueError:
+        logger.warning("Invalid %s=%r, using %s", name, value, default.value)
+        return default
+
+
+def _is_pong(text: str) -> bool:
+    if "pong" not in text:
+        return False
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(message, dict) and message.get("type") == "pong"
+
+
+_sessions: "weakref.WeakSet[WebSocketSession]" = weakref.WeakSet()
+_closed_totals: Dict[str, Dict[str, int]] = {}
+
+
+def _empty_totals() -> Dict[str, int]:
+    return {"closed": 0, "reaped": 0, "sent": 0, "dropped": 0, "coalesced": 0, "overflow_disconnects": 0}
+
+
+class WebSocketSession:
+    """
+    Wraps an accepted WebSocket with a writer task and a bounded outbound queue.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        name: str,
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        heartbeat: Optional[float] = None,
+        heartbeat_timeout: Optional[float] = None,
+    ) -> None:
+        self.websocket = websocket
+        self.name = name
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self.heartbeat = HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+        self.heartbeat_timeout = HEARTBEAT_TIMEOUT_SECONDS if heartbeat_timeout is None else heartbeat_timeout
+        self.closed = False
+        self.started = False
+        self.reaped = False
+        self.last_seen = time.monotonic()
+
+        self._queue: Deque[List[Any]] = deque()  # entries are [key, payload, pinned]
+        self._keyed: Dict[Hashable, List[Any]] = {}
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._reaped: Optional[asyncio.Future] = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflow_disconnects = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def start(self) -> "WebSocketSession":
+        """
+        Start the writer task. Call once, after the socket has been accepted.
+        """
+        self._writer = asyncio.create_task(self._write_loop())
+        if self.heartbeat > 0:
+            self._reaped = asyncio.get_running_loop().create_future()
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        self.started = True
+        _sessions.add(self)
+        return self
+
+    def send(self, payload: Payload, key: Optional[Hashable] = None, pinned: bool = False) -> bool:
+        """
+        Queue `payload` (dict/list are JSON-encoded, str as text, bytes as binary).
+        A pinned payload is never dropped to make room.
+
+        Returns:
+            bool: False if the session is closed or the message was refused.
+        """
+        if self.closed:
+            return False
+
+        if key is not None and self.policy is OverflowPolicy.COALESCE:
+            entry = self._keyed.get(key)
+            if entry is not None:
+                entry[1] = payload
+                self.coalesced += 1
+                return True
+
+        if len(self._queue) >= self.max_queue:
+            if self.policy is OverflowPolicy.DISCONNECT:
+                self.overflow_disconnects += 1
+                logger.warning("[%s] Outbound queue full (%d), disconnecting slow client", self.name, self.max_queue)
+                asyncio.create_task(self.close(code=1013))
+                return False
+            self._drop_oldest()
+
+        entry = [key, payload, pinned]
+        self._queue.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+        if len(self._queue) > self.max_depth:
+            self.max_depth = len(self._queue)
+        self._ready.set()
+        return True
+
+    def _drop_oldest(self) -> None:
+        if not self._queue[0][2]:
+            entry = self._queue.popleft()
+        else:
+            entry = next((entry for entry in self._queue if not entry[2]), None)
+            if entry is None:
+                return  # only pinned messages queued: let the queue run over
+            self._queue.remove(entry)
+        if entry[0] is not None and self._keyed.get(entry[0]) is entry:
+            del self._keyed[entry[0]]
+        self.dropped += 1
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                while not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                entry = self._queue.popleft()
+                key, payload, _ = entry
+                if key is not None and self._keyed.get(key) is entry:
+                    del self._keyed[key]
+                await self._send_now(payload)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug("[%s] Writer stopped: %s", self.name, e)
+            self._mark_closed()
+
+    async def _send_now(self, payload: Payload) -> None:
+        if isinstance(payload, bytes):
+            await self.websocket.send_bytes(payload)
+        elif isinstance(payload, str):
+            await self.websocket.send_text(payload)
+        else:
+            await self.websocket.send_text(json.dumps(payload, separators=(",", ":")))
+
+    async def _heartbeat_loop(self) -> None:
+        while not self.closed:
+            await asyncio.sleep(self.heartbeat)
+            if time.monotonic() - self.last_seen > self.heartbeat_timeout:
+                await self._reap()
+                return
+            self.send(PING, key=PING["type"])
+
+    async def _reap(self) -> None:
+        logger.info("[%s] No heartbeat for %.0fs, reaping connection", self.name, time.monotonic() - self.last_seen)
+        self.reaped = True
+        await self.close(code=1001)
+        if not self._reaped.done():
+            self._reaped.set_result(None)
+
+    async def receive_text(self) -> str:
+        """
+        Read the next client text message, skipping pongs.
+
+        Raises:
+            WebSocketDisconnect: When the client goes away or the session is reaped.
+        """
+        while True:
+            if self._reaped is None:
+                text = await self.websocket.receive_text()
+            else:
+                receive = asyncio.ensure_future(self.websocket.receive_text())
+                try:
+                    await asyncio.wait((receive, self._reaped), return_when=asyncio.FIRST_COMPLETED)
+                except asyncio.CancelledError:
+                    receive.cancel()
+                    raise
+                if not receive.done():
+                    receive.cancel()
+                    raise WebSocketDisconnect(code=1001)
+                text = receive.result()
+            self.last_seen = time.monotonic()
+            if not _is_pong(text):
+                return text
+
+    async def receive_json(self) -> Any:
+        """
+        Read the next client message as JSON (raises WebSocketDisconnect on close).
+        """
+        return json.loads(await self.receive_text())
+
+    async def close(self, code: int = 1000) -> None:
+        """
+        Stop writing and close the socket.
+        """
+        if self.closed:
+            return
+        await self.finish()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Connection might already be closed
+
+    async def finish(self) -> None:
+        """
+        Stop the writer and release the queue; call when the handler exits.
+        """
+        self._mark_closed()
+        for task in (self._writer, self._heartbeat):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._writer = self._heartbeat = None
+
+    def _mark_closed(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._keyed.clear()
+        _sessions.discard(self)
+        if not self.started:
+            return
+        totals = _closed_totals.setdefault(self.name, _empty_totals())
+        totals["closed"] += 1
+        totals["reaped"] += self.reaped
+        totals["sent"] += self.sent
+        totals["dropped"] += self.dropped
+        totals["coalesced"] += self.coalesced
+        totals["overflow_disconnects"] += self.overflow_disconnects
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "policy": self.policy.value,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "capacity": self.max_queue,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+def session_metrics() -> Dict[str, Any]:
+    """
+    Queue-depth, overflow and reaped-connection counters per endpoint, for open and closed sessions.
+    """
+    endpoints: Dict[str, Dict[str, Any]] = {}
+    for name, totals in _closed_totals.items():
+        endpoints[name] = {"open": 0, "queued": 0, "max_depth": 0, **totals}
+
+    for session in list(_sessions):
+        stats = endpoints.setdefault(session.name, {"open": 0, "queued": 0, "max_depth": 0, **_empty_totals()})
+        stats["open"] += 1
+        stats["queued"] += session.depth
+        stats["max_depth"] = max(stats["max_depth"], session.max_depth)
+        stats["sent"] += session.sent
+        stats["dropped"] += session.dropped
+        stats["coalesced"] += session.coalesced
+        stats["overflow_disconnects"] += session.overflow_disconnects
+
+    return {"endpoints": endpoints}
@@ -0,0 +1,198 @@
+"""
+Pool of upstream Alpaca stream connections for the real-time manager.
+
+One IEX connection carries every symbol by default. Free-tier accounts cap
+how many symbols a connection may subscribe to, so MARKET_UPSTREAMS may list
+several connections (other API keys and/or feeds) as a JSON array:
+
+    [{"key": "...", "secret": "...", "feed": "iex", "max_symbols": 30}, ...]
+
+Missing `key` / `secret` fall back to ALPACA_API_KEY / ALPACA_SECRET_KEY,
+`url` to the feed's stream URL, and `max_symbols` to
+MARKET_UPSTREAM_MAX_SYMBOLS (0 = no cap).
+
+The pool only tracks placement: each (type, symbol) the manager wants
+upstream lives on exactly one connection, chosen as the least-loaded one with
+room under its cap. Keys of a connection that fails are evacuated and placed
+again elsewhere; keys that fit nowhere wait in `unplaced` until capacity frees
+up. Clients never see which connection serves a symbol, since every
+connection feeds the same fan-out.
+
+Each connection also carries its reconnect state: consecutive failures drive
+an exponential backoff with jitter, and a circuit breaker stops attempts for
+MARKET_RECONNECT_BREAKER_SECONDS after a 406 (connection limit) or after
+MARKET_RECONNECT_BREAKER_FAILURES failures in a row.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+ALPACA_STREAM_URL = "wss://stream.data.alpaca.markets/v2/{feed}"
+UPSTREAM_MAX_SYMBOLS = int(os.getenv("MARKET_UPSTREAM_MAX_SYMBOLS", "0"))
+RECONNECT_BASE_SECONDS = float(os.getenv("MARKET_RECONNECT_BASE_SECONDS", "0.5"))
+RECONNECT_MAX_SECONDS = float(os.getenv("MARKET_RECONNECT_MAX_SECONDS", "30"))
+RECONNECT_BREAKER_FAILURES = int(os.getenv("MARKET_RECONNECT_BREAKER_FAILURES", "8"))
+RECONNECT_BREAKER_SECONDS = float(os.getenv("MARKET_RECONNECT_BREAKER_SECONDS", "60"))
+
+Key = Tuple[str, str]
+
+
+class UpstreamConnection:
+    """
+    One Alpaca stream socket and the (type, symbol) keys placed on it.
+    """
+
+    def __init__(self, name: str, url: str, key: Optional[str], secret: Optional[str], max_symbols: int = 0) -> None:
+        self.name = name
+        self.url = url
+        self.key = key
+        self.secret = secret
+        self.max_symbols = max_symbols
+        self.ws = None
+        self.lock = asyncio.Lock()
+        self.symbols: Dict[str, Set[str]] = {"trades": set(), "bars": set()}
+        # Set when connecting fails (auth, connection limit, network); cleared on success.
+        self.failed = False
+        self.failures = 0
+        self.breaker_until = 0.0  # time.monotonic() before which no attempt is made
+        self.reconnecting = False
+        self.receive_task: Optional[asyncio.Task] = None
+        # Gap recovery: when the socket dropped, live batches held back while the
+        # gap is backfilled, and counters describing recoveries so far.
+        self.disconnected_at = None
+        self.held: Optional[List[Any]] = None
+        self.reconnects = 0
+        self.backfilled_bars = 0
+        self.backfill_failures = 0
+        self.last_recovery: Optional[Dict[str, Any]] = None
+
+    @property
+    def load(self) -> int:
+        return sum(len(symbols) for symbols in self.symbols.values())
+
+    def has_room(self) -> bool:
+        return self.max_symbols <= 0 or self.load < self.max_symbols
+
+    @property
+    def is_open(self) -> bool:
+        return self.ws is not None and self.ws.close_code is None
+
+    @property
+    def breaker_open(self) -> bool:
+        return time.monotonic() < self.breaker_until
+
+    def record_failure(self, trip: bool = False) -> None:
+        """
+        Count a failed attempt; `trip` (e.g. a 406) opens the breaker at once.
+        """
+        self.failed = True
+        self.failures += 1
+        if trip or self.failures >= RECONNECT_BREAKER_FAILURES:
+            self.breaker_until = time.monotonic() + RECONNECT_BREAKER_SECONDS
+            logger.warning("Circuit breaker open for %s for %.0fs", self.name, RECONNECT_BREAKER_SECONDS)
+
+    def record_success(self) -> None:
+        self.failed = False
+        self.failures = 0
+        self.breaker_until = 0.0
+
+    def next_delay(self) -> float:
+        """
+        Seconds to wait before the next attempt: exponential in the failure count, with jitter.
+        """
+        ceiling = min(RECONNECT_MAX_SECONDS, RECONNECT_BASE_SECONDS * 2 ** max(self.failures - 1, 0))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name, "url": self.url, "open": self.is_open, "failed": self.failed,
+            "load": self.load, "max_symbols": self.max_symbols,
+            "failures": self.failures, "breaker_open": self.breaker_open, "reconnects": self.reconnects,
+            "backfilled_bars": self.backfilled_bars, "backfill_failures": self.backfill_failures,
+            "last_recovery": self.last_recovery,
+        }
+
+
+def upstreams_from_env() -> List[UpstreamConnection]:
+    """
+    Connections configured by MARKET_UPSTREAMS, or the single default one.
+
+    Raises:
+        ValueError: If MARKET_UPSTREAMS is not a non-empty JSON array of objects.
+    """
+    key, secret = os.getenv("ALPACA_API_KEY"), os.getenv("ALPACA_SECRET_KEY")
+    raw = os.getenv("MARKET_UPSTREAMS", "").strip()
+    if not raw:
+        return [UpstreamConnection("upstream-0", ALPACA_STREAM_URL.format(feed="iex"), key, secret, UPSTREAM_MAX_SYMBOLS)]
+
+    specs = json.loads(raw)
+    if not isinstance(specs, list) or not specs or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError("MARKET_UPSTREAMS must be a non-empty JSON array of objects")
+    return [
+        UpstreamConnection(
+            spec.get("name", f"upstream-{i}"),
+            spec.get("url") or ALPACA_STREAM_URL.format(feed=spec.get("feed", "iex")),
+            spec.get("key", key),
+            spec.get("secret", secret),
+            int(spec.get("max_symbols", UPSTREAM_MAX_SYMBOLS)),
+        )
+        for i, spec in enumerate(specs)
+    ]
+
+
+class UpstreamPool:
+    def __init__(self, connections: List[UpstreamConnection]) -> None:
+        self.connections = connections
+        self.placement: Dict[Key, UpstreamConnection] = {}
+        # Keys wanted upstream that no connection currently has room for.
+        self.unplaced: Set[Key] = set()
+
+    def place(self, key: Key) -> Optional[UpstreamConnection]:
+        """
+        Put `key` on the least-loaded healthy connection with room.
+
+        Returns:
+            UpstreamConnection | None: Where it went, or None if it fits nowhere
+            (it is then kept in `unplaced`).
+        """
+        candidates = [conn for conn in self.connections if not conn.failed and conn.has_room()]
+        if not candidates:
+            self.unplaced.add(key)
+            return None
+        conn = min(candidates, key=lambda c: c.load)
+        self.placement[key] = conn
+        conn.symbols.setdefault(key[0], set()).add(key[1])
+        self.unplaced.discard(key)
+        return conn
+
+    def release(self, key: Key) -> Optional[UpstreamConnection]:
+        """
+        Forget `key`; returns the connection it was on, if any.
+        """
+        self.unplaced.discard(key)
+        conn = self.placement.pop(key, None)
+        if conn is not None:
+            conn.symbols[key[0]].discard(key[1])
+        return conn
+
+    def evacuate(self, conn: UpstreamConnection) -> List[Key]:
+        """
+        Take every key off `conn` and mark them unplaced, to be placed again.
+        """
+        keys = [(type_, symbol) for type_, symbols in conn.symbols.items() for symbol in symbols]
+        for key in keys:
+            del self.placement[key]
+        for symbols in conn.symbols.values():
+            symbols.clear()
+        self.unplaced.update(keys)
+        return keys
+
+    def status(self) -> Dict[str, Any]:
+        return {"connections": [conn.status() for conn in self.connections], "unplaced": len(self.unplaced)}
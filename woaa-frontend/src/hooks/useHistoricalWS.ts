@@ -13,8 +13,28 @@ type Bar = {
   v: number;
 };
 
+export type SubscribeOptions = {
+  // Bar count or market-time duration ("90m", "2h", "1d"); answered with one snapshot frame
+  lookback?: number | string;
+  // e.g. "5Min", "15Min", "1Hour"; defaults to "1Min"
+  timeframe?: string;
+  // Also push candles while their bucket is still open (default true)
+  forming?: boolean;
+  // Encoding of catch-up chunks for large backlogs; this hook reads JSON
+  catchup?: "json";
+};
+
+export type BarsMeta = {
+  timeframe: string;
+  snapshot: boolean;
+  // Part of a backlog burst; a message with catchupEnd follows the last chunk
+  catchup: boolean;
+  catchupEnd?: string;
+  forming?: Bar;
+};
+
 export function useHistoricalWS(
-  onBars?: (symbol: string, bars: Bar[]) => void
+  onBars?: (symbol: string, bars: Bar[], meta: BarsMeta) => void
 ) {
   const [connected, setConnected] = useState(false);
   const wsRef = useRef<WebSocket | null>(null);
@@ -40,10 +60,20 @@ export function useHistoricalWS(
     ws.onmessage = (event) => {
       try {
         const msg = JSON.parse(event.data);
+        if (msg.type === "ping") {
+          ws.send(JSON.stringify({ type: "pong" })); // heartbeat; silent clients are disconnected
+          return;
+        }
 
-        if (msg.symbol && Array.isArray(msg.bars)) {
+        if (msg.symbol && (Array.isArray(msg.bars) || msg.catchup_end)) {
           if (typeof onBars === "function") {
-            onBars(msg.symbol, msg.bars);
+            onBars(msg.symbol, msg.bars ?? [], {
+              timeframe: msg.timeframe ?? "1Min",
+              snapshot: msg.snapshot === true,
+              catchup: msg.catchup === true,
+              catchupEnd: msg.catchup_end,
+              forming: msg.forming,
+            });
           }
         } else if (msg.info) {
           console.log("ℹ️", msg.info);
@@ -70,7 +100,11 @@ export function useHistoricalWS(
   }, [onBars]);
 
   const sendMessage = useCallback(
-    (action: "subscribe" | "unsubscribe", symbol: string) => {
+    (
+      action: "subscribe" | "unsubscribe",
+      symbol: string,
+      options: SubscribeOptions = {}
+    ) => {
       const trimmed = symbol.trim().toUpperCase();
       if (!isValidSymbol(trimmed)) {
         console.warn("❌ Invalid symbol format:", symbol);
@@ -78,7 +112,9 @@ export function useHistoricalWS(
       }
 
       if (wsRef.current?.readyState === WebSocket.OPEN) {
-        wsRef.current.send(JSON.stringify({ action, symbol: trimmed }));
+        wsRef.current.send(
+          JSON.stringify({ action, symbol: trimmed, ...options })
+        );
       } else {
         console.warn("⚠️ WebSocket is not open; cannot send", {
           action,
@@ -91,13 +127,15 @@ export function useHistoricalWS(
 
   const subscribe = useCallback(
     //TODO: add log
-    (symbol: string) => sendMessage("subscribe", symbol),
+    (symbol: string, options?: SubscribeOptions) =>
+      sendMessage("subscribe", symbol, options),
     [sendMessage]
   );
 
   const unsubscribe = useCallback(
     //TODO: add log
-    (symbol: string) => sendMessage("unsubscribe", symbol),
+    (symbol: string, timeframe?: string) =>
+      sendMessage("unsubscribe", symbol, timeframe ? { timeframe } : {}),
     [sendMessage]
   );
 
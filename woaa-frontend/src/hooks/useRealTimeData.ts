@@ -1,20 +1,40 @@
 import { useEffect, useRef, useState, useCallback } from "react";
+import {
+  BINARY_SUBPROTOCOL,
+  JSON_SUBPROTOCOL,
+  decodeMarket,
+} from "../utils/marketCodec";
 
 // Valid US stock symbols: 1–5 uppercase letters (basic example)
 const isValidSymbol = (symbol: string) =>
   /^[A-Z]{1,5}$/.test(symbol.trim().toUpperCase());
 
-type SubscriptionType = "trades" | "bars";
+type SubscriptionType = "trades" | "bars" | "second_bars";
+// Sub-minute bars are built server-side from trades (type "second_bars").
+export type SecondTimeframe = "1Sec" | "5Sec" | "15Sec" | "30Sec";
 
 export function useRealTimeData(onMessage?: (msg: any) => void) {
   const [connected, setConnected] = useState(false);
   const wsRef = useRef<WebSocket | null>(null);
 
   useEffect(() => {
-    const ws = new WebSocket(
-      `${import.meta.env.VITE_API_URL.replace(/^http/, "ws")}/ws/market`
+    const token = localStorage.getItem("token");
+    if (!token) return;
+
+    const wsUrl = new URL(
+      import.meta.env.VITE_API_URL.replace(/^http/, "ws") + "/ws/market"
     );
+    wsUrl.searchParams.set("token", token);
+
+    // Prefer binary market frames (no JSON parsing per message); control
+    // messages such as pings and errors stay JSON text either way.
+    const ws = new WebSocket(wsUrl.toString(), [
+      BINARY_SUBPROTOCOL,
+      JSON_SUBPROTOCOL,
+    ]);
+    ws.binaryType = "arraybuffer";
     wsRef.current = ws;
+    const symbols = new Map<number, string>(); // this connection's symbol ids
 
     ws.onopen = () => {
       setConnected(true);
@@ -22,7 +42,18 @@ export function useRealTimeData(onMessage?: (msg: any) => void) {
     };
 
     ws.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        const items = decodeMarket(event.data, symbols);
+        if (items.length > 0 && typeof onMessage === "function") {
+          onMessage(items); // same item shape as the JSON stream
+        }
+        return;
+      }
       const data = JSON.parse(event.data);
+      if (data?.type === "ping") {
+        ws.send(JSON.stringify({ type: "pong" })); // heartbeat; silent clients are disconnected
+        return;
+      }
       if (typeof onMessage === "function") {
         onMessage(data);
       }
@@ -43,7 +74,13 @@ export function useRealTimeData(onMessage?: (msg: any) => void) {
   }, []);
 
   const sendMessage = useCallback(
-    (action: string, symbol?: string, type: SubscriptionType = "trades") => {
+    (
+      action: string,
+      symbol?: string,
+      type: SubscriptionType = "trades",
+      maxRate?: number,
+      timeframe?: SecondTimeframe
+    ) => {
       if (symbol && !isValidSymbol(symbol)) {
         console.warn("❌ Invalid symbol format:", symbol);
         return;
@@ -57,6 +94,13 @@ export function useRealTimeData(onMessage?: (msg: any) => void) {
         if (action !== "get_subscriptions") {
           msg.type = type;
         }
+        if (maxRate !== undefined) {
+          // Server conflates trades to at most maxRate messages/s (adds h, l, v, n)
+          msg.max_rate = maxRate;
+        }
+        if (timeframe !== undefined) {
+          msg.timeframe = timeframe;
+        }
         wsRef.current.send(JSON.stringify(msg));
       }
     },
@@ -65,16 +109,25 @@ export function useRealTimeData(onMessage?: (msg: any) => void) {
 
   const subscribe = useCallback(
     //TODO: add log
-    (symbol: string, type: SubscriptionType = "trades") => {
-      sendMessage("subscribe", symbol, type);
+    (
+      symbol: string,
+      type: SubscriptionType = "trades",
+      maxRate?: number,
+      timeframe?: SecondTimeframe
+    ) => {
+      sendMessage("subscribe", symbol, type, maxRate, timeframe);
     },
     [sendMessage]
   );
 
   const unsubscribe = useCallback(
     //TODO: add log
-    (symbol: string, type: SubscriptionType = "trades") => {
-      sendMessage("unsubscribe", symbol, type);
+    (
+      symbol: string,
+      type: SubscriptionType = "trades",
+      timeframe?: SecondTimeframe
+    ) => {
+      sendMessage("unsubscribe", symbol, type, undefined, timeframe);
     },
     [sendMessage]
   );
@@ -25,7 +25,9 @@ export function useSimTime() {
     socket.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        if (data.sim_time) {
+        if (data.type === "ping") {
+          socket.send(JSON.stringify({ type: "pong" })); // heartbeat; silent clients are disconnected
+        } else if (data.sim_time) {
           setSimTime(new Date(data.sim_time));
         }
       } catch (error) {
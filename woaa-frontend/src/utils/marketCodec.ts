@@ -0,0 +1,89 @@
+/**
+ * @fileoverview Decoder for the binary `/ws/market` subprotocol (see
+ * woaa-backend/app/websocket/codec.py). A frame is "WM" | version u8, then
+ * records until the end of the frame, each starting with a kind u8:
+ *
+ *   SYMBOL   kind | id u32 | length u8 | symbol (utf-8)
+ *   TRADE    kind | id u32 | t i64 (epoch ns) | p f64 | s f64
+ *   SUMMARY  kind | id u32 | t i64 | p s h l v f64 | n u32     (conflated trade)
+ *   BAR      kind | id u32 | t i64 | interval u16 (s) | flags u8 | o h l c v f64 | n u32 | vw f64
+ *
+ * All little endian. Decoded items have the same shape as the JSON stream's
+ * Alpaca-style items, so handlers don't care which encoding was negotiated.
+ */
+
+export const BINARY_SUBPROTOCOL = "woaa.market.binary.v1";
+export const JSON_SUBPROTOCOL = "woaa.market.json.v1";
+
+const MARKET_VERSION = 1;
+const KIND_SYMBOL = 1;
+const KIND_TRADE = 2;
+const KIND_SUMMARY = 3;
+const KIND_BAR = 4;
+const BAR_UPDATED = 0x01;
+const BAR_BACKFILL = 0x02;
+
+const textDecoder = new TextDecoder();
+
+const rfc3339 = (ns: bigint): string => {
+  const seconds = ns / 1_000_000_000n;
+  const fraction = ns % 1_000_000_000n;
+  const stamp = new Date(Number(seconds) * 1000).toISOString().slice(0, 19);
+  return fraction ? `${stamp}.${fraction.toString().padStart(9, "0")}Z` : `${stamp}Z`;
+};
+
+/**
+ * Decode one market frame into Alpaca-style items.
+ *
+ * @param data - The binary WebSocket message.
+ * @param symbols - The connection's id -> symbol dictionary; SYMBOL records update it.
+ * @throws Error if the frame is not a market frame of a known version.
+ */
+export function decodeMarket(data: ArrayBuffer, symbols: Map<number, string>): any[] {
+  const view = new DataView(data);
+  if (view.getUint8(0) !== 0x57 || view.getUint8(1) !== 0x4d || view.getUint8(2) !== MARKET_VERSION) {
+    throw new Error("Not a market frame");
+  }
+  const items: any[] = [];
+  let offset = 3;
+  while (offset < view.byteLength) {
+    const kind = view.getUint8(offset);
+    const id = view.getUint32(offset + 1, true);
+    if (kind === KIND_SYMBOL) {
+      const length = view.getUint8(offset + 5);
+      symbols.set(id, textDecoder.decode(new Uint8Array(data, offset + 6, length)));
+      offset += 6 + length;
+      continue;
+    }
+    const S = symbols.get(id);
+    const t = rfc3339(view.getBigInt64(offset + 5, true));
+    const f64 = (at: number) => view.getFloat64(offset + at, true);
+    if (kind === KIND_TRADE) {
+      items.push({ T: "t", S, t, p: f64(13), s: f64(21) });
+      offset += 29;
+    } else if (kind === KIND_SUMMARY) {
+      items.push({
+        T: "t", S, t, p: f64(13), s: f64(21), h: f64(29), l: f64(37), v: f64(45),
+        n: view.getUint32(offset + 53, true),
+      });
+      offset += 57;
+    } else if (kind === KIND_BAR) {
+      const interval = view.getUint16(offset + 13, true);
+      const flags = view.getUint8(offset + 15);
+      const item: any = {
+        T: flags & BAR_UPDATED ? "u" : "b", S, t,
+        o: f64(16), h: f64(24), l: f64(32), c: f64(40), v: f64(48),
+        n: view.getUint32(offset + 56, true),
+      };
+      const vw = f64(60);
+      if (!Number.isNaN(vw)) item.vw = vw;
+      if (interval !== 60) item.tf = `${interval}Sec`;
+      if (flags & BAR_BACKFILL) item.backfill = true;
+      items.push(item);
+      offset += 68;
+    } else {
+      throw new Error(`Unknown market record kind ${kind}`);
+    }
+  }
+  return items;
+}